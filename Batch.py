@@ -0,0 +1,114 @@
+import io
+import json
+import multiprocessing
+import os
+import time
+
+import Cache
+import Embed
+import Optimizer
+
+# === Batch runner ===
+# Runs many independent scripts over a pool of worker processes. Workers are
+# forked once with every module already imported and each run a stream of
+# scripts, so a script costs a parse and a run rather than an interpreter
+# start. Every script gets fresh globals of its own, and its print output is
+# captured rather than written to the terminal. Results come back in input
+# order however the scripts were scheduled. Budget limits keep a runaway
+# script from holding a worker forever.
+
+# Per-process settings, filled in by init_worker
+settings = {}
+
+
+def init_worker(engine='closure', optimize=False, use_cache=True, cache_dir=None,
+                limits=None):
+    settings['engine'] = engine
+    settings['optimize'] = optimize
+    settings['limits'] = limits
+    settings['cache'] = Cache.Cache(cache_dir) if use_cache else None
+
+
+def script_paths(paths):
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if name.endswith('.mylang'))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def run_script(path):
+    output = io.StringIO()
+    error = None
+    start = time.perf_counter()
+    try:
+        with open(path, 'r') as file:
+            code = file.read()
+        cache = settings['cache']
+        ast = cache.parse(path, code) if cache is not None else Cache.parse_source(code)
+        if settings['optimize']:
+            ast = Optimizer.optimize(ast)
+        Embed.Program(code, ast, settings['engine'], settings['limits']).run(output=output)
+    except FileNotFoundError:
+        error = f"File not found: {path}"
+    except Embed.ScriptError as e:
+        error = str(e)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    return {
+        'path': path,
+        'status': 0 if error is None else 1,
+        'seconds': time.perf_counter() - start,
+        'output': output.getvalue(),
+        'error': error,
+    }
+
+
+def run_batch(paths, jobs=None, engine='closure', optimize=False, use_cache=True,
+              cache_dir=None, limits=None):
+    scripts = script_paths(paths)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(scripts) or 1))
+    options = (engine, optimize, use_cache, cache_dir, limits)
+    start = time.perf_counter()
+    if jobs == 1:
+        init_worker(*options)
+        results = [run_script(path) for path in scripts]
+    else:
+        # fork keeps the workers' imports warm; elsewhere use the default
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        chunksize = max(1, len(scripts) // (jobs * 4))
+        with context.Pool(jobs, init_worker, options) as pool:
+            results = pool.map(run_script, scripts, chunksize)
+    return {
+        'engine': engine,
+        'jobs': jobs,
+        'seconds': time.perf_counter() - start,
+        'failed': sum(result['status'] != 0 for result in results),
+        'results': results,
+    }
+
+
+def format_report(report):
+    lines = []
+    for result in report['results']:
+        status = 'ok' if result['status'] == 0 else f"exit {result['status']}"
+        lines.append(f"=== {result['path']} [{status}] {result['seconds'] * 1000:.2f} ms")
+        if result['output']:
+            lines.append(result['output'].rstrip('\n'))
+        if result['error']:
+            lines.append(result['error'])
+    lines.append(f"--- {len(report['results'])} scripts, {report['failed']} failed, "
+                 f"{report['seconds'] * 1000:.2f} ms on {report['jobs']} "
+                 f"worker{'s' if report['jobs'] != 1 else ''} ({report['engine']})")
+    return "\n".join(lines)
+
+
+def main(paths, jobs=None, engine='closure', optimize=False, use_cache=True,
+         cache_dir=None, as_json=False, limits=None):
+    report = run_batch(paths, jobs, engine, optimize, use_cache, cache_dir, limits)
+    print(json.dumps(report, indent=2) if as_json else format_report(report))
+    return report
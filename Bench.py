@@ -0,0 +1,133 @@
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import time
+
+import Lexer
+import Optimizer
+import Parser
+
+# === Benchmarks ===
+# Times the lex, parse and evaluate phases of each workload separately. Every
+# repetition evaluates in a fresh environment; warmup runs are not recorded.
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+PHASES = ('lex', 'parse', 'evaluate')
+
+
+# A large program for lexer/parser throughput that also runs quickly
+def generated_source(blocks=2000):
+    parts = []
+    for i in range(blocks):
+        parts.append(
+            f"/* block {i} */\n"
+            f"int v{i} = {i} * 3 + {i % 7} - ({i} / 2);\n"
+            f"string s{i} = \"value \" + toString(v{i});\n"
+            f"if (v{i} > {i} && s{i} != \"\") {{\n"
+            f"    v{i} = v{i} - 1; // adjust\n"
+            f"}} else {{\n"
+            f"    v{i} = v{i} + 2;\n"
+            f"}}\n")
+    return "".join(parts)
+
+
+GENERATED = {
+    'generated-2k': lambda: generated_source(2000),
+    'generated-10k': lambda: generated_source(10000),
+}
+
+
+def default_workloads():
+    workloads = []
+    for name in sorted(os.listdir(BENCH_DIR)):
+        if name.endswith('.mylang'):
+            workloads.append((name, os.path.join(BENCH_DIR, name)))
+    workloads.extend(GENERATED.items())
+    return workloads
+
+
+def load(source):
+    if callable(source):
+        return source()
+    with open(source, 'r') as file:
+        return file.read()
+
+
+def summarize(samples):
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+    }
+
+
+def bench_source(name, code, make_env, repeat=5, warmup=1, optimize=False):
+    samples = {phase: [] for phase in PHASES}
+    tokens = ast = None
+    # Scripts print; keep that out of the terminal and off the timings' tail
+    with contextlib.redirect_stdout(io.StringIO()) as sink:
+        for run in range(warmup + repeat):
+            sink.seek(0)
+            sink.truncate()
+            start = time.perf_counter()
+            tokens = Lexer.tokenize(code)
+            lexed = time.perf_counter()
+            ast = Parser.Parser(tokens).parse()
+            if optimize:
+                ast = Optimizer.optimize(ast)
+            parsed = time.perf_counter()
+            make_env().evaluate(ast)
+            done = time.perf_counter()
+            if run >= warmup:
+                samples['lex'].append(lexed - start)
+                samples['parse'].append(parsed - lexed)
+                samples['evaluate'].append(done - parsed)
+    result = {
+        'name': name,
+        'bytes': len(code),
+        'tokens': len(tokens),
+        'statements': len(ast),
+    }
+    for phase in PHASES:
+        result[phase] = summarize(samples[phase])
+    result['total'] = sum(result[phase]['median'] for phase in PHASES)
+    return result
+
+
+def run_benchmarks(workloads, make_env, engine='', repeat=5, warmup=1, optimize=False):
+    results = []
+    for name, source in workloads:
+        results.append(bench_source(name, load(source), make_env, repeat, warmup, optimize))
+    return {
+        'engine': engine,
+        'optimize': optimize,
+        'repeat': repeat,
+        'warmup': warmup,
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+
+def format_table(report):
+    header = f"{'workload':<24}{'lex ms':>10}{'parse ms':>10}{'eval ms':>10}{'total ms':>10}"
+    lines = [f"engine: {report['engine']}  optimize: {report['optimize']}  "
+             f"repeat: {report['repeat']}  warmup: {report['warmup']}  (medians)",
+             header, '-' * len(header)]
+    for result in report['results']:
+        row = f"{result['name']:<24}"
+        for phase in PHASES:
+            row += f"{result[phase]['median'] * 1000:>10.2f}"
+        row += f"{result['total'] * 1000:>10.2f}"
+        lines.append(row)
+    return "\n".join(lines)
+
+
+def main(paths, make_env, engine='', repeat=5, warmup=1, optimize=False, as_json=False):
+    workloads = [(os.path.basename(path), path) for path in paths] or default_workloads()
+    report = run_benchmarks(workloads, make_env, engine, repeat, warmup, optimize)
+    print(json.dumps(report, indent=2) if as_json else format_table(report))
+    return report
@@ -0,0 +1,116 @@
+import time
+
+import Runtime
+
+# === Execution budgets ===
+# Opt-in limits for running untrusted or generated scripts. A step is one
+# loop iteration or one user function call; every non-terminating program
+# takes unboundedly many of them. Engines decrement Budget.countdown per
+# step and only call check() when it reaches zero, so the clock is read once
+# per INTERVAL steps. Call depth is tracked on every call, and the size of
+# strings, ints and arrays produced by '+', '*', array literals and the
+# array builtins is checked when a value limit is set. Limits apply to each
+# evaluate() separately: a console input, an Embed run or one script of a
+# batch.
+
+INTERVAL = 1024
+
+# Bytes an int may take before it counts against value_size
+INT_BYTES = 8
+
+
+class BudgetExceeded(Exception):
+    # resource is one of 'steps', 'time', 'value' and 'depth'
+    def __init__(self, resource, message):
+        super().__init__(message)
+        self.resource = resource
+
+
+class Budget:
+    def __init__(self, steps=None, seconds=None, value_size=None, depth=None,
+                 interval=INTERVAL, clock=time.perf_counter):
+        self.steps = steps            # loop iterations plus calls
+        self.seconds = seconds        # wall-clock time
+        self.value_size = value_size  # characters of a string, bytes of an int,
+                                      # elements of an array
+        self.max_depth = depth        # nested user function calls
+        self.interval = interval
+        self.clock = clock
+        # The array builtins engines call; with a value limit fill() checks
+        # the length before allocating and append() the grown array
+        self.array_builtins = Runtime.ARRAY_BUILTINS if value_size is None else dict(
+            Runtime.ARRAY_BUILTINS, fill=self.fill, append=self.append)
+        self.start()
+
+    def __repr__(self):
+        limits = [f"{name}={value}" for name, value in (
+            ('steps', self.steps), ('seconds', self.seconds),
+            ('value_size', self.value_size), ('depth', self.max_depth))
+            if value is not None]
+        return f"<budget {' '.join(limits) or 'unlimited'}>"
+
+    def start(self):
+        self.used = 0
+        self.depth = 0
+        self.deadline = None if self.seconds is None else self.clock() + self.seconds
+        self.countdown = self.next_countdown()
+
+    def next_countdown(self):
+        if self.steps is None:
+            return self.interval
+        return max(1, min(self.interval, self.steps - self.used + 1))
+
+    # Called when countdown reaches zero, i.e. after the steps it allowed
+    def check(self):
+        self.used += self.next_countdown() - self.countdown
+        if self.steps is not None and self.used > self.steps:
+            raise BudgetExceeded('steps', f"step limit of {self.steps} exceeded")
+        if self.deadline is not None and self.clock() > self.deadline:
+            raise BudgetExceeded('time', f"time limit of {self.seconds}s exceeded")
+        self.countdown = self.next_countdown()
+
+    def step(self):
+        self.countdown -= 1
+        if self.countdown <= 0:
+            self.check()
+
+    def enter(self):
+        self.step()
+        self.depth += 1
+        if self.max_depth is not None and self.depth > self.max_depth:
+            self.depth -= 1
+            raise BudgetExceeded('depth', f"call depth limit of {self.max_depth} exceeded")
+
+    def leave(self):
+        self.depth -= 1
+
+    def check_value(self, value):
+        if type(value) is str or type(value) is Runtime.StringBuilder:
+            if len(value) > self.value_size:
+                raise BudgetExceeded(
+                    'value', f"value size limit of {self.value_size} exceeded "
+                             f"(string of {len(value)} characters)")
+        elif type(value) is int and value.bit_length() > INT_BYTES * 8:
+            size = (value.bit_length() + 7) // 8
+            if size > self.value_size:
+                raise BudgetExceeded(
+                    'value', f"value size limit of {self.value_size} exceeded "
+                             f"(int of {size} bytes)")
+        elif isinstance(value, Runtime.Array):
+            self.check_length(len(value))
+        return value
+
+    def check_length(self, length):
+        if length > self.value_size:
+            raise BudgetExceeded(
+                'value', f"value size limit of {self.value_size} exceeded "
+                         f"(array of {length} elements)")
+
+    def fill(self, count, value):
+        if type(count) is int and type(value) in Runtime.ELEMENT_ARRAYS:
+            self.check_length(count)
+        return Runtime.array_fill(count, value)
+
+    def append(self, values, value):
+        Runtime.array_append(values, value)
+        self.check_length(len(values))
@@ -0,0 +1,450 @@
+import math
+from array import array
+
+import Checker
+import Resolver
+import Runtime
+
+# === Bytecode ===
+# Flat instruction encoding for the VM. Every instruction is two words,
+# (opcode, argument), stored in an array('i'); jump arguments are absolute
+# word offsets into the same buffer.
+
+LOAD_CONST = 0        # push consts[arg]
+LOAD_LOCAL = 1        # push slots[arg] as it is (see BytecodeCompiler.load)
+STORE_LOCAL = 2       # pop, convert to the slot's declared type, store
+DECL_LOCAL = 3        # pop, declare decls[arg] = (slot, type) in the frame
+LOAD_GLOBAL = 4       # same as the local variants, on global slots
+STORE_GLOBAL = 5
+DECL_GLOBAL = 6
+POP = 7
+DUP = 8
+ADD = 9
+SUB = 10
+MUL = 11
+DIV = 12
+NEG = 13
+NOT = 14
+JUMP_IF_TRUE_OR_POP = 15    # a || b: pc = arg keeping a when truthy, else pop
+JUMP_IF_FALSE_OR_POP = 16   # a && b: pc = arg keeping a when falsy, else pop
+EQ = 17
+NE = 18
+LE = 19
+GE = 20
+LT = 21
+GT = 22
+JUMP = 23             # pc = arg
+JUMP_IF_FALSE = 24    # pop, pc = arg when falsy
+CALL = 25             # calls[arg] = (name, argc), user function lookup
+CALL_BUILTIN = 26     # calls[arg] = (builtin, argc)
+MAKE_FUNCTION = 27    # register the function Code in consts[arg]
+RETURN_VALUE = 28     # arg is 1 for an explicit 'return' statement
+LOAD_OUTER = 29       # outers[arg] = (depth, slot, fallback) in an enclosing function
+STORE_OUTER = 30
+STORE_LOCAL_TYPED = 31   # pop and store a value that already has the slot's type
+STORE_GLOBAL_TYPED = 32
+INCR_LOCAL = 33       # updates[arg] = (slot, op, literal): x += literal in place
+INCR_GLOBAL = 34
+LOAD_LOCAL_STRING = 35   # push slots[arg], joining a Runtime.StringBuilder into a str
+LOAD_GLOBAL_STRING = 36
+APPEND_LOCAL = 37     # pop e and the raw slot value below it, slots[arg] += e
+APPEND_GLOBAL = 38
+BUILD_ARRAY = 39      # pop arg values, push Runtime.make_array of them
+INDEX = 40            # pop i and xs, push xs[i]
+STORE_INDEX = 41      # pop e, i and xs, xs[i] = e; push e back when arg is 1
+LOOP_IF_FALSE = 42    # JUMP_IF_FALSE that counts a budget step when the loop body runs
+
+OPNAMES = [
+    'LOAD_CONST',
+    'LOAD_LOCAL',
+    'STORE_LOCAL',
+    'DECL_LOCAL',
+    'LOAD_GLOBAL',
+    'STORE_GLOBAL',
+    'DECL_GLOBAL',
+    'POP',
+    'DUP',
+    'ADD',
+    'SUB',
+    'MUL',
+    'DIV',
+    'NEG',
+    'NOT',
+    'JUMP_IF_TRUE_OR_POP',
+    'JUMP_IF_FALSE_OR_POP',
+    'EQ',
+    'NE',
+    'LE',
+    'GE',
+    'LT',
+    'GT',
+    'JUMP',
+    'JUMP_IF_FALSE',
+    'CALL',
+    'CALL_BUILTIN',
+    'MAKE_FUNCTION',
+    'RETURN_VALUE',
+    'LOAD_OUTER',
+    'STORE_OUTER',
+    'STORE_LOCAL_TYPED',
+    'STORE_GLOBAL_TYPED',
+    'INCR_LOCAL',
+    'INCR_GLOBAL',
+    'LOAD_LOCAL_STRING',
+    'LOAD_GLOBAL_STRING',
+    'APPEND_LOCAL',
+    'APPEND_GLOBAL',
+    'BUILD_ARRAY',
+    'INDEX',
+    'STORE_INDEX',
+    'LOOP_IF_FALSE',
+]
+
+BINARY_OPS = {
+    '+': ADD,
+    '-': SUB,
+    '*': MUL,
+    '/': DIV,
+    '==': EQ,
+    '!=': NE,
+    '<=': LE,
+    '>=': GE,
+    '<': LT,
+    '>': GT
+}
+
+UNARY_OPS = {
+    '-': NEG,
+    '!': NOT
+}
+
+SHORT_CIRCUITS = {
+    '||': JUMP_IF_TRUE_OR_POP,
+    '&&': JUMP_IF_FALSE_OR_POP
+}
+
+# Heads of work-list entries in BytecodeCompiler.expr; AST nodes always
+# start with a string. (EMIT, opcode, arg) emits an instruction, (BRANCH,
+# opcode, label) a forward jump whose target (LABEL, label) fills in once
+# the code it skips has been emitted.
+EMIT = object()
+BRANCH = object()
+LABEL = object()
+
+
+class Code:
+    __slots__ = ('name', 'ops', 'consts', 'calls', 'decls', 'outers', 'fallbacks',
+                 'updates', 'local_names', 'params', 'return_type')
+
+    def __init__(self, name, params=(), return_type=None):
+        self.name = name
+        self.ops = array('i')
+        self.consts = []
+        self.calls = []
+        self.decls = []
+        self.outers = []
+        self.fallbacks = {}  # local slot -> fallback, see BytecodeCompiler.locate
+        self.updates = []
+        self.local_names = []
+        self.params = params  # [(slot, type_str)]
+        self.return_type = return_type
+
+    def __repr__(self):
+        return f"<code {self.name}>"
+
+    def disassemble(self, global_names=()):
+        lines = [f"{self.name}:"]
+        ops = self.ops
+        for pc in range(0, len(ops), 2):
+            op, arg = ops[pc], ops[pc + 1]
+            name = OPNAMES[op]
+            match name:
+                case 'LOAD_CONST' | 'MAKE_FUNCTION':
+                    detail = repr(self.consts[arg])
+                case ('LOAD_LOCAL' | 'STORE_LOCAL' | 'STORE_LOCAL_TYPED' | 'LOAD_LOCAL_STRING'
+                      | 'APPEND_LOCAL'):
+                    detail = self.local_names[arg]
+                case 'DECL_LOCAL':
+                    slot, type_str = self.decls[arg]
+                    detail = f"{type_str} {self.local_names[slot]}"
+                case 'DECL_GLOBAL':
+                    slot, type_str = self.decls[arg]
+                    detail = f"{type_str} {global_names[slot] if slot < len(global_names) else slot}"
+                case ('LOAD_GLOBAL' | 'STORE_GLOBAL' | 'STORE_GLOBAL_TYPED' | 'LOAD_GLOBAL_STRING'
+                      | 'APPEND_GLOBAL'):
+                    detail = global_names[arg] if arg < len(global_names) else str(arg)
+                case 'CALL' | 'CALL_BUILTIN':
+                    func, argc = self.calls[arg]
+                    detail = f"{getattr(func, '__name__', func)}/{argc}"
+                case 'LOAD_OUTER' | 'STORE_OUTER':
+                    depth, slot, _ = self.outers[arg]
+                    detail = f"{slot} (depth {depth})"
+                case 'INCR_LOCAL' | 'INCR_GLOBAL':
+                    slot, op_str, value = self.updates[arg]
+                    names = self.local_names if name == 'INCR_LOCAL' else global_names
+                    detail = f"{names[slot] if slot < len(names) else slot} {op_str}= {value!r}"
+                case 'JUMP' | 'JUMP_IF_FALSE' | 'LOOP_IF_FALSE' | 'JUMP_IF_TRUE_OR_POP' | 'JUMP_IF_FALSE_OR_POP':
+                    detail = f"-> {arg}"
+                case 'BUILD_ARRAY':
+                    detail = str(arg)
+                case _:
+                    detail = ''
+            lines.append(f"{pc:6} {name:<14} {detail}".rstrip())
+        for const in self.consts:
+            if isinstance(const, Code):
+                lines.append(const.disassemble(global_names))
+        return "\n".join(lines)
+
+
+class BytecodeCompiler:
+    # global_scope is the root Resolver.Scope. It outlives a single compile,
+    # so console input can keep referring to earlier declarations. types is
+    # Checker.TypeChecker.types for the statements being compiled.
+    def __init__(self, global_scope, types=None):
+        self.scope = global_scope
+        self.types = {} if types is None else types
+        self.code = None
+        self.const_index = None
+
+    def compile_program(self, statements):
+        return self.compile_code('<program>', statements, self.scope, (), None)
+
+    def compile_code(self, name, statements, scope, params, return_type):
+        outer = (self.code, self.scope, self.const_index)
+        self.scope = scope
+        self.code = Code(name, [(scope.declare(param_name), param_type)
+                                for param_type, param_name in params], return_type)
+        if not scope.is_global:
+            for local in Checker.declared_types(statements):
+                scope.declare(local)
+        self.const_index = {}
+        ops = []
+        self.block(ops, statements, True)
+        self.emit(ops, RETURN_VALUE)
+        code = self.code
+        code.ops = array('i', ops)
+        if not scope.is_global:
+            code.local_names = scope.names
+        self.code, self.scope, self.const_index = outer
+        return code
+
+    # Helpers
+
+    def emit(self, ops, op, arg=0):
+        ops.append(op)
+        ops.append(arg)
+        return len(ops) - 1
+
+    def const(self, value):
+        if isinstance(value, Code):
+            key = id(value)
+        elif type(value) is float:
+            # 0.0 == -0.0, but they print differently
+            key = (float, value, math.copysign(1.0, value))
+        else:
+            key = (type(value), value)
+        index = self.const_index.get(key)
+        if index is None:
+            index = len(self.code.consts)
+            self.code.consts.append(value)
+            self.const_index[key] = index
+        return index
+
+    # Resolves name to (depth, slot, is global, fallback). The fallback
+    # lists the slots to look the name up in while this one is UNSET (see
+    # Resolver.Scope.candidates) as (depth, slot), with depth None for a
+    # global; the VM finds it in code.fallbacks for locals and in the
+    # outers entry for variables of enclosing functions.
+    def locate(self, name):
+        scope = self.scope
+        (depth, slot), *candidates = scope.candidates(name)
+        fallback = [(None if scope.scope_at(outer).is_global else outer, outer_slot)
+                    for outer, outer_slot in candidates]
+        is_global = scope.scope_at(depth).is_global
+        if depth == 0 and not is_global:
+            self.code.fallbacks[slot] = fallback
+        return depth, slot, is_global, fallback
+
+    def access(self, ops, name, local_op, global_op, outer_op):
+        depth, slot, is_global, fallback = self.locate(name)
+        if is_global:
+            self.emit(ops, global_op, slot)
+        elif depth == 0:
+            self.emit(ops, local_op, slot)
+        else:
+            self.code.outers.append((depth, slot, fallback))
+            self.emit(ops, outer_op, len(self.code.outers) - 1)
+
+    # Loads join strings being built by APPEND_* into a str. A raw load
+    # pushes the slot as it is: for variables that are statically an int,
+    # float or bool, and for APPEND_* itself. LOAD_OUTER always joins.
+    def load(self, ops, name, raw=False):
+        if raw:
+            self.access(ops, name, LOAD_LOCAL, LOAD_GLOBAL, LOAD_OUTER)
+        else:
+            self.access(ops, name, LOAD_LOCAL_STRING, LOAD_GLOBAL_STRING, LOAD_OUTER)
+
+    def store(self, ops, name):
+        self.access(ops, name, STORE_LOCAL, STORE_GLOBAL, STORE_OUTER)
+
+    # Statements; keep=True leaves the statement's value on the stack
+
+    def block(self, ops, statements, keep):
+        if not statements:
+            if keep:
+                self.emit(ops, LOAD_CONST, self.const(None))
+            return
+        last = len(statements) - 1
+        for index, stmt in enumerate(statements):
+            self.statement(ops, stmt, keep and index == last)
+
+    def statement(self, ops, node, keep):
+        op = node[0] if isinstance(node, tuple) else None
+        match op:
+            case 'expr_stmt':
+                self.expr(ops, node[1])
+                if not keep:
+                    self.emit(ops, POP)
+            case 'return':
+                self.expr(ops, node[1])
+                self.emit(ops, RETURN_VALUE, 1)
+            case 'decl':
+                _, type_str, name, expr = node
+                self.expr(ops, expr)
+                if keep:
+                    self.emit(ops, DUP)
+                self.code.decls.append((self.scope.declare(name), type_str))
+                self.emit(ops, DECL_GLOBAL if self.scope.is_global else DECL_LOCAL,
+                          len(self.code.decls) - 1)
+            case 'assign':
+                name = node[1]
+                self.expr(ops, node[2])
+                target_type = self.types.get(id(node))
+                if target_type is not None and (
+                        Checker.static_type(self.types, node[2]) == target_type):
+                    self.access(ops, name, STORE_LOCAL_TYPED, STORE_GLOBAL_TYPED, STORE_OUTER)
+                else:
+                    self.store(ops, name)
+                if keep:
+                    self.load(ops, name)
+            case 'compound':
+                _, name, op_str, expr = node
+                depth, slot, is_global, _ = self.locate(name)
+                typed = self.types.get(id(node)) in ('int', 'float', 'bool')
+                if isinstance(expr, (int, float, str, bool)) and (depth == 0 or is_global):
+                    self.code.updates.append((slot, op_str, expr))
+                    self.emit(ops, INCR_GLOBAL if is_global else INCR_LOCAL,
+                              len(self.code.updates) - 1)
+                elif op_str == '+' and (depth == 0 or is_global):
+                    # Read before evaluating expr, like the assignment it
+                    # stands for; a string is read unjoined and appended to
+                    self.load(ops, name, raw=True)
+                    self.expr(ops, expr)
+                    self.emit(ops, APPEND_GLOBAL if is_global else APPEND_LOCAL, slot)
+                else:
+                    self.load(ops, name, raw=typed)
+                    self.expr(ops, expr)
+                    self.emit(ops, BINARY_OPS[op_str])
+                    self.store(ops, name)
+                if keep:
+                    self.load(ops, name, raw=typed)
+            case 'index_assign':
+                # The variable is read first, then the index, then the value
+                _, name, index, expr = node
+                self.load(ops, name)
+                self.expr(ops, index)
+                self.expr(ops, expr)
+                self.emit(ops, STORE_INDEX, 1 if keep else 0)
+            case 'func':
+                name, params, body = node[1], node[2], node[3]
+                return_type = node[4] if len(node) > 4 else None
+                code = self.compile_code(name, body, Resolver.Scope(self.scope),
+                                         params, return_type)
+                self.emit(ops, MAKE_FUNCTION, self.const(code))
+                if keep:
+                    self.emit(ops, LOAD_CONST, self.const(f"<function {name}>"))
+            case 'if':
+                self.expr(ops, node[1])
+                to_else = self.emit(ops, JUMP_IF_FALSE)
+                self.block(ops, node[2], keep)
+                to_end = self.emit(ops, JUMP)
+                ops[to_else] = len(ops)
+                if len(node) > 3:
+                    self.block(ops, node[3], keep)
+                elif keep:
+                    self.emit(ops, LOAD_CONST, self.const(None))
+                ops[to_end] = len(ops)
+            case 'while':
+                start = len(ops)
+                self.expr(ops, node[1])
+                to_end = self.emit(ops, LOOP_IF_FALSE)
+                self.block(ops, node[2], False)
+                self.emit(ops, JUMP, start)
+                ops[to_end] = len(ops)
+                if keep:
+                    self.emit(ops, LOAD_CONST, self.const(None))
+            case _:
+                self.expr(ops, node)
+                if not keep:
+                    self.emit(ops, POP)
+
+    # Expressions always leave exactly one value on the stack. Operators and
+    # call arguments go through an explicit work list rather than Python
+    # recursion, so expression depth is only limited by memory; EMIT entries
+    # are instructions whose operands have already been queued.
+
+    def expr(self, ops, node):
+        work = [node]
+        while work:
+            node = work.pop()
+            if isinstance(node, list):
+                self.block(ops, node, True)
+                continue
+            if isinstance(node, (int, float, str, bool, type(None))):
+                self.emit(ops, LOAD_CONST, self.const(node))
+                continue
+            if not isinstance(node, tuple):
+                raise TypeError(f"Invalid AST node: {node}")
+            op = node[0]
+            if op is EMIT:
+                self.emit(ops, node[1], node[2])
+            elif op is BRANCH:
+                node[2].append(self.emit(ops, node[1]))
+            elif op is LABEL:
+                ops[node[1].pop()] = len(ops)
+            elif op in SHORT_CIRCUITS:
+                label = []
+                work.append((LABEL, label))
+                work.append(node[2])
+                work.append((BRANCH, SHORT_CIRCUITS[op], label))
+                work.append(node[1])
+            elif op in UNARY_OPS and len(node) == 2:
+                work.append((EMIT, UNARY_OPS[op], 0))
+                work.append(node[1])
+            elif op in BINARY_OPS:
+                work.append((EMIT, BINARY_OPS[op], 0))
+                work.append(node[2])
+                work.append(node[1])
+            elif op == 'var':
+                self.load(ops, node[1], Checker.static_type(self.types, node)
+                          in ('int', 'float', 'bool'))
+            elif op == 'array':
+                work.append((EMIT, BUILD_ARRAY, len(node[1])))
+                work.extend(reversed(node[1]))
+            elif op == 'index':
+                work.append((EMIT, INDEX, 0))
+                work.append(node[2])
+                work.append(node[1])
+            elif op == 'call':
+                func_name, args = node[1], node[2]
+                builtin = Runtime.BUILTINS.get(func_name)
+                self.code.calls.append(
+                    (builtin if builtin is not None else func_name, len(args)))
+                work.append((EMIT, CALL_BUILTIN if builtin is not None else CALL,
+                             len(self.code.calls) - 1))
+                work.extend(reversed(args))
+            elif op in ('expr_stmt', 'decl', 'assign', 'compound', 'index_assign', 'func',
+                        'return', 'if', 'while'):
+                self.statement(ops, node, True)
+            else:
+                raise TypeError(f"Invalid AST node: {node}")
@@ -0,0 +1,147 @@
+import hashlib
+import marshal
+import os
+import sys
+
+import Lexer
+import Parser
+
+# === AST cache ===
+# Stores the parsed program next to the script (or in a cache directory),
+# like __pycache__, so repeated runs of an unchanged file skip lexing and
+# parsing. An entry is only used when both the source hash and the
+# interpreter tag match; anything else is a miss and gets rewritten. The
+# python engine's compiled modules are kept the same way, keyed by the
+# generated source, so they skip Python's compile(). Its ASTs are cached
+# with their source lines, which the generated module keeps.
+
+CACHE_DIR_NAME = '__mylangcache__'
+MAGIC = 'mylang-ast-1'
+
+
+# Changes whenever the lexer or parser source (and therefore the AST shape)
+# or the Python version (and therefore the marshal format) changes
+def interpreter_tag():
+    digest = hashlib.sha256(sys.version.encode())
+    for module in (Lexer, Parser):
+        with open(module.__file__, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def parse_source(code):
+    return Parser.Parser(Lexer.iter_tokens(code)).parse()
+
+
+# Every node of an AST, in the same order for an AST and its unmarshalled copy
+def walk_nodes(ast):
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            yield node
+        if isinstance(node, (tuple, list)):
+            stack.extend(node)
+
+
+class Cache:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.tag = interpreter_tag()
+        self.hits = 0
+        self.misses = 0
+        self.events = []  # (path, 'hit' | 'miss', reason)
+
+    # kind is 'ast', or 'pyc' for a compiled python engine module
+    def entry_path(self, source_path, kind='ast'):
+        name = os.path.basename(source_path)
+        if self.cache_dir is None:
+            return os.path.join(os.path.dirname(os.path.abspath(source_path)),
+                                CACHE_DIR_NAME, f"{name}.{kind}")
+        # One shared directory: keep same-named scripts apart
+        where = hashlib.sha256(os.path.abspath(source_path).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}.{where}.{kind}")
+
+    def load(self, source_path, digest, kind='ast'):
+        try:
+            with open(self.entry_path(source_path, kind), 'rb') as file:
+                magic, tag, source_digest, payload = marshal.loads(file.read())
+        except FileNotFoundError:
+            return None, 'no entry'
+        except (OSError, EOFError, ValueError, TypeError):
+            return None, 'unreadable entry'
+        if magic != MAGIC or tag != self.tag:
+            return None, 'interpreter changed'
+        if source_digest != digest:
+            return None, 'source changed'
+        return payload, None
+
+    # Write failures (read-only directories, ASTs too deep for marshal) only
+    # cost the next run a re-parse, so they are not errors
+    def store(self, source_path, digest, payload, kind='ast'):
+        path = self.entry_path(source_path, kind)
+        temp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp, 'wb') as file:
+                file.write(marshal.dumps((MAGIC, self.tag, digest, payload)))
+            os.replace(temp, path)
+        except (OSError, ValueError):
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+    def parse(self, source_path, code):
+        digest = hashlib.sha256(code.encode()).hexdigest()
+        ast, reason = self.load(source_path, digest)
+        if ast is not None:
+            self.hits += 1
+            self.events.append((source_path, 'hit', None))
+            return ast
+        self.misses += 1
+        self.events.append((source_path, 'miss', reason))
+        ast = parse_source(code)
+        self.store(source_path, digest, ast)
+        return ast
+
+    # Like parse, but also fills locations ({id(node): line}) the way
+    # Parser.LocatingParser does. Node ids do not outlive the process, so
+    # the lines are stored in walk_nodes order.
+    def parse_located(self, source_path, code, locations):
+        digest = hashlib.sha256(code.encode()).hexdigest()
+        payload, reason = self.load(source_path, digest, 'located')
+        if payload is not None:
+            self.hits += 1
+            self.events.append((source_path, 'hit', None))
+            ast, lines = payload
+            for node, line in zip(walk_nodes(ast), lines):
+                if line:
+                    locations.setdefault(id(node), line)
+            return ast
+        self.misses += 1
+        self.events.append((source_path, 'miss', reason))
+        ast = Parser.LocatingParser(Lexer.iter_tokens(code), locations).parse()
+        lines = [locations.get(id(node), 0) for node in walk_nodes(ast)]
+        self.store(source_path, digest, (ast, lines), 'located')
+        return ast
+
+    # Code object for a Transpiler.Module generated from source_path
+    def compile_module(self, source_path, module):
+        digest = hashlib.sha256(f"{module.filename}\n{module.source}".encode()).hexdigest()
+        code, reason = self.load(source_path, digest, 'pyc')
+        if code is not None:
+            self.hits += 1
+            self.events.append((source_path, 'hit', 'python module'))
+            return code
+        self.misses += 1
+        self.events.append((source_path, 'miss', f"python module, {reason}"))
+        code = compile(module.source, module.filename, 'exec')
+        self.store(source_path, digest, code, 'pyc')
+        return code
+
+    def report(self):
+        lines = [f"cache {event}: {path}" + (f" ({reason})" if reason else '')
+                 for path, event, reason in self.events]
+        lines.append(f"cache hits: {self.hits}, misses: {self.misses}")
+        return "\n".join(lines)
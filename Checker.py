@@ -0,0 +1,377 @@
+import Runtime
+
+# === Static type checker ===
+# Infers the type of every expression from literals and the declared types
+# of variables, parameters and conversion builtins. The compiled engines use
+# the result to skip conversions and type checks that cannot fail. It also
+# reports operations that are certain to raise whenever they run.
+#
+# A static type is one of Runtime.CONVERTERS' names and means "a value of
+# exactly that Python type, or None"; None as a static type means unknown.
+# Names are resolved like Resolver.Scope.candidates resolves them: a use
+# may find any enclosing declaration of the name, up to one that has
+# certainly run by then (a parameter, or a declaration earlier in a block
+# around the use), or else the global. A variable is typed when all of
+# those declarations agree:
+# - function locals and parameters, whose declarations are all in the body;
+# - globals already declared at runtime, whose type can no longer change;
+# - from top-level code only, globals declared by the program itself.
+#   Functions may outlive the program and see later declarations, so they
+#   leave those globals unknown.
+# User function results are unknown, because a name can be redefined with a
+# different return type at any time.
+
+STATIC_TYPES = {
+    bool: 'bool',
+    int: 'int',
+    float: 'float',
+    str: 'string',
+    Runtime.IntArray: 'int[]',
+    Runtime.FloatArray: 'float[]'
+}
+
+# Python type names, as used in runtime error messages
+PY_NAMES = {
+    'bool': 'bool',
+    'int': 'int',
+    'float': 'float',
+    'string': 'str',
+    'int[]': 'IntArray',
+    'float[]': 'FloatArray'
+}
+
+# Array type -> element type
+ELEMENT_TYPES = {
+    'int[]': 'int',
+    'float[]': 'float'
+}
+
+# Types indexing produces
+INDEX_TYPES = {
+    'int[]': 'int',
+    'float[]': 'float',
+    'string': 'string'
+}
+
+BUILTIN_TYPES = {
+    'toInt': 'int',
+    'toString': 'string',
+    'toFloat': 'float'
+}
+
+ORDERING = ('<', '>', '<=', '>=')
+
+COUNTED_COMPARISONS = ('<', '<=', '>', '>=', '!=')
+
+
+def literal_type(node):
+    return STATIC_TYPES.get(type(node))
+
+
+# Static type of node given a TypeChecker.types table
+def static_type(types, node):
+    if isinstance(node, tuple):
+        return types.get(id(node))
+    return STATIC_TYPES.get(type(node))
+
+
+# Type of an array literal whose elements have the static types in items
+def array_type(items):
+    kinds = {item_type for item_type, maybe_none in items}
+    if any(maybe_none for _, maybe_none in items):
+        return None
+    if kinds <= {'int'}:
+        return 'int[]'
+    if kinds == {'float'}:
+        return 'float[]'
+    return None
+
+
+# Result of an elementwise operator on an array and an array or scalar
+def elementwise_type(lt, rt):
+    result = lt if lt in ELEMENT_TYPES else rt
+    if lt in (result, ELEMENT_TYPES[result]) and rt in (result, ELEMENT_TYPES[result]):
+        return result
+    return None
+
+
+class StaticError:
+    __slots__ = ('statement', 'kind', 'message')
+
+    def __init__(self, statement, kind, message):
+        self.statement = statement
+        self.kind = kind
+        self.message = message
+
+    def __repr__(self):
+        return f"{self.kind}: {self.message}"
+
+
+class FunctionScope:
+    __slots__ = ('parent', 'certain', 'types')
+
+    def __init__(self, parent, types):
+        self.parent = parent
+        self.certain = set()  # names certainly declared at this point
+        self.types = types    # name -> {declared type, ...}
+
+
+# Declared types of the names a body declares, not counting nested functions
+def declared_types(statements, types=None):
+    types = {} if types is None else types
+    stack = [statements]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, tuple):
+            match node[0]:
+                case 'decl':
+                    types.setdefault(node[2], set()).add(node[1])
+                case 'if':
+                    stack.extend(node[2:])
+                case 'while':
+                    stack.append(node[2])
+    return types
+
+
+def single(types):
+    if types is not None and len(types) == 1:
+        (type_str,) = types
+        if type_str in Runtime.CONVERTERS:
+            return type_str
+    return None
+
+
+# Shape of a counted loop, while (i <cmp> bound) { ...; i += k; } with k an
+# int literal and i not declared in the body, so i names the same variable
+# for the whole loop. Returns (name, comparison, bound, body without the
+# step, step) or None.
+def counted_loop(node):
+    condition, body = node[1], node[2]
+    if not (body and isinstance(condition, tuple) and len(condition) == 3
+            and condition[0] in COUNTED_COMPARISONS
+            and isinstance(condition[1], tuple) and condition[1][0] == 'var'):
+        return None
+    name = condition[1][1]
+    step = body[-1]
+    if not (isinstance(step, tuple) and step[0] == 'compound'
+            and step[1] == name and type(step[3]) is int):
+        return None
+    if name in declared_types(body):
+        return None
+    return name, condition[0], condition[2], body[:-1], step
+
+
+class TypeChecker:
+    # global_types: {name: type} of globals already declared at runtime, or
+    # a view with the same get(), e.g. Resolver.SlotTypes
+    def __init__(self, global_types=None):
+        self.global_types = global_types if global_types is not None else {}
+        self.program_types = {}
+        self.scope = None
+        self.statement = None
+        self.types = {}   # id(expression node) -> static type
+        self.errors = []  # StaticError, in source order
+
+    def check(self, node):
+        statements = node if isinstance(node, list) else [node]
+        self.program_types = declared_types(statements)
+        self.block(statements)
+        return self
+
+    def resolve(self, name):
+        found = set()
+        scope = self.scope
+        while scope is not None:
+            types = scope.types.get(name)
+            if types is not None:
+                found |= types
+                if name in scope.certain:
+                    return single(found)
+            scope = scope.parent
+        global_type = self.global_types.get(name)
+        if global_type is None and self.scope is None:
+            global_type = single(self.program_types.get(name))
+        if global_type is None:
+            return None
+        found.add(global_type)
+        return single(found)
+
+    def error(self, kind, message):
+        self.errors.append(StaticError(self.statement, kind, message))
+
+    # Statements
+
+    def block(self, statements):
+        for stmt in statements:
+            outer = self.statement
+            self.statement = stmt
+            self.visit(stmt)
+            self.statement = outer
+
+    # An if or while body: declarations in it are not certain after it
+    def inner_block(self, statements):
+        if self.scope is None:
+            return self.block(statements)
+        certain = set(self.scope.certain)
+        self.block(statements)
+        self.scope.certain = certain
+
+    def visit(self, node):
+        if not isinstance(node, tuple):
+            return self.expr(node)
+        match node[0]:
+            case 'expr_stmt' | 'return':
+                self.expr(node[1])
+            case 'decl':
+                _, type_str, name, expr = node
+                value_type, maybe_none = self.expr(expr)
+                expected = Runtime.DECL_TYPES.get(type_str)
+                if (expected is not None and value_type is not None and not maybe_none
+                        and not issubclass(Runtime.CONVERTERS[value_type], expected)):
+                    self.error('RuntimeError',
+                               f"Expected {type_str}, got {PY_NAMES[value_type]}")
+                if self.scope is not None:
+                    self.scope.certain.add(name)
+            case 'assign':
+                self.expr(node[2])
+                target = self.resolve(node[1])
+                if target is not None:
+                    self.types[id(node)] = target
+            case 'index_assign':
+                self.expr(node[2])
+                self.expr(node[3])
+            case 'compound':
+                _, name, op, expr = node
+                target = self.resolve(name)
+                self.binary(op, (op, ('var', name), expr), (target, True), self.expr(expr))
+                if target is not None:
+                    self.types[id(node)] = target
+            case 'func':
+                params = node[2]
+                types = declared_types(node[3])
+                for param_type, param_name in params:
+                    types.setdefault(param_name, set()).add(param_type)
+                outer = self.scope
+                self.scope = FunctionScope(outer, types)
+                self.scope.certain.update(param_name for _, param_name in params)
+                self.block(node[3])
+                self.scope = outer
+            case 'if':
+                self.expr(node[1])
+                self.inner_block(node[2])
+                if len(node) > 3:
+                    self.inner_block(node[3])
+            case 'while':
+                self.expr(node[1])
+                self.inner_block(node[2])
+            case _:
+                self.expr(node)
+
+    # Expressions, bottom-up with an explicit stack like Optimizer.expr.
+    # Each value is (static type, may be None).
+
+    def expr(self, node):
+        work = [(node, False)]
+        values = []
+        while work:
+            node, ready = work.pop()
+            if not isinstance(node, tuple):
+                values.append((literal_type(node), node is None))
+                continue
+            op = node[0]
+            if op == 'var':
+                var_type = self.resolve(node[1])
+                if var_type is not None:
+                    self.types[id(node)] = var_type
+                values.append((var_type, True))
+                continue
+            if op == 'call' or op == 'array':
+                operands = node[2] if op == 'call' else node[1]
+            elif op == 'index':
+                operands = node[1:]
+            elif op in Runtime.BINARY and len(node) == 3 or op in Runtime.UNARY and len(node) == 2:
+                operands = node[1:]
+            else:
+                # Statements used as expressions only come from list nodes
+                self.visit(node)
+                values.append((None, True))
+                continue
+            if not ready:
+                work.append((node, True))
+                work.extend((operand, False) for operand in reversed(operands))
+                continue
+            args = values[len(values) - len(operands):]
+            del values[len(values) - len(operands):]
+            if op == 'call':
+                result = (BUILTIN_TYPES.get(node[1]), node[1] not in BUILTIN_TYPES)
+            elif op == 'array':
+                result = (array_type(args), False)
+            elif op == 'index':
+                result = (INDEX_TYPES.get(args[0][0]), False)
+            elif len(node) == 3:
+                result = self.binary(op, node, *args)
+            else:
+                result = self.unary(op, *args)
+            if result[0] is not None:
+                self.types[id(node)] = result[0]
+            values.append(result)
+        return values[0]
+
+    def binary(self, op, node, left, right):
+        (lt, ln), (rt, rn) = left, right
+        if op in ('+', '-', '*', '/') and (lt in ELEMENT_TYPES or rt in ELEMENT_TYPES):
+            return elementwise_type(lt, rt), False
+        if op in ('+', '-', '*'):
+            if lt is None or rt is None:
+                return None, False
+            # 'a - b' with b None is unary minus on a, so it may not fail
+            certain = not (op == '-' and rn)
+            if lt != rt:
+                if certain:
+                    self.error('TypeError',
+                               f"Type mismatch for '{op}': {PY_NAMES[lt]} and {PY_NAMES[rt]}")
+                return None, False
+            if lt == 'bool':
+                return 'int', False
+            if lt == 'string' and op != '+':
+                if certain:
+                    self.error('TypeError', f"Unsupported operand type for '{op}': str")
+                return None, False
+            return lt, False
+        if op == '/':
+            if (lt in ('int', 'float', 'bool') and not ln
+                    and type(node[2]) in (int, float, bool) and node[2] == 0):
+                self.error('ZeroDivisionError', 'division by zero')
+            if lt is None or rt is None:
+                return None, False
+            if lt == 'string' or rt == 'string':
+                self.error('TypeError', f"Unsupported operand type for '/': "
+                                        f"{PY_NAMES[lt]} and {PY_NAMES[rt]}")
+                return None, False
+            if lt in ('int', 'bool') and rt in ('int', 'bool'):
+                return 'int', False
+            return 'float', False
+        if op in ('&&', '||'):
+            return (lt if lt == rt else None), ln or rn
+        if op in ORDERING and lt is not None and rt is not None and (
+                (lt == 'string') != (rt == 'string')):
+            self.error('TypeError', f"'{op}' not supported between instances of "
+                                    f"'{PY_NAMES[lt]}' and '{PY_NAMES[rt]}'")
+        return 'bool', False
+
+    def unary(self, op, operand):
+        if op == '!':
+            return 'bool', False
+        value_type = operand[0]
+        if value_type == 'string':
+            self.error('TypeError', "Unsupported operand type for unary '-': str")
+            return None, False
+        if value_type == 'bool':
+            return 'int', False
+        return value_type, False
+
+
+def check(ast, global_types=None):
+    return TypeChecker(global_types).check(ast)
@@ -0,0 +1,873 @@
+import operator
+
+import Checker
+import Output
+import Resolver
+import Runtime
+from Resolver import UNSET
+
+# === Closure compiler ===
+# Turns the Parser AST into a tree of prebuilt closures once per program, so
+# execution no longer re-dispatches on node shape and operator strings. Every
+# closure takes the executing Frame and returns the node's value. Variables
+# are resolved to (depth, slot) pairs at compile time by Resolver.Scope.
+
+
+class Returned:
+    def __repr__(self):
+        return '<returned>'
+
+
+# Completion record for 'return': the statement stores its value in
+# frame.result and hands RETURNED back up through the enclosing blocks and
+# loops, which stop as soon as they see it.
+RETURNED = Returned()
+
+COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '!=': operator.ne
+}
+
+
+def may_return(node):
+    if not isinstance(node, tuple):
+        return False
+    match node[0]:
+        case 'return':
+            return True
+        case 'if':
+            return any(map(may_return, node[2])) or (
+                len(node) > 3 and any(map(may_return, node[3])))
+        case 'while':
+            return any(map(may_return, node[2]))
+    return False
+
+
+class Frame:
+    __slots__ = ('values', 'types', 'parent', 'result')
+
+    def __init__(self, size, parent=None):
+        self.values = [UNSET] * size
+        self.types = [None] * size
+        self.parent = parent
+
+
+class Function:
+    __slots__ = ('name', 'params', 'body', 'return_type', 'size', 'parent')
+
+    def __init__(self, name, params, body, return_type, size, parent):
+        self.name = name
+        self.params = params  # [(slot, type_str)]
+        self.body = body
+        self.return_type = return_type
+        self.size = size
+        self.parent = parent
+
+    def __repr__(self):
+        return f"<function {self.name}>"
+
+
+class Compiler:
+    def __init__(self, env):
+        self.env = env
+        self.scope = env.scope
+        self.types = {}  # Checker.TypeChecker.types for the program being compiled
+        self.handlers = {
+            '+': self.arithmetic,
+            '-': self.arithmetic,
+            '*': self.arithmetic,
+            '/': self.arithmetic,
+            '||': self.binary,
+            '&&': self.binary,
+            '==': self.binary,
+            '!=': self.binary,
+            '<=': self.binary,
+            '>=': self.binary,
+            '<': self.binary,
+            '>': self.binary,
+            '!': self.logical_not,
+            'expr_stmt': self.expr_stmt,
+            'decl': self.decl,
+            'assign': self.assign,
+            'compound': self.compound,
+            'var': self.var,
+            'array': self.array,
+            'index': self.index,
+            'index_assign': self.index_assign,
+            'call': self.call,
+            'func': self.func,
+            'return': self.return_stmt,
+            'if': self.if_stmt,
+            'while': self.while_stmt,
+        }
+        budget = env.budget
+        if budget is not None and budget.value_size is not None:
+            for op in ('+', '*', 'compound', 'array'):
+                self.handlers[op] = self.sized(self.handlers[op])
+
+    def compile(self, node):
+        if isinstance(node, list):
+            return self.block(node)
+        if isinstance(node, (int, float, str, bool, type(None))):
+            return self.constant(node)
+        if isinstance(node, tuple) and node[0] in self.handlers:
+            return self.handlers[node[0]](node)
+        raise TypeError(f"Invalid AST node: {node}")
+
+    def block(self, statements):
+        steps = [self.compile(stmt) for stmt in statements]
+        if not steps:
+            return self.constant(None)
+        if len(steps) == 1:
+            return steps[0]
+        if any(map(may_return, statements)):
+            def run_returning_block(frame):
+                result = None
+                for step in steps:
+                    result = step(frame)
+                    if result is RETURNED:
+                        break
+                return result
+            return run_returning_block
+
+        def run_block(frame):
+            result = None
+            for step in steps:
+                result = step(frame)
+            return result
+        return run_block
+
+    def static_type(self, node):
+        return Checker.static_type(self.types, node)
+
+    def constant(self, value):
+        def run_constant(frame):
+            return value
+        return run_constant
+
+    # Variable access
+
+    # Returns (globals frame, None, slot) for globals, otherwise
+    # (None, depth, slot) with depth counted in frame.parent hops.
+    def locate(self, name, declare=False):
+        if declare:
+            slot = self.scope.declare(name)
+            depth = 0
+        else:
+            depth, slot = self.scope.resolve(name)
+        if self.scope.scope_at(depth).is_global:
+            return self.env.frame, None, slot
+        return None, depth, slot
+
+    def frame_getter(self, name, declare=False):
+        global_frame, depth, slot = self.locate(name, declare)
+        return self.frame_at(global_frame, depth), slot
+
+    def frame_at(self, global_frame, depth):
+        if global_frame is not None:
+            def global_frame_of(frame):
+                return global_frame
+            return global_frame_of
+        if depth == 0:
+            def local_frame_of(frame):
+                return frame
+            return local_frame_of
+
+        def outer_frame_of(frame):
+            for _ in range(depth):
+                frame = frame.parent
+            return frame
+        return outer_frame_of
+
+    # Finds the variable name refers to when the slot locate() gives is
+    # still UNSET: the next of Resolver.Scope.candidates whose declaration
+    # has run, as (frame, slot). Raises the usual NameError when none has.
+    def fallback(self, name):
+        getters = []
+        for depth, slot in self.scope.candidates(name)[1:]:
+            global_frame = self.env.frame if self.scope.scope_at(depth).is_global else None
+            getters.append((self.frame_at(global_frame, depth), slot))
+
+        def find(frame):
+            for frame_of, slot in getters:
+                target = frame_of(frame)
+                if target.values[slot] is not UNSET:
+                    return target, slot
+            raise NameError(f"Undefined variable: {name}")
+        return find
+
+    # Loads of a variable that may hold a string turn the
+    # Runtime.StringBuilder compound() leaves in string slots into a str
+    def var(self, node):
+        load = self.load(node[1])
+        if self.static_type(node) in ('int', 'float', 'bool'):
+            return load
+        builder = Runtime.StringBuilder
+
+        def run_string_var(frame):
+            value = load(frame)
+            if type(value) is builder:
+                return str(value)
+            return value
+        return run_string_var
+
+    def load(self, name):
+        global_frame, depth, slot = self.locate(name)
+        find = self.fallback(name)
+        if global_frame is not None:
+            values = global_frame.values
+
+            def run_global(frame):
+                value = values[slot]
+                if value is UNSET:
+                    target, found = find(frame)
+                    return target.values[found]
+                return value
+            return run_global
+        if depth == 0:
+            def run_local(frame):
+                value = frame.values[slot]
+                if value is UNSET:
+                    target, found = find(frame)
+                    return target.values[found]
+                return value
+            return run_local
+        frame_of, slot = self.frame_getter(name)
+
+        def run_outer(frame):
+            value = frame_of(frame).values[slot]
+            if value is UNSET:
+                target, found = find(frame)
+                return target.values[found]
+            return value
+        return run_outer
+
+    # Arrays
+
+    def array(self, node):
+        items = [self.compile(item) for item in node[1]]
+        make = Runtime.make_array
+
+        def run_array(frame):
+            return make([item(frame) for item in items])
+        return run_array
+
+    def index(self, node):
+        target_of = self.compile(node[1])
+        index_of = self.compile(node[2])
+
+        def run_index(frame):
+            target = target_of(frame)
+            return target[index_of(frame)]
+        return run_index
+
+    # xs[i] = e: the variable is read first, then i, then e
+    def index_assign(self, node):
+        _, name, index, expr = node
+        target_of = self.var(('var', name))
+        index_of = self.compile(index)
+        value_of = self.compile(expr)
+
+        def run_index_assign(frame):
+            target = target_of(frame)
+            index = index_of(frame)
+            value = value_of(frame)
+            target[index] = value
+            return value
+        return run_index_assign
+
+    def decl(self, node):
+        _, type_str, name, expr = node
+        value_of = self.compile(expr)
+        frame_of, slot = self.frame_getter(name, declare=True)
+        check = Runtime.check_decl
+        convert = Runtime.convert
+        if self.static_type(expr) == type_str:
+            # The value already has the declared type (or is None)
+            def run_typed_decl(frame):
+                value = value_of(frame)
+                target = frame_of(frame)
+                if target.values[slot] is not UNSET:
+                    raise NameError(f"Variable '{name}' already declared")
+                target.values[slot] = value
+                target.types[slot] = type_str
+                return value
+            return run_typed_decl
+
+        def run_decl(frame):
+            value = value_of(frame)
+            target = frame_of(frame)
+            if target.values[slot] is not UNSET:
+                raise NameError(f"Variable '{name}' already declared")
+            check(type_str, value)
+            target.values[slot] = convert(type_str, value)
+            target.types[slot] = type_str
+            return value
+        return run_decl
+
+    def assign(self, node):
+        name = node[1]
+        value_of = self.compile(node[2])
+        global_frame, depth, slot = self.locate(name)
+        find = self.fallback(name)
+        converters = Runtime.CONVERTERS
+        convert = Runtime.convert
+
+        def store(target, frame):
+            found = slot
+            if target.values[found] is UNSET:
+                target, found = find(frame)
+            value = value_of(frame)
+            type_str = target.types[found]
+            # Values stored with their declared type need no conversion
+            if type(value) is not converters.get(type_str):
+                value = convert(type_str, value)
+            target.values[found] = value
+            return value
+
+        if self.types.get(id(node)) is not None and (
+                self.static_type(node[2]) == self.types[id(node)]):
+            def store(target, frame):
+                found = slot
+                if target.values[found] is UNSET:
+                    target, found = find(frame)
+                value = value_of(frame)
+                target.values[found] = value
+                return value
+
+        if global_frame is not None:
+            def run_assign_global(frame):
+                return store(global_frame, frame)
+            return run_assign_global
+        if depth == 0:
+            def run_assign_local(frame):
+                return store(frame, frame)
+            return run_assign_local
+        frame_of, slot = self.frame_getter(name)
+
+        def run_assign_outer(frame):
+            return store(frame_of(frame), frame)
+        return run_assign_outer
+
+    # x += e and friends: one slot access for the read and the write, and
+    # int += int literal without going through Runtime. Strings are appended
+    # to through Runtime.compound.
+    def compound(self, node):
+        _, name, op, expr = node
+        value_of = self.compile(expr)
+        global_frame, depth, slot = self.locate(name)
+        find = self.fallback(name)
+        fast = operator.add if op == '+' else operator.sub
+        update_value = Runtime.compound
+
+        def update(target, frame):
+            found = slot
+            if target.values[found] is UNSET:
+                target, found = find(frame)
+            values = target.values
+            current = values[found]
+            right = value_of(frame)
+            if type(current) is type(right) and (type(current) is int or type(current) is float):
+                # An int or float slot always holds its declared type
+                value = fast(current, right)
+            else:
+                value = update_value(target.types[found], op, current, right)
+            values[found] = value
+            return value
+
+        if global_frame is not None or depth == 0:
+            if type(expr) is int:
+                # An int slot always holds its declared type, so the sum needs
+                # no conversion
+                delta = expr if op == '+' else -expr
+                if global_frame is not None:
+                    values = global_frame.values
+
+                    def run_incr_global(frame):
+                        value = values[slot]
+                        if type(value) is int:
+                            value += delta
+                            values[slot] = value
+                            return value
+                        return update(global_frame, frame)
+                    return run_incr_global
+
+                def run_incr_local(frame):
+                    values = frame.values
+                    value = values[slot]
+                    if type(value) is int:
+                        value += delta
+                        values[slot] = value
+                        return value
+                    return update(frame, frame)
+                return run_incr_local
+            if global_frame is not None:
+                def run_compound_global(frame):
+                    return update(global_frame, frame)
+                return run_compound_global
+
+            def run_compound_local(frame):
+                return update(frame, frame)
+            return run_compound_local
+        frame_of, slot = self.frame_getter(name)
+
+        def run_compound_outer(frame):
+            return update(frame_of(frame), frame)
+        return run_compound_outer
+
+    # Operators
+
+    def arithmetic(self, node):
+        op = node[0]
+        left = self.compile(node[1])
+        if len(node) == 2:
+            neg = Runtime.neg
+
+            def run_neg(frame):
+                return neg(left(frame))
+            return run_neg
+        right = self.compile(node[2])
+        operand_type = self.static_type(node[1])
+        if operand_type == self.static_type(node[2]) and (
+                operand_type in ('int', 'float') or operand_type == 'string' and op == '+'):
+            return self.typed_arithmetic(op, left, right)
+        if op == '+':
+            add = Runtime.add
+
+            def run_add(frame):
+                a = left(frame)
+                b = right(frame)
+                if type(a) is type(b):
+                    return a + b
+                return add(a, b)
+            return run_add
+        if op == '-':
+            sub = Runtime.sub
+
+            def run_sub(frame):
+                a = left(frame)
+                b = right(frame)
+                if type(a) is type(b) and (type(a) is int or type(a) is float):
+                    return a - b
+                return sub(a, b)
+            return run_sub
+        if op == '*':
+            mul = Runtime.mul
+
+            def run_mul(frame):
+                a = left(frame)
+                b = right(frame)
+                if type(a) is type(b) and (type(a) is int or type(a) is float):
+                    return a * b
+                return mul(a, b)
+            return run_mul
+        return self.binary(node)
+
+    # Both operands have the same static type, so the operation can only fail
+    # when one of them is None; Runtime then raises the reference's error
+    def typed_arithmetic(self, op, left, right):
+        fallback = Runtime.BINARY[op]
+        if op == '+':
+            def run_typed_add(frame):
+                a = left(frame)
+                b = right(frame)
+                try:
+                    return a + b
+                except TypeError:
+                    return fallback(a, b)
+            return run_typed_add
+        if op == '-':
+            def run_typed_sub(frame):
+                a = left(frame)
+                b = right(frame)
+                try:
+                    return a - b
+                except TypeError:
+                    return fallback(a, b)
+            return run_typed_sub
+        if op == '*':
+            def run_typed_mul(frame):
+                a = left(frame)
+                b = right(frame)
+                try:
+                    return a * b
+                except TypeError:
+                    return fallback(a, b)
+            return run_typed_mul
+
+        def run_typed_div(frame):
+            a = left(frame)
+            b = right(frame)
+            try:
+                return a // b if type(a) is int else a / b
+            except (TypeError, ZeroDivisionError):
+                return fallback(a, b)
+        return run_typed_div
+
+    def binary(self, node):
+        op = node[0]
+        left = self.compile(node[1])
+        right = self.compile(node[2])
+        if op == '<=':
+            def run_le(frame):
+                return left(frame) <= right(frame)
+            return run_le
+        if op == '<':
+            def run_lt(frame):
+                return left(frame) < right(frame)
+            return run_lt
+        if op == '>=':
+            def run_ge(frame):
+                return left(frame) >= right(frame)
+            return run_ge
+        if op == '>':
+            def run_gt(frame):
+                return left(frame) > right(frame)
+            return run_gt
+        if op == '==':
+            def run_eq(frame):
+                return left(frame) == right(frame)
+            return run_eq
+        if op == '!=':
+            def run_ne(frame):
+                return left(frame) != right(frame)
+            return run_ne
+        # The right operand only runs when the left one does not decide
+        if op == '&&':
+            def run_and(frame):
+                return left(frame) and right(frame)
+            return run_and
+        if op == '||':
+            def run_or(frame):
+                return left(frame) or right(frame)
+            return run_or
+        apply = Runtime.BINARY[op]
+
+        def run_binary(frame):
+            return apply(left(frame), right(frame))
+        return run_binary
+
+    def logical_not(self, node):
+        operand = self.compile(node[1])
+
+        def run_not(frame):
+            return not operand(frame)
+        return run_not
+
+    # Statements
+
+    def expr_stmt(self, node):
+        return self.compile(node[1])
+
+    def call(self, node):
+        func_name = node[1]
+        args_of = [self.compile(arg) for arg in node[2]]
+        if func_name == 'print':
+            env = self.env
+
+            def run_print(frame):
+                env.output.print([arg(frame) for arg in args_of])
+            return run_print
+        builtin = Runtime.BUILTINS.get(func_name)
+        if builtin is not None:
+            def run_builtin(frame):
+                return builtin(*[arg(frame) for arg in args_of])
+            return run_builtin
+        funcs = self.env.funcs
+        convert = Runtime.convert
+        # Used when no user function of the same name is defined
+        budget = self.env.budget
+        array_builtins = budget.array_builtins if budget is not None else Runtime.ARRAY_BUILTINS
+        array_builtin = array_builtins.get(func_name)
+
+        def run_call(frame):
+            args = [arg(frame) for arg in args_of]
+            func = funcs.get(func_name)
+            if func is None:
+                if array_builtin is not None:
+                    return array_builtin(*args)
+                raise NameError(f"Unknown function: {func_name}")
+            params = func.params
+            if len(args) != len(params):
+                raise TypeError(
+                    f"{func_name}() expects {len(params)} args, got {len(args)}")
+            local = Frame(func.size, func.parent)
+            values = local.values
+            types = local.types
+            for (slot, type_str), value in zip(params, args):
+                values[slot] = convert(type_str, value)
+                types[slot] = type_str
+            result = func.body(local)
+            if result is RETURNED:
+                result = local.result
+            if func.return_type:
+                result = convert(func.return_type, result)
+            return result
+        return run_call
+
+    def func(self, node):
+        name = node[1]
+        return_type = node[4] if len(node) > 4 else None
+        outer = self.scope
+        self.scope = Resolver.Scope(outer)
+        params = [(self.scope.declare(param_name), param_type)
+                  for param_type, param_name in node[2]]
+        for local in Checker.declared_types(node[3]):
+            self.scope.declare(local)
+        body = self.block(node[3])
+        size = len(self.scope)
+        self.scope = outer
+        funcs = self.env.funcs
+        label = f"<function {name}>"
+        memo = self.env.memo
+        if memo is not None and name in memo.pure:
+            body = self.memoized(name, params, body)
+        body = self.metered_call(body)
+        if memo is None:
+            def run_func(frame):
+                funcs[name] = Function(name, params, body, return_type, size, frame)
+                return label
+            return run_func
+
+        def run_memo_func(frame):
+            memo.invalidate(name)
+            funcs[name] = Function(name, params, body, return_type, size, frame)
+            return label
+        return run_memo_func
+
+    # Serves calls from the memo cache, keyed by the converted arguments
+    def memoized(self, name, params, body):
+        memo = self.env.memo
+        slots = [slot for slot, _ in params]
+
+        def run_memoized(local):
+            def compute():
+                result = body(local)
+                return local.result if result is RETURNED else result
+            values = local.values
+            return memo.call(name, tuple([values[slot] for slot in slots]), compute)
+        return run_memoized
+
+    # Budget.Budget accounting for calls (a step, and call depth) and for the
+    # size of values '+' and '*' produce; loops count their own iterations.
+    # Without a budget the closures are returned unchanged.
+
+    def metered_call(self, body):
+        budget = self.env.budget
+        if budget is None:
+            return body
+
+        def run_metered_body(local):
+            budget.enter()
+            try:
+                return body(local)
+            finally:
+                budget.depth -= 1
+        return run_metered_body
+
+    def sized(self, handler):
+        def compile_sized(node):
+            step = handler(node)
+            check = self.env.budget.check_value
+
+            def run_sized(frame):
+                return check(step(frame))
+            return run_sized
+        return compile_sized
+
+    def return_stmt(self, node):
+        value_of = self.compile(node[1])
+
+        def run_return(frame):
+            frame.result = value_of(frame)
+            return RETURNED
+        return run_return
+
+    def if_stmt(self, node):
+        condition = self.compile(node[1])
+        body = self.block(node[2])
+        else_body = self.block(node[3]) if len(node) > 3 else None
+
+        def run_if(frame):
+            if condition(frame):
+                return body(frame)
+            if else_body is not None:
+                return else_body(frame)
+            return None
+        return run_if
+
+    def while_stmt(self, node):
+        counted = self.counted_while(node)
+        if counted is not None:
+            return counted
+        condition = self.compile(node[1])
+        body = self.block(node[2])
+        budget = self.env.budget
+        if budget is not None:
+            def run_metered_while(frame):
+                while condition(frame):
+                    budget.countdown -= 1
+                    if budget.countdown <= 0:
+                        budget.check()
+                    if body(frame) is RETURNED:
+                        return RETURNED
+                return None
+            return run_metered_while
+        if any(map(may_return, node[2])):
+            def run_returning_while(frame):
+                while condition(frame):
+                    if body(frame) is RETURNED:
+                        return RETURNED
+                return None
+            return run_returning_while
+
+        def run_while(frame):
+            while condition(frame):
+                body(frame)
+            return None
+        return run_while
+
+    # while (i <cmp> bound) { ...; i += k; } over a local or global i: the
+    # counter is compared and stepped in place rather than through the
+    # condition and step closures. With a budget each iteration also
+    # counts a step.
+    def counted_while(self, node):
+        counted = Checker.counted_loop(node)
+        if counted is None:
+            return None
+        name, comparison, bound, body, step = counted
+        global_frame, depth, slot = self.locate(name)
+        if global_frame is None and depth:
+            return None
+        find = self.fallback(name)
+        limit_of = self.compile(bound)
+        compare = COMPARISONS[comparison]
+        run_body = self.block(body)
+        run_step = self.compile(step)
+        delta = step[3] if step[2] == '+' else -step[3]
+        values = global_frame.values if global_frame is not None else None
+        builder = Runtime.StringBuilder
+        budget = self.env.budget
+        if budget is not None:
+            def run_metered_counted_while(frame):
+                slots = values if values is not None else frame.values
+                index = slot
+                if slots[index] is UNSET:
+                    target, index = find(frame)
+                    slots = target.values
+                while True:
+                    value = slots[index]
+                    if type(value) is builder:
+                        value = str(value)
+                    if not compare(value, limit_of(frame)):
+                        return None
+                    budget.countdown -= 1
+                    if budget.countdown <= 0:
+                        budget.check()
+                    if run_body(frame) is RETURNED:
+                        return RETURNED
+                    value = slots[index]
+                    if type(value) is int:
+                        slots[index] = value + delta
+                    else:
+                        run_step(frame)
+            return run_metered_counted_while
+
+        def run_counted_while(frame):
+            slots = values if values is not None else frame.values
+            index = slot
+            if slots[index] is UNSET:
+                target, index = find(frame)
+                slots = target.values
+            while True:
+                value = slots[index]
+                if type(value) is builder:
+                    value = str(value)
+                if not compare(value, limit_of(frame)):
+                    return None
+                if run_body(frame) is RETURNED:
+                    return RETURNED
+                value = slots[index]
+                if type(value) is int:
+                    slots[index] = value + delta
+                else:
+                    run_step(frame)
+        return run_counted_while
+
+
+class CompiledEnvironment:
+    # Global state for the closure engine: the root scope, the frame holding
+    # global values, and the function table. Both outlive a single evaluate()
+    # so console input keeps earlier declarations. Evaluator.Environment
+    # stays the reference implementation to diff results against.
+    def __init__(self, memo=None, budget=None):
+        self.scope = Resolver.Scope()
+        self.frame = Frame(0)
+        self.funcs = {}
+        self.memo = memo  # Memo.Memoizer when pure functions are cached
+        self.budget = budget  # Budget.Budget limiting each evaluate()
+        self.output = Output.Output(buffer_size=0)  # where print writes
+        self.compiler = Compiler(self)
+        self.returning = False  # the last evaluate() ended in a top-level return
+
+    # Globals as {name: (value, type)}, the shape Environment.vars uses
+    @property
+    def vars(self):
+        values, types = self.frame.values, self.frame.types
+        return {name: (values[slot], types[slot])
+                for name, slot in self.scope.slots.items()
+                if slot < len(values) and values[slot] is not UNSET}
+
+    def compile(self, node):
+        return self.compiler.compile(node)
+
+    def evaluate(self, node):
+        return self.prepare(node)()
+
+    # Compiles node once; the returned function runs it against whatever the
+    # globals hold at the time, so it can be called again after reset()
+    def prepare(self, node):
+        if self.memo is not None:
+            self.memo.analyze(node)
+        global_types = Resolver.SlotTypes(self.scope, self.frame.values, self.frame.types)
+        self.compiler.types = Checker.check(node, global_types).types
+        run = self.compile(node)
+
+        def run_program():
+            if self.budget is not None:
+                self.budget.start()
+            self.extend_frame()
+            self.returning = False
+            result = run(self.frame)
+            self.returning = result is RETURNED
+            if self.returning:
+                result = self.frame.result
+            if type(result) is Runtime.StringBuilder:
+                result = str(result)
+            return result
+        return run_program
+
+    def extend_frame(self):
+        missing = len(self.scope) - len(self.frame.values)
+        if missing > 0:
+            self.frame.values.extend([UNSET] * missing)
+            self.frame.types.extend([None] * missing)
+
+    # Forgets every global and function. Compiled code stays valid: it holds
+    # on to the global frame and function table, which are emptied in place.
+    def reset(self):
+        values, types = self.frame.values, self.frame.types
+        values[:] = [UNSET] * len(values)
+        types[:] = [None] * len(types)
+        self.funcs.clear()
+        self.returning = False
+
+    # Sets global name, declaring it if needed, without any type checks
+    def bind(self, name, value, type_str):
+        slot = self.scope.declare(name)
+        self.extend_frame()
+        self.frame.values[slot] = value
+        self.frame.types[slot] = type_str
@@ -0,0 +1,79 @@
+import difflib
+import io
+import os
+import re
+
+import Embed
+
+# === Conformance ===
+# Runs every program in the conformance directory on each engine, with and
+# without the optimizer, and compares what it prints with the .out file next
+# to the program. A run that fails ends with an "error: Kind: message" line,
+# so error behaviour is compared too. The .out files hold what the tree
+# engine, the reference, prints. A first line like
+#
+#     // limits: steps=1000 value_size=100
+#
+# runs the program under those Budget limits.
+
+CONFORMANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'conformance')
+
+LIMITS = re.compile(r'//\s*limits:(.*)')
+
+
+def default_programs():
+    return [os.path.join(CONFORMANCE_DIR, name) for name in sorted(os.listdir(CONFORMANCE_DIR))
+            if name.endswith('.mylang')]
+
+
+def limits_of(source):
+    match = LIMITS.match(source)
+    if match is None:
+        return None
+    limits = {}
+    for setting in match.group(1).split():
+        name, value = setting.split('=')
+        limits[name] = float(value) if name == 'seconds' else int(value)
+    return limits
+
+
+def run_program(source, engine, optimize=False, limits=None):
+    output = io.StringIO()
+    try:
+        Embed.compile(source, engine, optimize, limits).run(output=output)
+    except Embed.ScriptError as e:
+        output.write(f"error: {e}\n")
+    return output.getvalue()
+
+
+def check(paths, engines, modes=(False, True)):
+    failures = []
+    runs = 0
+    for path in paths:
+        with open(path, 'r') as file:
+            source = file.read()
+        with open(os.path.splitext(path)[0] + '.out', 'r') as file:
+            expected = file.read()
+        limits = limits_of(source)
+        for engine in engines:
+            for optimize in modes:
+                runs += 1
+                actual = run_program(source, engine, optimize, limits)
+                if actual != expected:
+                    failures.append((path, engine, optimize, expected, actual))
+    return runs, failures
+
+
+def format_failure(path, engine, optimize, expected, actual):
+    label = f"{os.path.basename(path)} on {engine}{' -O' if optimize else ''}"
+    diff = difflib.unified_diff(expected.splitlines(), actual.splitlines(),
+                                'expected', label, lineterm='')
+    return "\n".join([f"=== {label}", *diff])
+
+
+def main(paths, engines=None):
+    runs, failures = check(paths or default_programs(), engines or list(Embed.ENGINES))
+    for failure in failures:
+        print(format_failure(*failure))
+    print(f"--- {runs} runs, {len(failures)} failed")
+    return failures
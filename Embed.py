@@ -0,0 +1,163 @@
+import Budget
+import Checker
+import Compiler
+import Evaluator
+import Lexer
+import Optimizer
+import Output
+import Parser
+import Runtime
+import Transpiler
+import VM
+
+# === Embedding API ===
+# Library entry point for running mylang inside another Python program:
+#
+#     program = Embed.compile(source)
+#     out = io.StringIO()
+#     value = program.run({'n': 10}, output=out)
+#
+# compile() lexes and parses once. Program.run() binds the inputs as globals
+# and runs the program in a fresh set of globals every time, reusing the
+# engine's compiled code, so repeated runs skip lexing, parsing and
+# compiling. Nothing is printed to the terminal and nothing exits: errors,
+# including inputs of the wrong type, are raised as CompileError or
+# ExecutionError. print() output is buffered
+# during a run and flushed when the run ends, whether or not it succeeded.
+
+ENGINES = {
+    'closure': Compiler.CompiledEnvironment,
+    'tree': Evaluator.Environment,
+    'vm': VM.Machine,
+    'python': Transpiler.PythonEnvironment,
+}
+
+
+class ScriptError(Exception):
+    # kind is the name of the underlying error, e.g. 'SyntaxError' or
+    # 'TypeError'; the original exception is chained as __cause__
+    def __init__(self, kind, message):
+        super().__init__(f"{kind}: {message}")
+        self.kind = kind
+        self.message = message
+
+    @classmethod
+    def wrap(cls, error):
+        return cls(type(error).__name__, str(error))
+
+
+class CompileError(ScriptError):
+    pass
+
+
+class ExecutionError(ScriptError):
+    pass
+
+
+# inputs map names to values, or to (value, type) pairs like env.vars when
+# the type cannot be told from the value (None)
+def input_binding(name, value):
+    if isinstance(value, tuple):
+        value, type_str = value
+        if type_str not in Runtime.CONVERTERS:
+            raise ExecutionError('TypeError', f"Unknown type for input '{name}': {type_str}")
+        return value, type_str
+    type_str = Checker.literal_type(value)
+    if type_str is None:
+        raise ExecutionError(
+            'TypeError', f"Unsupported input type for '{name}': {type(value).__name__}")
+    return value, type_str
+
+
+# The input's value as type_str, e.g. an int for a float input
+def convert_input(name, type_str, value):
+    try:
+        return Runtime.convert(type_str, value)
+    except Exception as e:
+        raise ExecutionError(type(e).__name__, f"input '{name}': {e}") from e
+
+
+class Program:
+    # limits are Budget.Budget keyword arguments; every run gets the full
+    # budget, and exceeding it raises ExecutionError of kind 'BudgetExceeded'
+    def __init__(self, source, ast, engine='closure', limits=None):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.source = source
+        self.ast = ast
+        self.engine = engine
+        self.limits = limits
+        self.idle = []  # (env, prepared program) pairs not running right now
+
+    def __repr__(self):
+        return f"<program {self.engine}, {len(self.ast)} statements>"
+
+    # With env=None every run starts from empty globals holding just the
+    # inputs. With an environment (e.g. a Session's), the program runs in
+    # it: inputs assign existing globals and declare new ones, and whatever
+    # the program defines stays there afterwards. output receives print():
+    # a text file (None means sys.stdout) or an Output.Output, e.g. an
+    # Output.StreamOutput for an asyncio stream.
+    def run(self, inputs=None, env=None, output=None):
+        bindings = [(name, *input_binding(name, value))
+                    for name, value in (inputs or {}).items()]
+        if not isinstance(output, Output.Output):
+            output = Output.Output(output)
+        if env is not None:
+            return self.run_in(env, bindings, output)
+        try:
+            env, run = self.idle.pop()
+        except IndexError:
+            env = self.environment()
+            try:
+                run = env.prepare(self.ast)
+            except Exception as e:
+                raise ExecutionError.wrap(e) from e
+        previous = env.output
+        try:
+            env.reset()
+            for name, value, type_str in bindings:
+                env.bind(name, convert_input(name, type_str, value), type_str)
+            env.output = output
+            try:
+                return run()
+            except Exception as e:
+                raise ExecutionError.wrap(e) from e
+        finally:
+            env.output = previous
+            self.idle.append((env, run))
+            output.flush()
+
+    # Each pooled environment has a budget of its own, since runs can overlap
+    def environment(self):
+        if self.limits:
+            return ENGINES[self.engine](budget=Budget.Budget(**self.limits))
+        return ENGINES[self.engine]()
+
+    def run_in(self, env, bindings, output):
+        declared = env.vars
+        for name, value, type_str in bindings:
+            if name in declared:
+                type_str = declared[name][1]
+            env.bind(name, convert_input(name, type_str, value), type_str)
+        previous = env.output
+        env.output = output
+        try:
+            return env.evaluate(self.ast)
+        except Exception as e:
+            raise ExecutionError.wrap(e) from e
+        finally:
+            env.output = previous
+            output.flush()
+
+
+def parse(source, optimize=False):
+    try:
+        ast = Parser.Parser(Lexer.iter_tokens(source)).parse()
+    except (SyntaxError, RecursionError) as e:
+        raise CompileError.wrap(e) from e
+    return Optimizer.optimize(ast) if optimize else ast
+
+
+def compile(source, engine='closure', optimize=False, limits=None):
+    return Program(source, parse(source, optimize), engine, limits)
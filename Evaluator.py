@@ -1,13 +1,76 @@
+import operator
+
+import Checker
+import Output
+import Runtime
+
+COMPARISONS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<=': operator.le,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '>': operator.gt
+}
+
+
 class Environment:
-    def __init__(self):
+    # Each function call gets its own Environment whose parent is the
+    # environment the function was declared in; lookups walk that chain
+    # instead of copying the caller's variables.
+    def __init__(self, parent=None, memo=None, budget=None):
         self.vars = {}
-        self.funcs = {}
+        self.funcs = parent.funcs if parent is not None else {}
+        self.parent = parent
+        # Memo.Memoizer when pure functions are cached, shared like funcs
+        self.memo = parent.memo if parent is not None else memo
+        # Budget.Budget limiting each top-level evaluate(), shared the same way
+        self.budget = parent.budget if parent is not None else budget
+        # Output.Output print writes to, shared the same way
+        self.output = parent.output if parent is not None else Output.Output(buffer_size=0)
+        # Set by 'return'. Statement lists and loops stop on it, and it stays
+        # set after a top-level return so callers can tell the program ended.
+        self.returning = False
+
+    # ProfilingEnvironment turns the counted-loop fast path off, which skips
+    # evaluating the condition and step nodes
+    counted_loops = True
+
+    # Same interface as CompiledEnvironment.prepare; nothing to compile here
+    def prepare(self, node):
+        return lambda: self.evaluate(node)
+
+    def reset(self):
+        self.vars.clear()
+        self.funcs.clear()
+        self.returning = False
+
+    def bind(self, name, value, type_str):
+        self.vars[name] = (value, type_str)
+
+    def lookup(self, name):
+        env = self
+        while env is not None:
+            if name in env.vars:
+                return env
+            env = env.parent
+        raise NameError(f"Undefined variable: {name}")
 
     def evaluate(self, node):
         if isinstance(node, list):  # Add support for lists of statements
+            if self.parent is None:
+                if self.memo is not None:
+                    self.memo.analyze(node)
+                if self.budget is not None:
+                    self.budget.start()
             result = None
+            self.returning = False
             for statement in node:
                 result = self.evaluate(statement)
+                if self.returning:
+                    break
+            if type(result) is Runtime.StringBuilder:
+                result = str(result)
             return result
 
         if isinstance(node, (int, float, str, bool, type(None))):
@@ -19,55 +82,22 @@ class Environment:
             if op in ('+', '-', '*', '/'):
                 left = self.evaluate(node[1])
                 right = self.evaluate(node[2]) if len(node) > 2 else None
-                if op == '+':
-                    if type(left) != type(right):
-                        raise TypeError(
-                            f"Type mismatch for '+': {type(left).__name__} and {type(right).__name__}")
-                    return left + right
-                elif op == '-':
-                    if right is not None:
-                        if type(left) != type(right):
-                            raise TypeError(
-                                f"Type mismatch for '-': {type(left).__name__} and {type(right).__name__}")
-                        if not isinstance(left, (int, float)):
-                            raise TypeError(
-                                f"Unsupported operand type for '-': {type(left).__name__}")
-                        return left - right
-                    else:
-                        if not isinstance(left, (int, float)):
-                            raise TypeError(
-                                f"Unsupported operand type for unary '-': {type(left).__name__}")
-                        return -left
-                elif op == '*':
-                    if type(left) != type(right):
-                        raise TypeError(
-                            f"Type mismatch for '*': {type(left).__name__} and {type(right).__name__}")
-                    if not isinstance(left, (int, float)):
-                        raise TypeError(
-                            f"Unsupported operand type for '*': {type(left).__name__}")
-                    return left * right
-                elif op == '/':
-                    if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
-                        raise TypeError(
-                            f"Unsupported operand type for '/': {type(left).__name__} and {type(right).__name__}")
-                    if right == 0:
-                        raise ZeroDivisionError("division by zero")
-                    return left // right if isinstance(left, int) and isinstance(right, int) else float(left) / float(right)
+                if self.budget is not None and self.budget.value_size is not None:
+                    return self.budget.check_value(self.arithmetic(op, left, right))
+                return self.arithmetic(op, left, right)
 
-            # Logical and comparison operators
-            if op in ('||', '&&', '==', '!=', '<=', '>=', '<', '>'):
+            # Comparison operators
+            if op in COMPARISONS:
                 left = self.evaluate(node[1])
                 right = self.evaluate(node[2])
-                return {
-                    '||': left or right,
-                    '&&': left and right,
-                    '==': left == right,
-                    '!=': left != right,
-                    '<=': left <= right,
-                    '>=': left >= right,
-                    '<': left < right,
-                    '>': left > right
-                }[op]
+                return COMPARISONS[op](left, right)
+
+            # Logical operators only evaluate the right operand when the
+            # left one does not decide the result
+            if op == '&&':
+                return self.evaluate(node[1]) and self.evaluate(node[2])
+            if op == '||':
+                return self.evaluate(node[1]) or self.evaluate(node[2])
 
             if op == '!':
                 return not self.evaluate(node[1])
@@ -92,29 +122,78 @@ class Environment:
                 if type_str == 'bool' and not isinstance(value, (bool, type(None))):
                     raise RuntimeError(
                         f"Expected bool, got {type(value).__name__}")
+                if type_str in Runtime.ARRAY_TYPES:
+                    if not isinstance(value, (Runtime.Array, type(None))):
+                        raise RuntimeError(
+                            f"Expected {type_str}, got {type(value).__name__}")
+                    # Stored converted, so every read gets this same array
+                    value = self.formatVar(type_str, value)
                 self.vars[name] = (value, type_str)
                 return value
 
             if op == 'assign':
                 name = node[1]
-                if name not in self.vars:
-                    raise NameError(f"Undefined variable: {name}")
+                scope = self.lookup(name)
                 value = self.formatVar(
-                    self.vars[name][1], self.evaluate(node[2]))
-                self.vars[name] = (value, self.vars[name][1])
+                    scope.vars[name][1], self.evaluate(node[2]))
+                scope.vars[name] = (value, scope.vars[name][1])
+                return value
+
+            if op == 'compound':
+                # Same as ('assign', name, (op, ('var', name), expr)) with a
+                # single lookup and no rebuilt tuples
+                _, name, operator, expr = node
+                scope = self.lookup(name)
+                value, type_str = scope.vars[name]
+                if operator == '+' and type_str == 'string' and (
+                        type(value) is str or type(value) is Runtime.StringBuilder):
+                    # Appends build a Runtime.StringBuilder, which 'var'
+                    # turns back into a str through formatVar. Anything else
+                    # a string variable holds (a parameter passed 1.5, say)
+                    # is converted on the generic path first.
+                    right = self.evaluate(expr)
+                    if type(right) is not str:
+                        self.arithmetic(operator, str(value), right)  # raises
+                    value = Runtime.append(value, right)
+                else:
+                    value = self.arithmetic(
+                        operator, self.formatVar(type_str, value), self.evaluate(expr))
+                    value = self.formatVar(type_str, value)
+                if self.budget is not None and self.budget.value_size is not None:
+                    self.budget.check_value(value)
+                scope.vars[name] = (value, type_str)
                 return value
 
             if op == 'var':
                 name = node[1]
-                if name not in self.vars:
-                    raise NameError(f"Undefined variable: {name}")
-                return self.formatVar(self.vars[name][1], self.vars[name][0])
+                scope = self.lookup(name)
+                return self.formatVar(scope.vars[name][1], scope.vars[name][0])
+
+            if op == 'array':
+                value = Runtime.make_array([self.evaluate(item) for item in node[1]])
+                if self.budget is not None and self.budget.value_size is not None:
+                    self.budget.check_value(value)
+                return value
+
+            if op == 'index':
+                target = self.evaluate(node[1])
+                return target[self.evaluate(node[2])]
+
+            if op == 'index_assign':
+                # xs[i] = e: the variable is read first, then i, then e
+                _, name, index, expr = node
+                scope = self.lookup(name)
+                target = self.formatVar(scope.vars[name][1], scope.vars[name][0])
+                index = self.evaluate(index)
+                value = self.evaluate(expr)
+                target[index] = value
+                return value
 
             if op == 'call':
                 func_name = node[1]
                 args = [self.evaluate(arg) for arg in node[2]]
                 if func_name == 'print':
-                    print(*args)
+                    self.output.print(args)
                     return None
                 if func_name == 'toInt':
                     return int(args[0])
@@ -123,19 +202,37 @@ class Environment:
                 if func_name == 'toFloat':
                     return float(args[0])
                 if func_name in self.funcs:
-                    func_params, func_body, func_ret_type = self.funcs[func_name]
+                    func_params, func_body, func_ret_type, func_env = self.funcs[func_name]
                     if len(args) != len(func_params):
                         raise TypeError(
                             f"{func_name}() expects {len(func_params)} args, got {len(args)}")
-                    local = Environment()
-                    local.funcs = self.funcs
-                    local.vars = self.vars.copy()
+                    local = type(self)(func_env)
+                    # Arguments are converted to the parameter types when
+                    # bound, so one that cannot be fails the call, and an
+                    # array argument is shared with the caller
+                    args = [self.formatVar(param[0], arg_val)
+                            for param, arg_val in zip(func_params, args)]
                     for param, arg_val in zip(func_params, args):
                         local.vars[param[1]] = (arg_val, param[0])
-                    result = local.evaluate(func_body)
+                    if self.budget is not None:
+                        self.budget.enter()
+                    try:
+                        if self.memo is not None and func_name in self.memo.pure:
+                            key = tuple(args)
+                            result = self.memo.call(
+                                func_name, key, lambda: local.evaluate(func_body))
+                        else:
+                            result = local.evaluate(func_body)
+                    finally:
+                        if self.budget is not None:
+                            self.budget.leave()
                     if func_ret_type:
                         result = self.formatVar(func_ret_type, result)
                     return result
+                if func_name in Runtime.ARRAY_BUILTINS:
+                    if self.budget is not None:
+                        return self.budget.array_builtins[func_name](*args)
+                    return Runtime.ARRAY_BUILTINS[func_name](*args)
                 raise NameError(f"Unknown function: {func_name}")
 
             if op == 'func':
@@ -143,51 +240,123 @@ class Environment:
                 params = node[2]
                 body = node[3]
                 return_type = node[4] if len(node) > 4 else None
-                self.funcs[name] = (params, body, return_type)
+                if self.memo is not None:
+                    self.memo.invalidate(name)
+                self.funcs[name] = (params, body, return_type, self)
                 return f"<function {name}>"
 
             if op == 'return':
-                return self.evaluate(node[1])
+                value = self.evaluate(node[1])
+                self.returning = True
+                return value
 
             if op == 'if':
                 condition = self.evaluate(node[1])
+                # Blocks share the enclosing function's scope
                 if condition:
                     result = None
-                    local_env = Environment()
-                    local_env.vars = self.vars
                     for stmt in node[2]:
-                        result = local_env.evaluate(stmt)
+                        result = self.evaluate(stmt)
+                        if self.returning:
+                            break
                     return result
                 elif len(node) > 3:  # Check for else clause
                     result = None
-                    local_env = Environment()
-                    local_env.vars = self.vars
                     for stmt in node[3]:
-                        result = local_env.evaluate(stmt)
+                        result = self.evaluate(stmt)
+                        if self.returning:
+                            break
                     return result
                 return None
 
             if op == 'while':
+                counted = Checker.counted_loop(node) if self.counted_loops else None
+                if counted is not None:
+                    return self.counted_while(*counted)
                 condition = node[1]
                 body = node[2]
+                budget = self.budget
                 while self.evaluate(condition):
-                    local_env = Environment()
-                    local_env.vars = self.vars
+                    if budget is not None:
+                        budget.step()
                     for stmt in body:
-                        local_env.evaluate(stmt)
+                        result = self.evaluate(stmt)
+                        if self.returning:
+                            return result
                 return None
 
         raise TypeError(f"Invalid AST node: {node}")
 
+    # while (i <cmp> bound) { ...; i += k; }: the counter's scope is looked up
+    # once, and int counters are compared and stepped without dispatching on
+    # the condition and step nodes
+    def counted_while(self, name, comparison, bound, body, step):
+        scope = self.lookup(name)
+        variables = scope.vars
+        compare = COMPARISONS[comparison]
+        delta = step[3] if step[2] == '+' else -step[3]
+        budget = self.budget
+        while True:
+            value, type_str = variables[name]
+            value = self.formatVar(type_str, value)
+            if not compare(value, self.evaluate(bound)):
+                return None
+            if budget is not None:
+                budget.step()
+            for stmt in body:
+                result = self.evaluate(stmt)
+                if self.returning:
+                    return result
+            value, type_str = variables[name]
+            if type_str == 'int' and type(value) is int:
+                variables[name] = (value + delta, type_str)
+            else:
+                self.evaluate(step)
+
+    def arithmetic(self, op, left, right):
+        if isinstance(left, Runtime.Array) or isinstance(right, Runtime.Array):
+            if right is None:
+                return Runtime.neg(left)
+            return Runtime.elementwise(op, left, right)
+        if op == '+':
+            if type(left) != type(right):
+                raise TypeError(
+                    f"Type mismatch for '+': {type(left).__name__} and {type(right).__name__}")
+            return left + right
+        elif op == '-':
+            if right is not None:
+                if type(left) != type(right):
+                    raise TypeError(
+                        f"Type mismatch for '-': {type(left).__name__} and {type(right).__name__}")
+                if not isinstance(left, (int, float)):
+                    raise TypeError(
+                        f"Unsupported operand type for '-': {type(left).__name__}")
+                return left - right
+            else:
+                if not isinstance(left, (int, float)):
+                    raise TypeError(
+                        f"Unsupported operand type for unary '-': {type(left).__name__}")
+                return -left
+        elif op == '*':
+            if type(left) != type(right):
+                raise TypeError(
+                    f"Type mismatch for '*': {type(left).__name__} and {type(right).__name__}")
+            if not isinstance(left, (int, float)):
+                raise TypeError(
+                    f"Unsupported operand type for '*': {type(left).__name__}")
+            return left * right
+        elif op == '/':
+            if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
+                raise TypeError(
+                    f"Unsupported operand type for '/': {type(left).__name__} and {type(right).__name__}")
+            if right == 0:
+                raise ZeroDivisionError("division by zero")
+            return left // right if isinstance(left, int) and isinstance(right, int) else float(left) / float(right)
+
     def formatVar(self, type, value):
-        converters = {
-            'int': int,
-            'float': float,
-            'string': str,
-            'bool': bool
-        }
         if value is None:
             return None
-        if type in converters:
-            return converters[type](value)
+        converter = Runtime.CONVERTERS.get(type)
+        if converter is not None:
+            return converter(value)
         raise TypeError(f"Unknown type: {type}")
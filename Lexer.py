@@ -1,81 +1,193 @@
 import re
+from collections import namedtuple
+from functools import partial
 
 # === Lexer ===
 
+TOKEN_SPECIFICATION = [
+    # Whitespace is the most frequent match, so it is tried first
+    ('SKIP',     r'\s+'),
 
-def tokenize(code):
-    token_specification = [
-        # Comments (must come before other operators)
-        ('COMMENT_LINE',  r'//.*'),           # Line comment
-        ('COMMENT_BLOCK', r'/\*[\s\S]*?\*/'),      # Block comment
-
-
-        ('FUNC',     r'func'),
-        ('RETURN',   r'return'),
-        ('IF',       r'if'),
-        ('ELSE',     r'else'),
-        ('WHILE',    r'while'),
-        ('BOOL',     r'true|false'),
-        ('TYPE_INT', r'int'),
-        ('TYPE_FLOAT', r'float'),
-        ('TYPE_STRING', r'string'),
-        ('TYPE_BOOL', r'bool'),
-        ('NUMBER',   r'\d+(\.\d+)?'),  # Integer or decimal
-        ('ID',       r'[a-zA-Z_]\w*'),
-        ('STRING',   r'"[^"]*"'),
-
-        # Comparison operators (order matters - longer patterns first!)
-        ('LESS_EQUAL',    r'<='),
-        ('GREATER_EQUAL', r'>='),
-        ('EQUAL',         r'=='),
-        ('NOT_EQUAL',     r'!='),
-        ('LESS',          r'<'),
-        ('GREATER',       r'>'),
-
-        # Logical operators
-        ('AND',     r'&&'),
-        ('OR',      r'\|\|'),
-        ('NOT',     r'!'),
-
-        # Fast Inrement
-        ('FAST_IN', r'\+\+'),
-        ('FAST_DE', r'--'),
-        ('FAST_ADD', r'\+='),
-        ('FAST_SUB', r'-='),
-
-        # Assignment and arithmetic
-        ('ASSIGN',   r'='),
-        ('ADD',      r'\+'),
-        ('SUB',      r'-'),
-        ('MUL',      r'\*'),
-        ('DIV',      r'/'),
-
-        # Delimiters
-        ('LPAREN',   r'\('),
-        ('RPAREN',   r'\)'),
-        ('LBRACE', r'\{'),
-        ('RBRACE', r'\}'),
-        ('COMMA',  r','),
-        ('SEMI',   r';'),
-        ('SKIP',     r'[ \t]+'),       # Skip spaces
-    ]
-    tok_regex = '|'.join(
-        f'(?P<{name}>{regex})' for name, regex in token_specification)
-    tokens = []
-    for mo in re.finditer(tok_regex, code):
-        kind = mo.lastgroup
-        value = mo.group()
-        match kind:
-            case 'NUMBER':
-                num = float(value) if '.' in value else int(value)
-                tokens.append(('NUMBER', num))
-            case 'STRING':
-                tokens.append(('STRING', value[1:-1]))
-            case 'BOOL':
-                tokens.append(('BOOL', value == 'true'))
-            case 'COMMENT_LINE' | 'COMMENT_BLOCK' | 'SKIP':
+    # Comments (must come before other operators)
+    ('COMMENT_LINE',  r'//.*'),           # Line comment
+    ('COMMENT_BLOCK', r'/\*[\s\S]*?\*/'),      # Block comment
+
+
+    ('FUNC',     r'func'),
+    ('RETURN',   r'return'),
+    ('IF',       r'if'),
+    ('ELSE',     r'else'),
+    ('WHILE',    r'while'),
+    ('BOOL',     r'true|false'),
+    ('TYPE_INT', r'int'),
+    ('TYPE_FLOAT', r'float'),
+    ('TYPE_STRING', r'string'),
+    ('TYPE_BOOL', r'bool'),
+    ('NUMBER',   r'\d+(\.\d+)?'),  # Integer or decimal
+    ('ID',       r'[a-zA-Z_]\w*'),
+    ('STRING',   r'"[^"]*"'),
+
+    # Comparison operators (order matters - longer patterns first!)
+    ('LESS_EQUAL',    r'<='),
+    ('GREATER_EQUAL', r'>='),
+    ('EQUAL',         r'=='),
+    ('NOT_EQUAL',     r'!='),
+    ('LESS',          r'<'),
+    ('GREATER',       r'>'),
+
+    # Logical operators
+    ('AND',     r'&&'),
+    ('OR',      r'\|\|'),
+    ('NOT',     r'!'),
+
+    # Fast Inrement
+    ('FAST_IN', r'\+\+'),
+    ('FAST_DE', r'--'),
+    ('FAST_ADD', r'\+='),
+    ('FAST_SUB', r'-='),
+
+    # Assignment and arithmetic
+    ('ASSIGN',   r'='),
+    ('ADD',      r'\+'),
+    ('SUB',      r'-'),
+    ('MUL',      r'\*'),
+    ('DIV',      r'/'),
+
+    # Delimiters
+    ('LPAREN',   r'\('),
+    ('RPAREN',   r'\)'),
+    ('LBRACE', r'\{'),
+    ('RBRACE', r'\}'),
+    ('LBRACKET', r'\['),
+    ('RBRACKET', r'\]'),
+    ('COMMA',  r','),
+    ('SEMI',   r';'),
+]
+
+# Compiled once at import; tokenize() and the console reuse it
+MASTER_PATTERN = re.compile('|'.join(
+    f'(?P<{name}>{regex})' for name, regex in TOKEN_SPECIFICATION))
+
+IGNORED = frozenset(('COMMENT_LINE', 'COMMENT_BLOCK', 'SKIP'))
+
+# Characters read per file.read() call when lexing straight from a file
+CHUNK_SIZE = 1 << 20
+
+# line and column are 1-based positions of the token's first character
+Token = namedtuple('Token', ('kind', 'value', 'line', 'column'))
+
+
+def iter_tokens(code):
+    return iter_chunk_tokens((code,))
+
+
+# Lexes text that arrives in pieces, e.g. file.read(n) chunks. A token that
+# could still grow with the next chunk (it touches the end of the buffer, or
+# is an unterminated string or comment) is carried over and lexed again with
+# more input, so chunk boundaries never change the token stream. An open
+# string or comment is only lexed again once a chunk holds the text that
+# can end it, so a long one costs time linear in its length.
+def iter_chunk_tokens(chunks):
+    line = 1
+    line_start = 0
+    code = ''
+    pos = 0
+    closer = None  # '"', '*/' or '\n' when the carried text is still open
+    tail = ''      # the carried text's last character, for a split '*/'
+    pending = []   # chunks read while waiting for closer
+    chunks = iter(chunks)
+    chunk = next(chunks, '')
+    while True:
+        following = next(chunks, None)
+        final = following is None
+        if closer is not None:
+            pending.append(chunk)
+            if not final and closer not in tail + chunk:
+                if closer == '*/':
+                    tail = chunk[-1:]
+                chunk = following
+                continue
+            code += ''.join(pending)
+            pending.clear()
+            closer = None
+            tail = ''
+        else:
+            code += chunk
+        limit = len(code) + 1 if final else len(code) - 1
+        pos = 0
+        for mo in MASTER_PATTERN.finditer(code):
+            start = mo.start()
+            end = mo.end()
+            kind = mo.lastgroup
+            # Gaps of unmatched characters are skipped like whitespace. A
+            # '"' there has no closing '"' anywhere after it yet.
+            if start != pos and not final and '"' in code[pos:start]:
+                closer = '"'
+                break
+            if end >= limit:
+                if kind == 'COMMENT_LINE' and end == len(code):
+                    closer = '\n'
+                break
+            # Newlines live in whitespace, block comments and strings
+            if start != pos:
+                newlines = code.count('\n', pos, start)
+                if newlines:
+                    line += newlines
+                    line_start = code.rfind('\n', pos, start) + 1
+            if kind == 'DIV' and not final and code.startswith('*', end):
+                # '/*' without a '*/' after it yet
+                closer = '*/'
+                tail = code[end + 1:][-1:]
+                break
+            pos = end
+            value = mo.group()
+            column = start - line_start + 1
+            if kind in IGNORED:
+                if kind != 'COMMENT_LINE' and '\n' in value:
+                    line += value.count('\n')
+                    line_start = start + value.rfind('\n') + 1
                 continue
-            case _:
-                tokens.append((kind, value))
-    tokens.append(('EOF', None))
-    return tokens
+            match kind:
+                case 'NUMBER':
+                    num = float(value) if '.' in value else int(value)
+                    yield Token('NUMBER', num, line, column)
+                case 'STRING':
+                    yield Token('STRING', value[1:-1], line, column)
+                    if '\n' in value:
+                        line += value.count('\n')
+                        line_start = start + value.rfind('\n') + 1
+                case 'BOOL':
+                    yield Token('BOOL', value == 'true', line, column)
+                case _:
+                    yield Token(kind, value, line, column)
+        if final:
+            break
+        code = code[pos:]
+        line_start -= pos
+        chunk = following
+    newlines = code.count('\n', pos)
+    if newlines:
+        line += newlines
+        line_start = code.rfind('\n', pos) + 1
+    yield Token('EOF', None, line, len(code) - line_start + 1)
+
+
+def iter_file_tokens(file, chunk_size=CHUNK_SIZE):
+    return iter_chunk_tokens(iter(partial(file.read, chunk_size), ''))
+
+
+def tokenize(code):
+    return list(iter_tokens(code))
+
+
+# True when code ends inside a string literal or block comment, which the
+# patterns above would otherwise lex as stray characters and operators
+def unterminated(code):
+    pos = 0
+    for mo in MASTER_PATTERN.finditer(code):
+        if '"' in code[pos:mo.start()]:
+            return True
+        if mo.lastgroup == 'DIV' and code.startswith('*', mo.end()):
+            return True
+        pos = mo.end()
+    return '"' in code[pos:]
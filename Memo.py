@@ -0,0 +1,194 @@
+import math
+from collections import OrderedDict
+
+import Runtime
+
+# === Memoization ===
+# Opt-in result caching for user functions that provably have no side
+# effects. A function body is locally pure when it only reads and writes its
+# own parameters and locals, defines no functions, calls no impure builtin
+# (print) and neither builds arrays nor stores into them: arrays are shared
+# by reference, so a cached array could change under its next caller. It
+# is memoizable when, in addition, every user function it calls is
+# memoizable. Results are cached per function, keyed by the argument tuple
+# after conversion to the parameter types, in an LRU of bounded size.
+
+DEFAULT_SIZE = 1024
+
+PURE_BUILTINS = frozenset(('toInt', 'toString', 'toFloat'))
+
+
+class LRUCache:
+    __slots__ = ('entries', 'size', 'hits', 'misses', 'evictions')
+
+    def __init__(self, size):
+        self.entries = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'entries': len(self.entries)}
+
+
+# Returns (locally pure, names of the user functions it calls). A name is
+# local once a declaration that has certainly run precedes it; anywhere else
+# it may refer to an outer variable, like Resolver.Scope.candidates.
+def analyze_function(node):
+    names = {param_name for _, param_name in node[2]}
+    callees = set()
+    return visit(node[3], names, callees), callees
+
+
+def visit(node, names, callees):
+    if isinstance(node, list):
+        return all(visit(item, names, callees) for item in node)
+    if not isinstance(node, tuple):
+        return True
+    match node[0]:
+        case 'var':
+            return node[1] in names
+        case 'assign':
+            return node[1] in names and visit(node[2], names, callees)
+        case 'compound':
+            return node[1] in names and visit(node[3], names, callees)
+        case 'decl':
+            if not visit(node[3], names, callees):
+                return False
+            names.add(node[2])
+            return True
+        case 'if' | 'while':
+            # Declarations in a body are not certain after it
+            return visit(node[1], names, callees) and all(
+                visit(body, set(names), callees) for body in node[2:])
+        case 'func' | 'array' | 'index_assign':
+            return False
+        case 'call':
+            if node[1] in Runtime.BUILTINS:
+                if node[1] not in PURE_BUILTINS:
+                    return False
+            else:
+                callees.add(node[1])
+            return visit(node[2], names, callees)
+    return all(visit(item, names, callees) for item in node[1:])
+
+
+# Yields every tuple node below node, statements and expressions alike
+def walk(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, tuple):
+            yield node
+            if node[0] == 'call':
+                stack.extend(node[2])
+            elif node[0] == 'func':
+                stack.append(node[3])
+            else:
+                stack.extend(node[1:])
+
+
+class Memoizer:
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.definitions = {}  # name -> (locally pure, callees), all definitions merged
+        self.pure = set()      # names whose calls may be served from the cache
+        self.caches = {}       # name -> LRUCache
+
+    # Called with every program before it runs, so purity is known for all
+    # functions it defines, including ones nested in other functions
+    def analyze(self, ast):
+        found = False
+        for node in walk(ast):
+            if node[0] != 'func':
+                continue
+            found = True
+            pure, callees = analyze_function(node)
+            # A name is only as pure as the least pure body it was given
+            known = self.definitions.get(node[1])
+            if known is not None:
+                pure = pure and known[0]
+                callees = callees | known[1]
+            self.definitions[node[1]] = (pure, callees)
+        if found:
+            self.update()
+
+    # Greatest fixpoint: drop names that call anything not (or no longer) pure
+    def update(self):
+        pure = {name for name, (local, _) in self.definitions.items() if local}
+        changed = True
+        while changed:
+            changed = False
+            for name in list(pure):
+                if not self.definitions[name][1] <= pure:
+                    pure.discard(name)
+                    changed = True
+        self.pure = pure
+
+    # (Re)defining name changes what it and its callers compute
+    def invalidate(self, name):
+        for cached, cache in self.caches.items():
+            if cache.entries and (cached == name or name in self.dependencies(cached)):
+                cache.entries.clear()
+
+    # User functions name calls, directly or indirectly
+    def dependencies(self, name):
+        seen = set()
+        stack = [name]
+        while stack:
+            for callee in self.definitions.get(stack.pop(), (True, ()))[1]:
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+        return seen
+
+    def cache_for(self, name):
+        cache = self.caches.get(name)
+        if cache is None:
+            cache = self.caches[name] = LRUCache(self.size)
+        return cache
+
+    # Looks key up in name's cache; compute() runs the call on a miss
+    def call(self, name, key, compute):
+        if name not in self.pure:
+            return compute()
+        if 0.0 in key:
+            # 0.0 and -0.0 are equal keys but print differently
+            key = tuple([(float, value, math.copysign(1.0, value)) if type(value) is float
+                         else value for value in key])
+        cache = self.cache_for(name)
+        entries = cache.entries
+        try:
+            result = entries[key]
+        except KeyError:
+            pass
+        except TypeError:  # unhashable arguments are never cached
+            return compute()
+        else:
+            cache.hits += 1
+            entries.move_to_end(key)
+            return result
+        cache.misses += 1
+        result = compute()
+        entries[key] = result
+        if len(entries) > cache.size:
+            entries.popitem(last=False)
+            cache.evictions += 1
+        return result
+
+    def stats(self):
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def report(self):
+        lines = [f"memo {name}: {s['hits']} hits, {s['misses']} misses, "
+                 f"{s['evictions']} evictions, {s['entries']} entries"
+                 for name, s in self.stats().items()]
+        hits = sum(cache.hits for cache in self.caches.values())
+        misses = sum(cache.misses for cache in self.caches.values())
+        lines.append(f"memo hits: {hits}, misses: {misses}, "
+                     f"memoized: {', '.join(sorted(self.pure)) or 'none'}")
+        return "\n".join(lines)
@@ -0,0 +1,173 @@
+import Runtime
+
+# === Optimizer ===
+# Optional AST-to-AST pass between Parser.parse() and evaluation. Folds
+# operators and conversion builtins whose operands are all literals, and
+# && and || whose left operand is one, and removes branches that can never
+# run. A fold that would raise is left in
+# place, so type mismatches and division by zero still fail at runtime, at
+# the same point of the program as before.
+
+LITERALS = (int, float, str, bool)
+
+FOLDABLE_CALLS = {
+    'toInt': Runtime.to_int,
+    'toString': Runtime.to_string,
+    'toFloat': Runtime.to_float
+}
+
+
+def is_literal(node):
+    return isinstance(node, LITERALS)
+
+
+# Pairs every comparison operator can handle without raising
+def comparable(left, right):
+    if isinstance(left, str) or isinstance(right, str):
+        return isinstance(left, str) and isinstance(right, str)
+    return True
+
+
+# Number of operands the optimizer folds for node, or None for leaves
+def operand_count(node):
+    if not isinstance(node, tuple):
+        return None
+    op = node[0]
+    if op in Runtime.BINARY and len(node) == 3:
+        return 2
+    if op in Runtime.UNARY and len(node) == 2:
+        return 1
+    if op == 'call':
+        return len(node[2])
+    if op == 'array':
+        return len(node[1])
+    if op == 'index':
+        return 2
+    return None
+
+
+class Optimizer:
+    # locations is Profiler's {id(node): line} table; rebuilt statements
+    # keep the line of the statement they replace
+    def __init__(self, locations=None):
+        self.locations = locations
+
+    def optimize(self, statements):
+        return self.block(statements)
+
+    def block(self, statements):
+        result = []
+        last = len(statements) - 1
+        for index, stmt in enumerate(statements):
+            folded = self.statement(stmt)
+            if self.locations is not None and id(stmt) in self.locations:
+                for node in folded if isinstance(folded, list) else (folded,):
+                    if isinstance(node, tuple):
+                        self.locations.setdefault(id(node), self.locations[id(stmt)])
+            if isinstance(folded, list):
+                result.extend(folded)
+                # A removed branch or loop used to be the block's value
+                if index == last and not folded:
+                    result.append(('expr_stmt', None))
+            else:
+                result.append(folded)
+        return result
+
+    # Returns a node, or a list of statements to splice into the block
+    def statement(self, node):
+        if not isinstance(node, tuple):
+            return self.expr(node)
+        match node[0]:
+            case 'expr_stmt' | 'return':
+                return (node[0], self.expr(node[1]))
+            case 'decl':
+                _, type_str, name, expr = node
+                return ('decl', type_str, name, self.expr(expr))
+            case 'assign':
+                return ('assign', node[1], self.expr(node[2]))
+            case 'compound':
+                return ('compound', node[1], node[2], self.expr(node[3]))
+            case 'index_assign':
+                return ('index_assign', node[1], self.expr(node[2]), self.expr(node[3]))
+            case 'func':
+                return node[:3] + (self.block(node[3]),) + node[4:]
+            case 'if':
+                condition = self.expr(node[1])
+                body = self.block(node[2])
+                else_body = self.block(node[3]) if len(node) > 3 else None
+                if is_literal(condition):
+                    return body if condition else (else_body or [])
+                if else_body is None:
+                    return ('if', condition, body)
+                return ('if', condition, body, else_body)
+            case 'while':
+                condition = self.expr(node[1])
+                if is_literal(condition) and not condition:
+                    return []
+                return ('while', condition, self.block(node[2]))
+        return self.expr(node)
+
+    # Folds bottom-up with an explicit stack, so operator chains of any
+    # depth do not recurse in Python. An entry (node, True) means the node's
+    # operands are already folded and waiting on top of values.
+    def expr(self, node):
+        work = [(node, False)]
+        values = []
+        while work:
+            node, ready = work.pop()
+            arity = operand_count(node)
+            if ready:
+                operands = values[len(values) - arity:]
+                del values[len(values) - arity:]
+                values.append(self.fold(node, operands))
+            elif arity is None:
+                values.append(node)
+            else:
+                work.append((node, True))
+                if node[0] == 'call':
+                    operands = node[2]
+                elif node[0] == 'array':
+                    operands = node[1]
+                else:
+                    operands = node[1:]
+                work.extend((operand, False) for operand in reversed(operands))
+        return values[0]
+
+    def fold(self, node, operands):
+        op = node[0]
+        # Arrays are mutable, so a literal is built fresh every time it runs
+        if op == 'array':
+            return ('array', operands)
+        if op == 'index':
+            return ('index', operands[0], operands[1])
+        if op == 'call':
+            fold = FOLDABLE_CALLS.get(node[1])
+            if fold is not None and operands and all(map(is_literal, operands)):
+                try:
+                    return fold(*operands)
+                except (TypeError, ValueError, OverflowError):
+                    pass
+            return ('call', node[1], operands)
+        if len(operands) == 2:
+            left, right = operands
+            if op in ('&&', '||') and is_literal(left):
+                # The left operand alone decides whether the right one runs
+                return left if bool(left) == (op == '||') else right
+            if is_literal(left) and is_literal(right) and (
+                    op in ('+', '-', '*', '/') or comparable(left, right)):
+                try:
+                    return Runtime.BINARY[op](left, right)
+                except (TypeError, ValueError, ZeroDivisionError):
+                    pass
+            return (op, left, right)
+        operand = operands[0]
+        if is_literal(operand):
+            try:
+                return Runtime.UNARY[op](operand)
+            except TypeError:
+                pass
+        return (op, operand)
+
+
+def optimize(statements, locations=None):
+    return Optimizer(locations).optimize(statements)
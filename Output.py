@@ -0,0 +1,72 @@
+import sys
+
+# === Output ===
+# Where print() goes. Engines hand every print to env.output, an Output,
+# which formats the line itself and collects lines until buffer_size
+# characters are waiting, then passes them to the target in one write. That
+# replaces print()'s several writes per call (and, on a pipe or terminal,
+# often a system call per line) with one write per buffer.
+#
+# Nothing reaches the target until the buffer fills or flush() is called,
+# so whoever buffers output flushes it at exit, and before printing errors
+# of its own to the same stream so they stay in order. With buffer_size 0
+# every print is written straight away, which is what engines default to.
+
+DEFAULT_BUFFER_SIZE = 1 << 16  # characters
+
+
+class Output:
+    # target is a text file: an open file, an io.StringIO, ... None means
+    # whatever sys.stdout is at the time of each write.
+    def __init__(self, target=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.target = target
+        self.buffer_size = buffer_size
+        self.pieces = []
+        self.size = 0
+
+    def __repr__(self):
+        return f"<output {self.target!r}, {self.size}/{self.buffer_size} buffered>"
+
+    # values as print(*values) shows them
+    def print(self, values):
+        self.write(' '.join(map(str, values)) + '\n')
+
+    def write(self, text):
+        self.pieces.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.spill()
+
+    def spill(self):
+        text = ''.join(self.pieces)
+        self.pieces.clear()
+        self.size = 0
+        self.emit(text)
+
+    def emit(self, text):
+        (self.target if self.target is not None else sys.stdout).write(text)
+
+    def flush(self):
+        if self.pieces:
+            self.spill()
+        (self.target if self.target is not None else sys.stdout).flush()
+
+
+# Output to an asyncio.StreamWriter. Text is encoded on the way out and
+# StreamWriter.write() never blocks; await drain() to flush and then wait
+# until the transport has caught up.
+class StreamOutput(Output):
+    def __init__(self, writer, buffer_size=DEFAULT_BUFFER_SIZE, encoding='utf-8'):
+        super().__init__(writer, buffer_size)
+        self.encoding = encoding
+
+    def emit(self, text):
+        self.target.write(text.encode(self.encoding))
+
+    def flush(self):
+        if self.pieces:
+            self.spill()
+
+    async def drain(self):
+        self.flush()
+        await self.target.drain()
@@ -1,34 +1,119 @@
+from Lexer import Token
+
+END = Token('EOF', None, 0, 0)
+
+BINARY_PRECEDENCE = {
+    'OR': 1,
+    'AND': 2,
+    'EQUAL': 3,
+    'NOT_EQUAL': 3,
+    'LESS': 4,
+    'GREATER': 4,
+    'LESS_EQUAL': 4,
+    'GREATER_EQUAL': 4,
+    'ADD': 5,
+    'SUB': 5,
+    'MUL': 6,
+    'DIV': 6
+}
+
+UNARY_OPS = ('NOT', 'SUB')
+
+# Element types that have an array type, e.g. int[]
+ARRAY_ELEMENTS = ('int', 'float')
+
+# Operator stack entries that are not binary operators
+GROUP = 0
+UNARY = 7
+
+# Builtins a user function cannot replace, so calling them reads no variable
+FIXED_BUILTINS = ('print', 'toInt', 'toString', 'toFloat')
+
+
+# True for expressions that always give a str: string literals, toString()
+# and '+' of two such expressions
+def is_string(node):
+    if isinstance(node, str):
+        return True
+    if not isinstance(node, tuple):
+        return False
+    if node[0] == 'call':
+        return node[1] == 'toString' and len(node[2]) == 1
+    return node[0] == '+' and len(node) == 3 and is_string(node[1]) and is_string(node[2])
+
+
+# True when evaluating node might read variable name, directly or through a
+# user function
+def may_read(node, name):
+    work = [node]
+    while work:
+        node = work.pop()
+        if isinstance(node, list):
+            work.extend(node)
+        elif isinstance(node, tuple):
+            if node == ('var', name):
+                return True
+            if node[0] == 'call' and node[1] not in FIXED_BUILTINS:
+                return True
+            work.extend(node[1:])
+    return False
+
+
 class Parser:
+    # tokens may be a list or any iterator of Lexer.Token, e.g.
+    # Lexer.iter_tokens(); the parser only ever holds one token of lookahead.
     def __init__(self, tokens):
-        self.tokens = tokens
+        self.tokens = iter(tokens)
         self.pos = 0
+        self.current = next(self.tokens, END)
 
     def peek(self):
-        if self.pos >= len(self.tokens):
-            return 'EOF'
-        return self.tokens[self.pos][0]
+        return self.current[0]
 
     def advance(self):
         self.pos += 1
+        self.current = next(self.tokens, END)
 
     def match(self, expected):
-        if self.peek() == expected:
-            val = self.tokens[self.pos][1]
+        token = self.current
+        if token[0] == expected:
             self.advance()
-            return val
-        token = self.tokens[self.pos] if self.pos < len(
-            self.tokens) else ('EOF', '')
+            return token[1]
         raise SyntaxError(
-            f'expected: {expected} but got: {token[0]} ({token[1]!r}) at position {self.pos}')
+            f'expected: {expected} but got: {token[0]} ({token[1]!r}) at position {self.pos}'
+            + self.location(token))
+
+    def location(self, token):
+        if isinstance(token, Token) and token.line:
+            return f' (line {token.line}, column {token.column})'
+        return ''
 
     def parse(self):
-        statements = []
-        while self.pos < len(self.tokens) and self.peek() != 'EOF':
+        return list(self.statements())
+
+    # Yields top-level statements as soon as each one is parsed
+    def statements(self):
+        while self.peek() != 'EOF':
             stmt = self.statement()
-            if stmt is not None:
-                statements.append(stmt)
-        return statements
+            if isinstance(stmt, list):
+                yield from stmt
+            elif stmt is not None:
+                yield stmt
 
+    # block -> { statement* }
+    def block(self):
+        self.match('LBRACE')
+        body = []
+        while self.peek() not in ('RBRACE', 'EOF'):
+            stmt = self.statement()
+            if isinstance(stmt, list):
+                body.extend(stmt)
+            elif stmt is not None:
+                body.append(stmt)
+        self.match('RBRACE')
+        return body
+
+    # Returns a node, or a list of statements to splice into the block
     def statement(self):
         match self.peek():
             case 'FUNC':
@@ -53,73 +138,57 @@ class Parser:
                 self.match('SEMI')
                 return ('expr_stmt', expr)
 
-    # expr -> comparison
+    # Binary operators are parsed by precedence climbing over explicit
+    # operand and operator stacks, so long chains and deeply nested
+    # parentheses do not recurse in Python. The grammar is unchanged:
+    #   expr -> unary (BINARY_OP unary)*, with || < && < ==,!= < <,>,<=,>=
+    #           < +,- < *,/ and all binary operators left-associative
+    #   unary -> (! | -)* ( factor | '(' expr ')' )
     def expr(self):
-        return self.logical_or()
-
-    # logical_or -> logical_and (|| logical_and)*
-    def logical_or(self):
-        node = self.logical_and()
-        while self.peek() in ('OR',):
-            op = self.match(self.peek())
-            right = self.logical_and()
-            node = (op, node, right)
-        return node
-
-    # logical_and -> equality (&& equality)*
-    def logical_and(self):
-        node = self.equality()
-        while self.peek() in ('AND',):
-            op = self.match(self.peek())
-            right = self.equality()
-            node = (op, node, right)
-        return node
-
-    # equality -> comparison ((==|!=) comparison)*
-    def equality(self):
-        node = self.comparison()
-        while self.peek() in ('EQUAL', 'NOT_EQUAL'):
-            op = self.match(self.peek())
-            right = self.comparison()
-            node = (op, node, right)
-        return node
-
-    # comparison -> addition ((<|>|<=|>=) addition)*
-    def comparison(self):
-        node = self.addition()
-        while self.peek() in ('LESS', 'GREATER', 'LESS_EQUAL', 'GREATER_EQUAL'):
-            op = self.match(self.peek())
-            right = self.addition()
-            node = (op, node, right)
-        return node
-
-    # addition -> term ((+|-) term)*
-    def addition(self):
-        node = self.term()
-        while self.peek() in ('ADD', 'SUB'):
-            op = self.match(self.peek())
-            right = self.term()
-            node = (op, node, right)
-        return node
-
-    # term -> factor ((*|/) factor)*
-    def term(self):
-        node = self.unary()
-        while self.peek() in ('MUL', 'DIV'):
-            op = self.match(self.peek())
-            right = self.unary()
-            node = (op, node, right)
-        return node
+        operands = []
+        operators = []  # (precedence, op); GROUP marks an open parenthesis
+        groups = 0
+        while True:
+            while True:
+                kind = self.peek()
+                if kind in UNARY_OPS:
+                    operators.append((UNARY, self.match(kind)))
+                elif kind == 'LPAREN':
+                    self.advance()
+                    operators.append((GROUP, None))
+                    groups += 1
+                else:
+                    break
+            operands.append(self.factor())
+            while True:
+                # Unary operators bind tighter than any binary operator
+                while operators and operators[-1][0] == UNARY:
+                    operands.append((operators.pop()[1], operands.pop()))
+                if groups and self.peek() == 'RPAREN':
+                    while operators[-1][0] != GROUP:
+                        self.reduce(operands, operators)
+                    operators.pop()
+                    groups -= 1
+                    self.advance()
+                else:
+                    break
+            precedence = BINARY_PRECEDENCE.get(self.peek())
+            if precedence is None:
+                break
+            while operators and operators[-1][0] >= precedence:
+                self.reduce(operands, operators)
+            operators.append((precedence, self.match(self.peek())))
+        if groups:
+            self.match('RPAREN')
+        while operators:
+            self.reduce(operands, operators)
+        return operands[0]
 
-    def unary(self):
-        if self.peek() in ('NOT', 'SUB'):
-            op = self.match(self.peek())
-            node = self.unary()  # Recursive call for nested unary operators
-            return (op, node)
-        else:
-            return self.factor()
+    def reduce(self, operands, operators):
+        right = operands.pop()
+        operands.append((operators.pop()[1], operands.pop(), right))
 
-    # factor -> NUMBER | (expr)
+    # factor -> NUMBER | BOOL | STRING | array | (ID | call) ('[' expr ']')*
     def factor(self):
         match self.peek():
             case 'NUMBER':
@@ -139,19 +208,65 @@ class Parser:
                             self.match('COMMA')
                             args.append(self.expr())
                     self.match('RPAREN')
-                    return ('call', name, args)
+                    return self.indexed(('call', name, args))
                 else:
-                    return ('var', name)
-            case 'LPAREN':
-                self.match('LPAREN')
-                node = self.expr()
-                self.match('RPAREN')
-                return node
+                    return self.indexed(('var', name))
+            case 'LBRACKET':
+                return self.indexed(self.array())
             case _:
-                raise SyntaxError(f"Unexpected token: {self.tokens[self.pos]}")
+                raise SyntaxError(
+                    f"Unexpected token: {tuple(self.current[:2])}" + self.location(self.current))
+
+    # array -> '[' (expr (',' expr)*)? ']'
+    def array(self):
+        self.match('LBRACKET')
+        items = []
+        if self.peek() != 'RBRACKET':
+            items.append(self.expr())
+            while self.peek() == 'COMMA':
+                self.match('COMMA')
+                items.append(self.expr())
+        self.match('RBRACKET')
+        return ('array', items)
+
+    def indexed(self, node):
+        while self.peek() == 'LBRACKET':
+            node = ('index', node, self.subscript())
+        return node
+
+    def subscript(self):
+        self.match('LBRACKET')
+        index = self.expr()
+        self.match('RBRACKET')
+        return index
+
+    # A type name, with [] after it for an array type
+    def type_name(self):
+        token = self.current
+        type_str = self.match(self.peek())
+        if self.peek() == 'LBRACKET':
+            self.match('LBRACKET')
+            self.match('RBRACKET')
+            if type_str not in ARRAY_ELEMENTS:
+                raise SyntaxError(f"Arrays of {type_str} are not supported" + self.location(token))
+            type_str += '[]'
+        return type_str
+
+    # x = x + a + b; as x += a; x += b; when a and b are strings that cannot
+    # read x. x is then a string, or the first append fails just as x + a
+    # would. A piece that fails to evaluate leaves the earlier ones appended.
+    def appends(self, name, expr):
+        pieces = []
+        while isinstance(expr, tuple) and len(expr) == 3 and expr[0] == '+':
+            pieces.append(expr[2])
+            expr = expr[1]
+        if expr != ('var', name) or not all(
+                is_string(piece) and not may_read(piece, name) for piece in pieces):
+            return None
+        return [('compound', name, '+', piece) for piece in reversed(pieces)]
 
     def variable_declaration(self):
-        type_token = self.match(self.peek())
+        type_token = self.type_name()
         name = self.match('ID')
         expr = None
         if self.peek() == 'ASSIGN':
@@ -162,23 +277,17 @@ class Parser:
 
     def function_declaration(self):
         self.match('FUNC')
-        ret_type = self.match(self.peek())
+        ret_type = self.type_name()
         name = self.match('ID')
         self.match('LPAREN')
         params = []
         if self.peek() != 'RPAREN':
-            params.append((self.match(self.peek()), self.match('ID')))
+            params.append((self.type_name(), self.match('ID')))
             while self.peek() == 'COMMA':
                 self.match('COMMA')
-                params.append((self.match(self.peek()), self.match('ID')))
+                params.append((self.type_name(), self.match('ID')))
         self.match('RPAREN')
-        self.match('LBRACE')
-        body = []
-        while self.peek() != 'RBRACE':
-            stmt = self.statement()
-            if stmt is not None:
-                body.append(stmt)
-        self.match('RBRACE')
+        body = self.block()
         return ('func', name, params, body, ret_type)
 
     def if_statement(self):
@@ -186,22 +295,10 @@ class Parser:
         self.match('LPAREN')
         condition = self.expr()
         self.match('RPAREN')
-        self.match('LBRACE')
-        body = []
-        while self.peek() != 'RBRACE':
-            stmt = self.statement()
-            if stmt is not None:
-                body.append(stmt)
-        self.match('RBRACE')
+        body = self.block()
         if self.peek() == 'ELSE':
             self.match('ELSE')
-            self.match('LBRACE')
-            else_body = []
-            while self.peek() != 'RBRACE':
-                stmt = self.statement()
-                if stmt is not None:
-                    else_body.append(stmt)
-            self.match('RBRACE')
+            else_body = self.block()
             return ('if', condition, body, else_body)
         return ('if', condition, body)
 
@@ -210,13 +307,7 @@ class Parser:
         self.match('LPAREN')
         condition = self.expr()
         self.match('RPAREN')
-        self.match('LBRACE')
-        body = []
-        while self.peek() != 'RBRACE':
-            stmt = self.statement()
-            if stmt is not None:
-                body.append(stmt)
-        self.match('RBRACE')
+        body = self.block()
         return ('while', condition, body)
 
     def assignment_or_expression_statement(self):
@@ -237,16 +328,58 @@ class Parser:
                 self.match('ASSIGN')
                 expr = self.expr()
                 self.match('SEMI')
-                return ('assign', name, expr)
+                # x = x + e; is the compound x += e;, which the engines can
+                # run in place (e.g. appending to a string without a copy)
+                if (isinstance(expr, tuple) and len(expr) == 3 and expr[0] in ('+', '-')
+                        and expr[1] == ('var', name)):
+                    return ('compound', name, expr[0], expr[2])
+                return self.appends(name, expr) or ('assign', name, expr)
+            # Compound assignments update the variable in place. They behave
+            # exactly like ('assign', name, (op, ('var', name), expr)).
             case 'FAST_IN' | 'FAST_DE':  # x++; x--;
                 op = self.match(self.peek())[0]
                 self.match('SEMI')
-                return ('assign', name, (op, ('var', name), 1))
+                return ('compound', name, op, 1)
             case 'FAST_ADD' | 'FAST_SUB':  # x += 5; -=
                 op = self.match(self.peek())[0]
                 expr = self.expr()
                 self.match('SEMI')
-                return ('assign', name, (op, ('var', name), expr))
+                return ('compound', name, op, expr)
+            case 'LBRACKET':  # xs[i] = e;
+                index = self.subscript()
+                if self.peek() != 'ASSIGN':
+                    self.match('SEMI')
+                    return ('expr_stmt', ('index', ('var', name), index))
+                self.match('ASSIGN')
+                expr = self.expr()
+                self.match('SEMI')
+                return ('index_assign', name, index, expr)
             case _:
                 self.match('SEMI')
                 return ('expr_stmt', ('var', name))
+
+
+# Records the line of each statement and operand in a side table keyed by
+# node id, for diagnostics that need source positions (profiles, type
+# errors) without changing the AST. The table is only meaningful while the
+# AST is alive, since ids can be reused afterwards.
+class LocatingParser(Parser):
+    def __init__(self, tokens, locations):
+        super().__init__(tokens)
+        self.locations = locations
+
+    def locate(self, node, token):
+        if isinstance(node, tuple) and token.line:
+            self.locations.setdefault(id(node), token.line)
+        elif isinstance(node, list):
+            for stmt in node:
+                self.locate(stmt, token)
+        return node
+
+    def statement(self):
+        token = self.current
+        return self.locate(super().statement(), token)
+
+    def factor(self):
+        token = self.current
+        return self.locate(super().factor(), token)
@@ -0,0 +1,232 @@
+import time
+from contextlib import contextmanager, nullcontext
+
+import Compiler
+import Evaluator
+import Lexer
+import Optimizer
+import Parser
+
+# === Profiler ===
+# Opt-in profiling for the closure and tree engines. Profiling is done by
+# subclasses that wrap every compiled closure (or override evaluate) with
+# timing code; they are only used when profiling is requested, so the normal
+# engines run exactly as before and pay nothing for it. Counted loops take
+# the generic path, so their condition and step are counted every iteration.
+#
+# Source locations come from Parser.LocatingParser. Nodes without a line of
+# their own (operators, rebuilt nodes) report their parent's line.
+
+PROGRAM = '<program>'
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.phases = {}     # phase -> seconds
+        self.nodes = {}      # (kind, line) -> [hits, seconds including children, open]
+        self.functions = {}  # name -> [calls, self seconds, total seconds]
+        self.stacks = {}     # 'a;b;c' -> self seconds, for flamegraphs
+        self.locations = {}  # id(node) -> line
+        self.bodies = {}     # id(function body) -> name, for the tree engine
+        self.asts = []       # keeps located nodes (and their ids) alive
+        self.stack = []      # [name, path, start, child seconds]
+        self.active = {}     # name -> open calls, so recursion is counted once
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + self.clock() - start
+
+    # Lexes, parses and optionally optimizes, recording node lines
+    def parse(self, code, optimize=False):
+        with self.phase('lex'):
+            tokens = Lexer.tokenize(code)
+        with self.phase('parse'):
+            ast = Parser.LocatingParser(tokens, self.locations).parse()
+        self.asts.append(ast)
+        if optimize:
+            with self.phase('optimize'):
+                ast = Optimizer.optimize(ast, self.locations)
+            self.asts.append(ast)
+        self.inherit(ast, None)
+        return ast
+
+    def inherit(self, node, line):
+        if isinstance(node, list):
+            for item in node:
+                self.inherit(item, line)
+        elif isinstance(node, tuple):
+            line = self.locations.setdefault(id(node), line)
+            for item in node[1:]:
+                self.inherit(item, line)
+
+    def node_stats(self, node):
+        key = (node[0], self.locations.get(id(node)))
+        stats = self.nodes.get(key)
+        if stats is None:
+            stats = self.nodes[key] = [0, 0.0, 0]
+        return stats
+
+    # Function calls
+
+    def enter(self, name):
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        path = f"{self.stack[-1][1]};{name}" if self.stack else name
+        self.stack.append([name, path, self.clock(), 0.0])
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def leave(self):
+        name, path, start, children = self.stack.pop()
+        total = self.clock() - start
+        own = total - children
+        stats = self.functions[name]
+        stats[1] += own
+        self.active[name] -= 1
+        if not self.active[name]:
+            stats[2] += total
+        if self.stack:
+            self.stack[-1][3] += total
+        self.stacks[path] = self.stacks.get(path, 0.0) + own
+
+    # Reports
+
+    def collapsed_stacks(self):
+        # Weights are microseconds of self time, one stack per line
+        return "".join(f"{path} {round(seconds * 1e6)}\n"
+                       for path, seconds in sorted(self.stacks.items())
+                       if round(seconds * 1e6) > 0)
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as file:
+            file.write(self.collapsed_stacks())
+
+    def report(self, limit=20):
+        lines = ['phases:']
+        for name, seconds in self.phases.items():
+            lines.append(f"  {name:<12}{seconds * 1000:>12.3f} ms")
+        lines.append(f"functions:{'calls':>14}{'self ms':>12}{'total ms':>12}")
+        for name, (calls, own, total) in sorted(
+                self.functions.items(), key=lambda item: -item[1][2]):
+            lines.append(f"  {name:<16}{calls:>8}{own * 1000:>12.3f}{total * 1000:>12.3f}")
+        lines.append(f"nodes (top {limit} by time):{'hits':>6}{'total ms':>12}")
+        ranked = sorted(self.nodes.items(), key=lambda item: -item[1][1])[:limit]
+        for (kind, line), (hits, total, _) in ranked:
+            where = f"line {line}" if line else 'line ?'
+            lines.append(f"  {where:<10}{kind:<15}{hits:>10}{total * 1000:>12.3f}")
+        return "\n".join(lines)
+
+
+class ProfilingCompiler(Compiler.Compiler):
+    def __init__(self, env, profiler):
+        super().__init__(env)
+        self.profiler = profiler
+
+    # The fast path runs the condition and step without their closures, so
+    # they would go uncounted
+    def counted_while(self, node):
+        return None
+
+    def compile(self, node):
+        step = super().compile(node)
+        if not isinstance(node, tuple):
+            return step
+        stats = self.profiler.node_stats(node)
+        clock = self.profiler.clock
+
+        def run_profiled(frame):
+            start = clock()
+            stats[2] += 1
+            try:
+                return step(frame)
+            finally:
+                stats[0] += 1
+                stats[2] -= 1
+                if not stats[2]:
+                    stats[1] += clock() - start
+        return run_profiled
+
+    def func(self, node):
+        define = super().func(node)
+        name = node[1]
+        funcs = self.env.funcs
+        profiler = self.profiler
+
+        def run_profiled_func(frame):
+            label = define(frame)
+            function = funcs[name]
+            body = function.body
+
+            def run_profiled_body(local):
+                profiler.enter(name)
+                try:
+                    return body(local)
+                finally:
+                    profiler.leave()
+            function.body = run_profiled_body
+            return label
+        return run_profiled_func
+
+
+class ProfilingCompiledEnvironment(Compiler.CompiledEnvironment):
+    def __init__(self, profiler, memo=None, budget=None):
+        super().__init__(memo, budget)
+        self.profiler = profiler
+        self.compiler = ProfilingCompiler(self, profiler)
+
+    def evaluate(self, node):
+        with self.profiler.phase('evaluate'):
+            self.profiler.enter(PROGRAM)
+            try:
+                return super().evaluate(node)
+            finally:
+                self.profiler.leave()
+
+
+class ProfilingEnvironment(Evaluator.Environment):
+    counted_loops = False
+
+    def __init__(self, parent=None, profiler=None, memo=None, budget=None):
+        super().__init__(parent, memo, budget)
+        self.profiler = parent.profiler if parent is not None else profiler
+
+    def evaluate(self, node):
+        profiler = self.profiler
+        if isinstance(node, list):
+            # A whole program, or the body of a user function being called
+            name = PROGRAM if self.parent is None else profiler.bodies.get(id(node))
+            if name is None:
+                return super().evaluate(node)
+            with profiler.phase('evaluate') if name is PROGRAM else nullcontext():
+                profiler.enter(name)
+                try:
+                    return super().evaluate(node)
+                finally:
+                    profiler.leave()
+        if not isinstance(node, tuple):
+            return super().evaluate(node)
+        if node[0] == 'func':
+            profiler.bodies[id(node[3])] = node[1]
+        stats = profiler.node_stats(node)
+        start = profiler.clock()
+        stats[2] += 1
+        try:
+            return super().evaluate(node)
+        finally:
+            stats[0] += 1
+            stats[2] -= 1
+            if not stats[2]:
+                stats[1] += profiler.clock() - start
+
+
+ENGINES = {
+    'closure': ProfilingCompiledEnvironment,
+    'tree': lambda profiler, memo=None, budget=None: ProfilingEnvironment(
+        profiler=profiler, memo=memo, budget=budget),
+}
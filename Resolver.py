@@ -0,0 +1,100 @@
+# === Resolver ===
+# Static scopes for the compiled engines. Every function body gets a Scope
+# whose parent is the scope it is declared in; the root scope holds the
+# globals. Names resolve to (depth, slot) pairs at compile time, so frames
+# can be fixed-size lists instead of dicts. Blocks do not open a scope:
+# variables declared inside if/while belong to the enclosing function.
+#
+# A function's scope declares all of its locals before its body is
+# compiled, so a name means the same slot anywhere in the body. That slot
+# may still be UNSET when the name is used: its declaration comes later, or
+# sits in a branch that did not run. The reference then finds the name in
+# an enclosing scope, so engines fall back along candidates().
+
+
+class Unset:
+    def __repr__(self):
+        return '<unset>'
+
+
+# Marks a slot whose declaration has not run yet
+UNSET = Unset()
+
+
+class Scope:
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.slots = {}
+        self.names = []
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def is_global(self):
+        return self.parent is None
+
+    def declare(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = len(self.names)
+            self.slots[name] = slot
+            self.names.append(name)
+        return slot
+
+    # Returns (depth, slot) relative to this scope. Names nobody declared
+    # (yet) resolve to a fresh global slot; reading it before a declaration
+    # runs is the usual "Undefined variable" error.
+    def resolve(self, name):
+        scope = self
+        depth = 0
+        while True:
+            slot = scope.slots.get(name)
+            if slot is not None:
+                return depth, slot
+            if scope.parent is None:
+                return depth, scope.declare(name)
+            scope = scope.parent
+            depth += 1
+
+    # Every (depth, slot) name may live in, innermost first: the slots of
+    # the enclosing scopes that declare it, then the global one. The first
+    # whose declaration has run is the variable.
+    def candidates(self, name):
+        found = []
+        scope = self
+        depth = 0
+        while scope.parent is not None:
+            slot = scope.slots.get(name)
+            if slot is not None:
+                found.append((depth, slot))
+            scope = scope.parent
+            depth += 1
+        found.append((depth, scope.declare(name)))
+        return found
+
+    def scope_at(self, depth):
+        scope = self
+        for _ in range(depth):
+            scope = scope.parent
+        return scope
+
+
+# The declared types of the globals scope holds, read from the global
+# frame's values and types lists as a {name: type} mapping for
+# Checker.check. Only get() is provided, and globals whose declaration has
+# not run are missing. Unlike a dict built from them it costs nothing per
+# evaluate(), which runs once per statement when a file is streamed.
+class SlotTypes:
+    __slots__ = ('scope', 'values', 'types')
+
+    def __init__(self, scope, values, types):
+        self.scope = scope
+        self.values = values
+        self.types = types
+
+    def get(self, name, default=None):
+        slot = self.scope.slots.get(name)
+        if slot is None or slot >= len(self.values) or self.values[slot] is UNSET:
+            return default
+        return self.types[slot]
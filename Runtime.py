@@ -0,0 +1,392 @@
+import operator
+from array import array
+from itertools import repeat
+
+# === Runtime ===
+# Value semantics shared by the compiled execution engines. Every helper here
+# mirrors the matching branch of Evaluator.Environment.evaluate, including its
+# error types and messages, so engines can be diffed against the reference.
+
+# int[] and float[] values: contiguous arrays of 64-bit ints and doubles.
+# Variables hold a reference, so assigning an array or passing it to a
+# function shares it rather than copying it. Converting to an array type
+# returns an array of that type unchanged and copies anything else, element
+# by element, converting each like a scalar of the element type. '+' is
+# elementwise (see elementwise()), not concatenation: engines add two values
+# of the same type with a plain a + b.
+class Array(array):
+    __slots__ = ()
+
+    def __new__(cls, values=()):
+        if type(values) is cls:
+            return values
+        return array.__new__(cls, cls.code, map(cls.element, values))
+
+    # An array of values that already have the element type
+    @classmethod
+    def of(cls, values):
+        return array.__new__(cls, cls.code, values)
+
+    def __add__(self, other):
+        return elementwise('+', self, other)
+
+    def __repr__(self):
+        return '[' + ', '.join(map(str, self)) + ']'
+
+    __str__ = __repr__
+
+
+class IntArray(Array):
+    __slots__ = ()
+    code = 'q'
+    element = int
+
+
+class FloatArray(Array):
+    __slots__ = ()
+    code = 'd'
+    element = float
+
+
+ARRAY_TYPES = {
+    'int[]': IntArray,
+    'float[]': FloatArray
+}
+
+CONVERTERS = {
+    'int': int,
+    'float': float,
+    'string': str,
+    'bool': bool,
+    **ARRAY_TYPES
+}
+
+DECL_TYPES = {
+    'int': int,
+    'float': float,
+    'string': str,
+    'bool': bool,
+    'int[]': Array,
+    'float[]': Array
+}
+
+
+def convert(type_str, value):
+    if value is None:
+        return None
+    converter = CONVERTERS.get(type_str)
+    if converter is None:
+        raise TypeError(f"Unknown type: {type_str}")
+    return converter(value)
+
+
+# A string built up by repeated '+=' on a string variable. The variable's
+# slot holds the builder instead of a str, so appending does not copy what
+# is already there; every read of the variable turns it back into a str
+# with str(), which joins the pieces once. A builder stands for the first
+# count entries of pieces. The builders append() returns share that list,
+# so a builder's value never changes once made.
+class StringBuilder:
+    __slots__ = ('pieces', 'count', 'length')
+
+    def __init__(self, pieces, length):
+        self.pieces = pieces
+        self.count = len(pieces)
+        self.length = length
+
+    def append(self, text):
+        pieces = self.pieces
+        if len(pieces) != self.count:
+            pieces = pieces[:self.count]
+        pieces.append(text)
+        return StringBuilder(pieces, self.length + len(text))
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        if self.count > 1:
+            self.pieces = [''.join(self.pieces[:self.count])]
+            self.count = 1
+        return self.pieces[0]
+
+    def __repr__(self):
+        return repr(str(self))
+
+
+# left + right for a string variable holding left (a str or StringBuilder)
+def append(left, right):
+    if type(left) is StringBuilder:
+        return left.append(right)
+    return StringBuilder([left, right], len(left) + len(right))
+
+
+# x op= right on a variable declared type_str that holds left
+def compound(type_str, op, left, right):
+    if op == '+' and type(right) is str:
+        if type(left) is str or type(left) is StringBuilder:
+            return append(left, right)
+    elif type(left) is StringBuilder:
+        left = str(left)
+    return convert(type_str, BINARY[op](left, right))
+
+
+def check_decl(type_str, value):
+    expected = DECL_TYPES.get(type_str)
+    if expected is not None and value is not None and not isinstance(value, expected):
+        raise RuntimeError(
+            f"Expected {type_str}, got {type(value).__name__}")
+    return value
+
+
+# Arithmetic operators
+
+def add(left, right):
+    if type(left) != type(right):
+        if isinstance(left, Array) or isinstance(right, Array):
+            return elementwise('+', left, right)
+        raise TypeError(
+            f"Type mismatch for '+': {type(left).__name__} and {type(right).__name__}")
+    return left + right
+
+
+def sub(left, right):
+    if right is None:  # the reference treats a missing right operand as unary
+        return neg(left)
+    if isinstance(left, Array) or isinstance(right, Array):
+        return elementwise('-', left, right)
+    if type(left) != type(right):
+        raise TypeError(
+            f"Type mismatch for '-': {type(left).__name__} and {type(right).__name__}")
+    if not isinstance(left, (int, float)):
+        raise TypeError(
+            f"Unsupported operand type for '-': {type(left).__name__}")
+    return left - right
+
+
+def neg(value):
+    if isinstance(value, Array):
+        return type(value).of(map(operator.neg, value))
+    if not isinstance(value, (int, float)):
+        raise TypeError(
+            f"Unsupported operand type for unary '-': {type(value).__name__}")
+    return -value
+
+
+def mul(left, right):
+    if isinstance(left, Array) or isinstance(right, Array):
+        return elementwise('*', left, right)
+    if type(left) != type(right):
+        raise TypeError(
+            f"Type mismatch for '*': {type(left).__name__} and {type(right).__name__}")
+    if not isinstance(left, (int, float)):
+        raise TypeError(
+            f"Unsupported operand type for '*': {type(left).__name__}")
+    return left * right
+
+
+def div(left, right):
+    if isinstance(left, Array) or isinstance(right, Array):
+        return elementwise('/', left, right)
+    if not isinstance(left, (int, float)) or not isinstance(right, (int, float)):
+        raise TypeError(
+            f"Unsupported operand type for '/': {type(left).__name__} and {type(right).__name__}")
+    if right == 0:
+        raise ZeroDivisionError("division by zero")
+    return left // right if isinstance(left, int) and isinstance(right, int) else float(left) / float(right)
+
+
+ELEMENTWISE = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul
+}
+
+
+# left op right where either side is an array: two arrays of the same type
+# and length combine element by element, and an array with a scalar of its
+# element type applies the scalar to every element. '/' divides like it does
+# on scalars, so int[] / int floors. The loop runs in map(), not per element
+# in the engine.
+def elementwise(op, left, right):
+    array_type = type(left) if isinstance(left, Array) else type(right)
+    for operand in (left, right):
+        if type(operand) is not array_type and type(operand) is not array_type.element:
+            raise TypeError(
+                f"Type mismatch for '{op}': {type(left).__name__} and {type(right).__name__}")
+    if op == '/':
+        if 0 in right if type(right) is array_type else right == 0:
+            raise ZeroDivisionError("division by zero")
+        function = operator.floordiv if array_type is IntArray else operator.truediv
+    else:
+        function = ELEMENTWISE[op]
+    if type(left) is not array_type:
+        return array_type.of(map(function, repeat(left), right))
+    if type(right) is not array_type:
+        return array_type.of(map(function, left, repeat(right)))
+    if len(left) != len(right):
+        raise ValueError(f"Length mismatch for '{op}': {len(left)} and {len(right)}")
+    return array_type.of(map(function, left, right))
+
+
+# [a, b, ...]: an int[] when every element is an int, a float[] when every
+# element is a float. [] is an empty int[], which converts to any array type.
+def make_array(values):
+    kinds = set(map(type, values))
+    if kinds <= {int}:
+        return IntArray.of(values)
+    if kinds == {float}:
+        return FloatArray.of(values)
+    names = ' and '.join(sorted(kind.__name__ for kind in kinds))
+    raise TypeError(f"Array elements must all be int or all be float, got {names}")
+
+
+# Logical and comparison operators
+
+def logical_or(left, right):
+    return left or right
+
+
+def logical_and(left, right):
+    return left and right
+
+
+def eq(left, right):
+    return left == right
+
+
+def ne(left, right):
+    return left != right
+
+
+def le(left, right):
+    return left <= right
+
+
+def ge(left, right):
+    return left >= right
+
+
+def lt(left, right):
+    return left < right
+
+
+def gt(left, right):
+    return left > right
+
+
+def logical_not(value):
+    return not value
+
+
+BINARY = {
+    '+': add,
+    '-': sub,
+    '*': mul,
+    '/': div,
+    '||': logical_or,
+    '&&': logical_and,
+    '==': eq,
+    '!=': ne,
+    '<=': le,
+    '>=': ge,
+    '<': lt,
+    '>': gt
+}
+
+UNARY = {
+    '-': neg,
+    '!': logical_not
+}
+
+
+# Builtin functions
+
+def builtin_print(*args):
+    print(*args)
+
+
+def to_int(*args):
+    return int(args[0])
+
+
+def to_string(*args):
+    return str(args[0])
+
+
+def to_float(*args):
+    return float(args[0])
+
+
+BUILTINS = {
+    'print': builtin_print,
+    'toInt': to_int,
+    'toString': to_string,
+    'toFloat': to_float
+}
+
+
+# Array builtins
+
+def expect_array(name, value):
+    if not isinstance(value, Array):
+        raise TypeError(f"{name}() expects an int[] or float[], got {type(value).__name__}")
+    return value
+
+
+def array_len(value):
+    return len(expect_array('len', value))
+
+
+def array_append(values, value):
+    expect_array('append', values).append(value)
+
+
+def array_sum(values):
+    return sum(expect_array('sum', values), values.element())
+
+
+def array_min(values):
+    if not expect_array('min', values):
+        raise ValueError("min() of an empty array")
+    return min(values)
+
+
+def array_max(values):
+    if not expect_array('max', values):
+        raise ValueError("max() of an empty array")
+    return max(values)
+
+
+# A sorted copy; the array itself is left as it is
+def array_sort(values):
+    expect_array('sort', values)
+    return type(values).of(sorted(values))
+
+
+# count copies of value, e.g. fill(n, 0.0) for a float[] of n zeros
+def array_fill(count, value):
+    array_type = ELEMENT_ARRAYS.get(type(value))
+    if array_type is None:
+        raise TypeError(f"fill() expects an int or float value, got {type(value).__name__}")
+    values = array_type.of([value])
+    values *= count
+    return values
+
+
+ELEMENT_ARRAYS = {
+    int: IntArray,
+    float: FloatArray
+}
+
+# Unlike BUILTINS, a user function of the same name takes precedence over
+# these, so programs that define their own max() or sum() keep working
+ARRAY_BUILTINS = {
+    'len': array_len,
+    'append': array_append,
+    'sum': array_sum,
+    'min': array_min,
+    'max': array_max,
+    'sort': array_sort,
+    'fill': array_fill
+}
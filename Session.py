@@ -0,0 +1,62 @@
+import Lexer
+import Optimizer
+import Parser
+
+# === Interactive session ===
+# A long-lived interpreter for the console and for tools that drive one
+# over a pipe. Input arrives a line at a time; a line that leaves a block,
+# a parenthesis, a string or a comment open is kept until the rest of the
+# input arrives. Errors propagate to the caller but leave the session
+# usable: the environment keeps every variable and function defined so far,
+# and each input only compiles its own statements, so redefining a function
+# recompiles just that function.
+
+
+class Session:
+    def __init__(self, env, optimize=False):
+        self.env = env
+        self.optimize = optimize
+        self.lines = []  # the incomplete input so far
+
+    @property
+    def pending(self):
+        return bool(self.lines)
+
+    # Drops an incomplete input, e.g. after Ctrl-C at a continuation prompt
+    def reset(self):
+        self.lines.clear()
+
+    # With partial=True, returns None instead of failing when code could
+    # still become valid input with more lines
+    def parse(self, code, partial=False):
+        if partial and Lexer.unterminated(code):
+            return None
+        parser = Parser.Parser(Lexer.iter_tokens(code))
+        try:
+            ast = parser.parse()
+        except SyntaxError:
+            if partial and parser.peek() == 'EOF':
+                return None
+            raise
+        return Optimizer.optimize(ast) if self.optimize else ast
+
+    # Runs one complete input and returns the value of its last statement
+    def run(self, code):
+        return self.env.evaluate(self.parse(code))
+
+    # Adds a line of input. Returns True while the input needs more lines;
+    # otherwise runs it.
+    def push(self, line):
+        if not self.lines and not line.strip():
+            return False
+        self.lines.append(line)
+        try:
+            ast = self.parse("\n".join(self.lines), partial=True)
+        except SyntaxError:
+            self.lines.clear()
+            raise
+        if ast is None:
+            return True
+        self.lines.clear()
+        self.env.evaluate(ast)
+        return False
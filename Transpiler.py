@@ -0,0 +1,921 @@
+import math
+
+import Checker
+import Output
+import Runtime
+
+# === Python transpiler ===
+# The python engine translates each program's Parser AST into the source of
+# a Python module and runs it through CPython's own compile() and exec(), so
+# loops and calls run as Python bytecode rather than as closures or VM
+# instructions. mylang functions become Python functions and if/while map
+# onto Python's. Globals live in the module's globals dict, function locals
+# are locals of the generated def, and variables of enclosing functions are
+# closure cells. Names resolve like Resolver.Scope.candidates resolves them:
+# where a declaration may not have run yet, the generated code tests for it
+# in locals() and falls back to enclosing variables and then the global.
+# Names are mangled so they cannot clash with each other or with the
+# runtime helpers the module sees as its builtins:
+#     global x -> x_    x local to a function nested n deep -> x_n
+#     function f -> f_fn    temporaries -> _1, _2, ...
+# Declared types are kept the way the compiled engines keep them: values
+# are converted when stored, Runtime's operators raise the reference's
+# errors, and an operator whose operands have the same static type
+# (Checker) runs as the plain Python operator once they are known not to be
+# None.
+#
+# Modules are plain text, so they can be printed (main.py --emit-python) and
+# their compiled code cached (Cache.compile_module). With source locations
+# from Parser.LocatingParser each generated statement is marked with the
+# .mylang line it came from, and errors get a note naming that line.
+
+# Python precedence of the expressions the transpiler writes, lowest first
+CONDITIONAL, OR, AND, NOT, COMPARE, SUM, PRODUCT, UNARY, ATOM = range(9)
+
+PYTHON_OPERATORS = {
+    '+': ('+', SUM),
+    '-': ('-', SUM),
+    '*': ('*', PRODUCT),
+    '/': ('/', PRODUCT),
+    '==': ('==', COMPARE),
+    '!=': ('!=', COMPARE),
+    '<=': ('<=', COMPARE),
+    '>=': ('>=', COMPARE),
+    '<': ('<', COMPARE),
+    '>': ('>', COMPARE),
+    '&&': ('and', AND),
+    '||': ('or', OR)
+}
+
+# Runtime operator for each arithmetic operator, by its name among the helpers
+HELPERS = {
+    '+': 'add',
+    '-': 'sub',
+    '*': 'mul',
+    '/': 'div'
+}
+
+CONVERSIONS = {
+    'toInt': ('int', 'to_int'),
+    'toString': ('str', 'to_string'),
+    'toFloat': ('float', 'to_float')
+}
+
+
+# Whether evaluating node may call a user function, which can change any
+# variable
+def calls(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, tuple):
+            if node[0] == 'call':
+                if node[1] not in Runtime.BUILTINS:
+                    return True
+                stack.extend(node[2])
+            elif node[0] == 'array':
+                stack.extend(node[1])
+            else:
+                stack.extend(node[1:])
+    return False
+
+
+# Whether running node, a statement, expression or list of them, may call a
+# user function, which takes budget steps of its own. Function definitions
+# do not run their bodies.
+def may_call(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, tuple) and node[0] != 'func':
+            if node[0] == 'call' and node[1] not in Runtime.BUILTINS:
+                return True
+            stack.extend(node[1:])
+    return False
+
+
+# Whether an expression of a known static type can still be None
+def may_be_none(node):
+    if not isinstance(node, tuple):
+        return node is None
+    if node[0] == 'call':
+        return node[1] not in Checker.BUILTIN_TYPES
+    return node[0] in ('var', '&&', '||')
+
+
+def literal(value):
+    if type(value) is int and value.bit_length() > 1024:
+        # Python limits the digits of decimal literals, not of hex ones
+        return hex(value), UNARY if value < 0 else ATOM
+    if type(value) is float and not math.isfinite(value):
+        return f"float({str(value)!r})", ATOM
+    if isinstance(value, (bool, int, float, str, type(None))):
+        text = repr(value)
+        return text, UNARY if text.startswith('-') else ATOM
+    raise TypeError(f"Invalid AST node: {value}")
+
+
+# The mylang variable a NameError of the generated code is about, or None
+def undefined_name(error):
+    message = str(error)
+    if not message.startswith(("name '", "cannot access ")):
+        return None
+    name, underscore, depth = message.split("'")[1].rpartition('_')
+    if name and underscore and (depth == '' or depth.isdigit()):
+        return name
+    return None
+
+
+class Module:
+    __slots__ = ('source', 'lines', 'filename')
+
+    def __init__(self, source, lines, filename):
+        self.source = source      # Python source defining program()
+        self.lines = lines        # .mylang line of each source line, or None
+        self.filename = filename  # the code's co_filename
+
+    def __repr__(self):
+        return f"<module {self.filename}, {len(self.lines)} lines>"
+
+    # .mylang line of the innermost frame of this module in a traceback
+    def line_of(self, traceback):
+        line = None
+        while traceback is not None:
+            if traceback.tb_frame.f_code.co_filename == self.filename:
+                number = traceback.tb_lineno
+                if 0 < number <= len(self.lines):
+                    line = self.lines[number - 1]
+            traceback = traceback.tb_next
+        return line
+
+
+class Scope:
+    # One generated def: the program (depth 0) or a function body
+    __slots__ = ('parent', 'depth', 'types', 'return_type', 'declared', 'definite',
+                 'globals', 'nonlocals', 'loops', 'temps', 'countdown')
+
+    def __init__(self, parent=None, types=None, return_type=None):
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.types = types or {}  # name -> {declared type, ...}, see Checker.declared_types
+        self.return_type = return_type
+        self.declared = set()     # names declared so far, in source order
+        self.definite = set()     # names certainly declared at this point
+        self.globals = set()      # Python names the def assigns as globals
+        self.nonlocals = set()    # ... and as variables of enclosing defs
+        self.loops = 0            # loops around the statement being written
+        self.temps = 0
+        self.countdown = None     # local holding budget.countdown, see while_stmt
+
+    def temp(self):
+        self.temps += 1
+        return f"_{self.temps}"
+
+
+class Transpiler:
+    def __init__(self, env, types):
+        self.env = env
+        self.types = types  # Checker.TypeChecker.types for the program
+        self.locations = env.locations or {}
+        self.scope = Scope()
+        self.out = []       # [indent, text, line]
+        self.indent = 0
+        self.line = None
+        sized = env.budget is not None and env.budget.value_size is not None
+        self.sized = sized
+
+    def module(self, statements):
+        self.emit('def program():')
+        self.indent += 1
+        self.body(statements, self.scope)
+        self.indent -= 1
+        source = []
+        lines = []
+        shown = None
+        for indent, text, line in self.out:
+            if line is not None and line != shown:
+                text += f"  # line {line}"
+                shown = line
+            source.append('    ' * indent + text)
+            lines.append(line)
+        return Module("\n".join(source) + "\n", lines, f"<{self.env.filename}.py>")
+
+    def emit(self, text):
+        self.out.append([self.indent, text, self.line])
+
+    # Writes a def's body, preceded by the global and nonlocal statements
+    # it turns out to need
+    def body(self, statements, scope):
+        start = len(self.out)
+        self.block(statements, tail=True)
+        declarations = []
+        if scope.globals:
+            declarations.append('global ' + ', '.join(sorted(scope.globals)))
+        if scope.nonlocals:
+            declarations.append('nonlocal ' + ', '.join(sorted(scope.nonlocals)))
+        self.out[start:start] = [[self.indent, text, None] for text in declarations]
+
+    def typed(self, node):
+        return Checker.static_type(self.types, node)
+
+    # Names
+
+    # The variables name may refer to, innermost first, as (Python name,
+    # scope) pairs ending with the global (scope None): every def around
+    # this one that declares name, up to one where the declaration has
+    # certainly run by now
+    def candidates(self, name):
+        found = []
+        scope = self.scope
+        while scope.parent is not None:
+            if name in scope.types:
+                found.append((f"{name}_{scope.depth}", scope))
+                if name in scope.definite:
+                    return found
+            scope = scope.parent
+        found.append((name + '_', None))
+        return found
+
+    def load(self, name):
+        found = self.candidates(name)
+        text = found[-1][0]
+        if len(found) == 1:
+            return text
+        for target, _ in reversed(found[:-1]):
+            text = f"{target} if {target!r} in locals() else {text}"
+        return f"({text})"
+
+    # Declares the Python name of a candidate as global or nonlocal when the
+    # def being written assigns it
+    def store(self, target, scope):
+        if scope is None:
+            self.scope.globals.add(target)
+        elif scope is not self.scope:
+            self.scope.nonlocals.add(target)
+        return target
+
+    # Writes an update of name with write(target, scope, certain) for its
+    # one candidate, or for each candidate under a test picking the first
+    # whose declaration has run. certain is whether target is known to be
+    # declared there.
+    def branches(self, name, write):
+        found = self.candidates(name)
+        if len(found) == 1:
+            write(*found[0], self.is_certain(name))
+            return
+        keyword = 'if'
+        for target, scope in found[:-1]:
+            self.emit(f"{keyword} {target!r} in locals():")
+            keyword = 'elif'
+            self.indent += 1
+            write(target, scope, True)
+            self.indent -= 1
+        self.emit('else:')
+        self.indent += 1
+        write(*found[-1], False)
+        self.indent -= 1
+
+    # Declared type of the candidate of name in scope as Python source: a
+    # literal when it is known statically, otherwise the globals' type table
+    # or, for a local with declarations of several types, the variable
+    # recording which one ran
+    def declared_type(self, name, static, scope):
+        if static is not None:
+            return repr(static)
+        if scope is None:
+            return f"types[{name!r}]"
+        declared = scope.types[name]
+        if len(declared) == 1:
+            return repr(next(iter(declared)))
+        return f"{name}_{scope.depth}t"
+
+    # Statements
+
+    def block(self, statements, tail=False):
+        if not statements:
+            self.emit(self.result('None') if tail else 'pass')
+            return
+        last = len(statements) - 1
+        for i, stmt in enumerate(statements):
+            self.statement(stmt, tail and i == last)
+
+    # A nested block: declarations in it are not certain after it
+    def inner_block(self, statements, tail=False):
+        definite = set(self.scope.definite)
+        self.indent += 1
+        self.block(statements, tail)
+        self.indent -= 1
+        self.scope.definite = definite
+
+    # The statement that makes value (Python source, of static type
+    # value_type) the result of the def being written
+    def result(self, value, value_type=None):
+        return_type = self.scope.return_type
+        if return_type and value_type != return_type:
+            value = f"convert({return_type!r}, {value})"
+        return f"return {value}"
+
+    def statement(self, node, tail=False):
+        outer = self.line
+        self.line = self.locations.get(id(node), outer)
+        self.scope.temps = 0
+        kind = node[0] if isinstance(node, tuple) else None
+        match kind:
+            case 'decl':
+                self.decl(node, tail)
+            case 'assign':
+                self.assign(node, tail)
+            case 'compound':
+                self.compound(node, tail)
+            case 'index_assign':
+                self.index_assign(node, tail)
+            case 'func':
+                self.func(node, tail)
+            case 'return':
+                self.return_stmt(node)
+            case 'if':
+                self.if_stmt(node, tail)
+            case 'while':
+                self.while_stmt(node, tail)
+            case _:
+                expr = node[1] if kind == 'expr_stmt' else node
+                text = self.text(expr)
+                self.emit(self.result(text, self.typed(expr)) if tail else text)
+        self.line = outer
+
+    def decl(self, node, tail):
+        _, type_str, name, expr = node
+        scope = self.scope
+        value = self.text(expr)
+        if self.typed(expr) != type_str:
+            stored = f"convert({type_str!r}, check_decl({type_str!r}, {{}}))"
+        else:
+            stored = '{}'
+        # A local declared for the first time in source order, outside loops,
+        # cannot have been declared already
+        first = name not in scope.declared and not scope.loops
+        if scope.parent is None:
+            target = name + '_'
+            scope.globals.add(target)
+            temp = scope.temp()
+            self.emit(f"{temp} = {value}")
+            self.emit(f"if {target!r} in namespace:")
+            self.emit(f"    redeclared({name!r})")
+            self.emit(f"{target} = {stored.format(temp)}")
+            self.emit(f"types[{name!r}] = {type_str!r}")
+            result = temp
+        else:
+            target = f"{name}_{scope.depth}"
+            if first and stored == '{}':
+                self.emit(f"{target} = {value}")
+                result = target
+            elif first and not tail:
+                self.emit(f"{target} = {stored.format(value)}")
+                result = None
+            else:
+                temp = scope.temp()
+                self.emit(f"{temp} = {value}")
+                if not first:
+                    self.emit(f"if {target!r} in locals():")
+                    self.emit(f"    redeclared({name!r})")
+                self.emit(f"{target} = {stored.format(temp)}")
+                result = temp
+            if len(scope.types.get(name, ())) > 1:
+                self.emit(f"{target}t = {type_str!r}")
+        scope.declared.add(name)
+        scope.definite.add(name)
+        if tail:
+            self.emit(self.result(result, self.typed(expr)))
+
+    def assign(self, node, tail):
+        self.branches(node[1], lambda target, scope, certain:
+                      self.assign_to(node, target, scope, certain, tail))
+
+    def assign_to(self, node, target, scope, certain, tail):
+        name, expr = node[1], node[2]
+        value = self.text(expr)
+        static = self.types.get(id(node))
+        if static is None or self.typed(expr) != static:
+            value = f"convert({self.declared_type(name, static, scope)}, {value})"
+        self.store(target, scope)
+        if not certain:
+            self.emit(target)  # raises the usual NameError when undeclared
+        self.emit(f"{target} = {value}")
+        if tail:
+            self.emit(self.result(target, static))
+
+    # x += e and x -= e update x in place when both sides have its type,
+    # which lets CPython append to a local string without copying it
+    def compound(self, node, tail):
+        self.branches(node[1], lambda target, scope, certain:
+                      self.compound_to(node, target, scope, certain, tail))
+
+    def compound_to(self, node, target, scope, certain, tail):
+        _, name, op, expr = node
+        static = self.types.get(id(node))
+        self.store(target, scope)
+        helper = HELPERS[op]
+        kind = self.operand_kind(expr) if not calls(expr) else None
+        if (kind is not None and self.typed(expr) == static
+                and (static in ('int', 'float') or static == 'string' and op == '+')):
+            value = self.text(expr)
+            guard = f"{target} is not None"
+            if kind == 'var':
+                guard += f" and {value} is not None"
+            self.emit(f"if {guard}:")
+            if static == 'string' and scope is not self.scope:
+                # CPython only appends in place to a str that a local of
+                # the running def holds alone; a global or enclosing
+                # variable would be copied by every append. The piece is
+                # computed first, since it may read the variable.
+                self.indent += 1
+                if kind != 'literal':
+                    piece = self.scope.temp()
+                    self.emit(f"{piece} = {value}")
+                    value = piece
+                text = self.scope.temp()
+                self.emit(f"{text} = {target}")
+                self.emit(f"{target} = None")
+                self.emit(f"{text} += {value}")
+                self.emit(f"{target} = {text}")
+                self.emit(f"{text} = None")
+                self.indent -= 1
+            else:
+                self.emit(f"    {target} {op}= {value}")
+            self.emit('else:')
+            self.emit(f"    {target} = convert({static!r}, {helper}({target}, {value}))")
+        else:
+            value = self.text(expr)
+            if static is None and not certain:
+                self.emit(target)  # before looking up its type
+            self.emit(f"{target} = convert({self.declared_type(name, static, scope)}, "
+                      f"{helper}({target}, {value}))")
+        if self.sized:
+            self.emit(f"check_value({target})")
+        if tail:
+            self.emit(self.result(target, static))
+
+    # xs[i] = e: the variable is read first, then i, then e
+    def index_assign(self, node, tail):
+        _, name, index, expr = node
+        target = self.load(name)
+        index_text = self.text(index)
+        if not tail and self.is_certain(name) and not calls(expr) and (
+                not isinstance(index, tuple) or index[0] == 'var' and self.is_certain(index[1])):
+            self.emit(f"{target}[{index_text}] = {self.text(expr)}")
+            return
+        array, key, value = self.scope.temp(), self.scope.temp(), self.scope.temp()
+        self.emit(f"{array} = {target}")
+        self.emit(f"{key} = {index_text}")
+        self.emit(f"{value} = {self.text(expr)}")
+        self.emit(f"{array}[{key}] = {value}")
+        if tail:
+            self.emit(self.result(value, self.typed(expr)))
+
+    def is_certain(self, name):
+        (_, scope), *others = self.candidates(name)
+        if others:
+            return False
+        if scope is None:
+            return self.scope.parent is None and name in self.scope.definite
+        return scope is self.scope and name in scope.definite
+
+    def func(self, node, tail):
+        name, params, body = node[1], node[2], node[3]
+        return_type = node[4] if len(node) > 4 else None
+        types = Checker.declared_types(body)
+        for param_type, param_name in params:
+            types.setdefault(param_name, set()).add(param_type)
+        outer = self.scope
+        scope = self.scope = Scope(outer, types, return_type)
+        names = []
+        for param_type, param_name in params:
+            scope.declared.add(param_name)
+            scope.definite.add(param_name)
+            names.append(f"{param_name}_{scope.depth}")
+        env = self.env
+        memoized = env.memo is not None and name in env.memo.pure
+        budget = env.budget is not None and not memoized
+        if memoized:
+            # memoized() checks and converts the arguments
+            self.emit(f"def {name}_fn({', '.join(names)}):")
+            self.indent += 1
+        else:
+            self.emit(f"def {name}_fn(*args):")
+            self.indent += 1
+            self.emit(f"if len(args) != {len(params)}:" if params else 'if args:')
+            self.emit(f"    arity({name!r}, {len(params)}, args)")
+            if params:
+                self.emit(f"{', '.join(names)}, = args")
+            for (param_type, _), param in zip(params, names):
+                self.emit(f"if type({param}) is not {Checker.PY_NAMES[param_type]}:")
+                self.emit(f"    {param} = convert({param_type!r}, {param})")
+        for param_type, param_name in params:
+            if len(types[param_name]) > 1:
+                self.emit(f"{param_name}_{scope.depth}t = {param_type!r}")
+        if budget:
+            self.emit('budget.enter()')
+            self.emit('try:')
+            self.indent += 1
+        self.body(body, scope)
+        if budget:
+            self.indent -= 1
+            self.emit('finally:')
+            self.emit('    budget.depth -= 1')
+        self.indent -= 1
+        self.scope = outer
+        if env.memo is not None:
+            self.emit(f"memo.invalidate({name!r})")
+        if memoized:
+            param_types = ''.join(f"{param_type!r}, " for param_type, _ in params)
+            self.emit(f"funcs[{name!r}] = memoized({name!r}, {name}_fn, ({param_types}))")
+        else:
+            self.emit(f"funcs[{name!r}] = {name}_fn")
+        if tail:
+            self.emit(self.result(repr(f"<function {name}>"), 'string'))
+
+    def return_stmt(self, node):
+        value = self.text(node[1])
+        if self.scope.countdown is not None:
+            self.emit(f"budget.countdown = {self.scope.countdown}")
+        if self.scope.parent is None:
+            self.emit(f"return returned({value})")
+        else:
+            self.emit(self.result(value, self.typed(node[1])))
+
+    def if_stmt(self, node, tail):
+        self.emit(f"if {self.text(node[1])}:")
+        self.inner_block(node[2], tail)
+        orelse = node[3] if len(node) > 3 else None
+        while (orelse is not None and len(orelse) == 1 and isinstance(orelse[0], tuple)
+               and orelse[0][0] == 'if'):
+            # else { if ... } becomes elif, so chains do not nest
+            node = orelse[0]
+            outer = self.line
+            self.line = self.locations.get(id(node), outer)
+            self.emit(f"elif {self.text(node[1])}:")
+            self.line = outer
+            self.inner_block(node[2], tail)
+            orelse = node[3] if len(node) > 3 else None
+        if orelse is not None:
+            self.emit('else:')
+            self.inner_block(orelse, tail)
+        elif tail:
+            self.emit(self.result('None'))
+
+    # Without user calls in the loop nothing else takes budget steps while it
+    # runs, so the countdown lives in a local (shared with the loops inside)
+    # and is written back for check(), a return and the end of the loop
+    def while_stmt(self, node, tail):
+        budget = self.env.budget is not None
+        countdown = self.scope.countdown
+        local = budget and countdown is None and not may_call(node)
+        if local:
+            countdown = self.scope.countdown = '_countdown'
+            self.emit(f"{countdown} = budget.countdown")
+        self.emit(f"while {self.text(node[1])}:")
+        if countdown is not None:
+            self.emit(f"    {countdown} -= 1")
+            self.emit(f"    if {countdown} <= 0:")
+            self.emit(f"        budget.countdown = {countdown}")
+            self.emit('        budget.check()')
+            self.emit(f"        {countdown} = budget.countdown")
+        elif budget:
+            self.emit('    budget.countdown -= 1')
+            self.emit('    if budget.countdown <= 0:')
+            self.emit('        budget.check()')
+        self.scope.loops += 1
+        self.inner_block(node[2])
+        self.scope.loops -= 1
+        if local:
+            self.emit(f"budget.countdown = {countdown}")
+            self.scope.countdown = None
+        if tail:
+            self.emit(self.result('None'))
+
+    # Expressions, as (Python source, precedence)
+
+    def text(self, node, precedence=CONDITIONAL):
+        text, own = self.expr(node)
+        return f"({text})" if own < precedence else text
+
+    def expr(self, node):
+        if not isinstance(node, tuple):
+            return literal(node)
+        op = node[0]
+        if op == 'var':
+            return self.load(node[1]), ATOM
+        if op in HELPERS:
+            if len(node) == 2:
+                return self.negation(node)
+            text = self.arithmetic(node)
+            if self.sized and op in ('+', '*'):
+                return f"check_value({text[0]})", ATOM
+            return text
+        if op in PYTHON_OPERATORS and len(node) == 3:
+            symbol, precedence = PYTHON_OPERATORS[op]
+            if precedence == COMPARE:
+                # Python would chain a < b < c
+                left = self.text(node[1], SUM)
+                right = self.text(node[2], SUM)
+            else:
+                left = self.text(node[1], precedence)
+                right = self.text(node[2], precedence + 1)
+            return f"{left} {symbol} {right}", precedence
+        if op == '!':
+            return f"not {self.text(node[1], NOT)}", NOT
+        if op == 'array':
+            text = f"make_array([{', '.join(self.text(item) for item in node[1])}])"
+            if self.sized:
+                return f"check_value({text})", ATOM
+            return text, ATOM
+        if op == 'index':
+            return f"{self.text(node[1], ATOM)}[{self.text(node[2])}]", ATOM
+        if op == 'call':
+            return self.call(node), ATOM
+        raise TypeError(f"Invalid AST node: {node}")
+
+    def call(self, node):
+        name, args = node[1], node[2]
+        texts = [self.text(arg) for arg in args]
+        if name == 'print':
+            return f"env.output.print([{', '.join(texts)}])"
+        if name in CONVERSIONS:
+            python, helper = CONVERSIONS[name]
+            if len(texts) == 1:
+                return f"{python}({texts[0]})"
+            return f"{helper}({', '.join(texts)})"
+        if any(map(calls, args)):
+            # The arguments may (re)define the function, so it is looked up
+            # after they ran
+            return f"call({', '.join([repr(name)] + texts)})"
+        return f"funcs[{name!r}]({', '.join(texts)})"
+
+    # How an operand can take part in a typed operation: a literal, a
+    # variable (which may be None), any other value of the static type, or
+    # None when the operation has to go through Runtime
+    def operand_kind(self, node):
+        if not isinstance(node, tuple):
+            return 'literal'
+        if node[0] == 'var':
+            return 'var'
+        return None if may_be_none(node) else 'value'
+
+    def arithmetic(self, node):
+        op, left, right = node
+        static = self.typed(left)
+        if (static == self.typed(right) and not calls(left) and not calls(right)
+                and (static in ('int', 'float') or static == 'string' and op == '+')):
+            text = self.typed_arithmetic(op, static, left, right)
+            if text is not None:
+                return text
+        return f"{HELPERS[op]}({self.text(left)}, {self.text(right)})", ATOM
+
+    # Both operands have the same static type, so the Python operator can
+    # only fail on None, or on a zero divisor; checks for those pick the
+    # Runtime operator instead, which raises the reference's error. Each
+    # operand is evaluated once and in order: values that need a check but
+    # are not plain variables go through temporaries.
+    def typed_arithmetic(self, op, static, left, right):
+        kinds = [self.operand_kind(left), self.operand_kind(right)]
+        if None in kinds:
+            return None
+        symbol, precedence = PYTHON_OPERATORS[op]
+        if op == '/':
+            if kinds[1] == 'value' or kinds[1] == 'literal' and not right:
+                return None
+            if static == 'int':
+                symbol = '//'
+        if 'var' not in kinds:
+            return (f"{self.text(left, precedence)} {symbol} {self.text(right, precedence + 1)}",
+                    precedence)
+        operands = []
+        checks = []
+        for operand, kind in zip((left, right), kinds):
+            if kind == 'literal':
+                operands.append(self.text(operand, UNARY))
+            elif kind == 'var':
+                name = self.load(operand[1])
+                operands.append(name)
+                checks.append((name if operand is right and op == '/'
+                               else f"{name} is not None", False))
+            else:
+                temp = self.scope.temp()
+                operands.append(temp)
+                checks.append((f"({temp} := {self.text(operand)}) is not None", True))
+        if len(checks) == 2 and not checks[0][1] and checks[1][1]:
+            # A check that short-circuits would skip evaluating the temporary
+            condition = ' & '.join(f"({check})" for check, _ in checks)
+        else:
+            condition = ' and '.join(check for check, _ in checks)
+        a, b = operands
+        return (f"{a} {symbol} {b} if {condition} else {HELPERS[op]}({a}, {b})",
+                CONDITIONAL)
+
+    def negation(self, node):
+        operand = node[1]
+        if self.typed(operand) in ('int', 'float'):
+            kind = self.operand_kind(operand)
+            if kind == 'var':
+                name = self.load(operand[1])
+                return f"-{name} if {name} is not None else neg({name})", CONDITIONAL
+            if kind is not None:
+                return f"-{self.text(operand, UNARY)}", UNARY
+        return f"neg({self.text(operand)})", ATOM
+
+
+class Functions(dict):
+    # The function table. Generated code calls funcs[name](...), so a name
+    # without a user function gives the array builtin of that name, or a
+    # function raising the reference's error once the arguments have run.
+    __slots__ = ('array_builtins',)
+
+    def __init__(self, array_builtins):
+        super().__init__()
+        self.array_builtins = array_builtins
+
+    def __missing__(self, name):
+        builtin = self.array_builtins.get(name)
+        if builtin is not None:
+            return builtin
+
+        def unknown(*args):
+            raise NameError(f"Unknown function: {name}")
+        return unknown
+
+
+# The declared types of the globals a PythonEnvironment holds, as the
+# {name: type} mapping Checker.check takes; see Resolver.SlotTypes
+class GlobalTypes:
+    __slots__ = ('namespace', 'types')
+
+    def __init__(self, namespace, types):
+        self.namespace = namespace
+        self.types = types
+
+    def get(self, name, default=None):
+        if name + '_' not in self.namespace:
+            return default
+        return self.types.get(name, default)
+
+
+class PythonEnvironment:
+    # Global state for the python engine: the globals dict generated modules
+    # run in, the declared type of every global and the function table.
+    # They outlive a single evaluate() so console input keeps earlier
+    # declarations.
+    def __init__(self, memo=None, budget=None):
+        self.funcs = Functions(
+            budget.array_builtins if budget is not None else Runtime.ARRAY_BUILTINS)
+        self.types = {}   # global name -> declared type
+        self.memo = memo  # Memo.Memoizer when pure functions are cached
+        self.budget = budget  # Budget.Budget limiting each evaluate()
+        self.output = Output.Output(buffer_size=0)  # where print writes
+        self.returning = False  # the last evaluate() ended in a top-level return
+        self.filename = 'mylang'  # the program's file, for error notes
+        self.locations = None     # {id(node): line} from Parser.LocatingParser
+        self.cache = None         # Cache.Cache for compiled modules
+        self.module = None        # the last Module prepared, for inspection
+        self.namespace = {}
+        self.helpers = self.make_helpers()
+        self.namespace['__builtins__'] = self.helpers
+
+    def make_helpers(self):
+        funcs = self.funcs
+        memo = self.memo
+        budget = self.budget
+        convert = Runtime.convert
+
+        def arity(name, count, args):
+            raise TypeError(f"{name}() expects {count} args, got {len(args)}")
+
+        def redeclared(name):
+            raise NameError(f"Variable '{name}' already declared")
+
+        def returned(value):
+            self.returning = True
+            return value
+
+        def call(name, *args):
+            return funcs[name](*args)
+
+        # Calls of a pure function: the converted arguments are the cache key
+        def memoized(name, body, param_types):
+            def run_memoized(*args):
+                if len(args) != len(param_types):
+                    arity(name, len(param_types), args)
+                args = tuple(map(convert, param_types, args))
+                if budget is None:
+                    return memo.call(name, args, lambda: body(*args))
+                budget.enter()
+                try:
+                    return memo.call(name, args, lambda: body(*args))
+                finally:
+                    budget.depth -= 1
+            return run_memoized
+
+        return {
+            'env': self,
+            'funcs': funcs,
+            'types': self.types,
+            'namespace': self.namespace,
+            'memo': memo,
+            'budget': budget,
+            'check_value': budget.check_value if budget is not None else None,
+            'convert': convert,
+            'check_decl': Runtime.check_decl,
+            'add': Runtime.add,
+            'sub': Runtime.sub,
+            'mul': Runtime.mul,
+            'div': Runtime.div,
+            'neg': Runtime.neg,
+            'make_array': Runtime.make_array,
+            'to_int': Runtime.to_int,
+            'to_string': Runtime.to_string,
+            'to_float': Runtime.to_float,
+            'arity': arity,
+            'redeclared': redeclared,
+            'returned': returned,
+            'call': call,
+            'memoized': memoized,
+            'int': int,
+            'float': float,
+            'str': str,
+            'bool': bool,
+            'IntArray': Runtime.IntArray,
+            'FloatArray': Runtime.FloatArray,
+            'type': type,
+            'len': len,
+            'locals': locals,
+        }
+
+    @property
+    def vars(self):
+        namespace = self.namespace
+        return {name: (namespace[name + '_'], type_str)
+                for name, type_str in self.types.items() if name + '_' in namespace}
+
+    def translate(self, node):
+        if self.memo is not None:
+            self.memo.analyze(node)
+        statements = node if isinstance(node, list) else [node]
+        types = Checker.check(statements, GlobalTypes(self.namespace, self.types)).types
+        return Transpiler(self, types).module(statements)
+
+    def evaluate(self, node):
+        return self.prepare(node)()
+
+    # Translates and compiles node once; the returned function runs it
+    # against whatever the globals hold at the time, so it can be called
+    # again after reset()
+    def prepare(self, node):
+        module = self.module = self.translate(node)
+        if self.cache is not None:
+            code = self.cache.compile_module(self.filename, module)
+        else:
+            code = compile(module.source, module.filename, 'exec')
+        namespace = self.namespace
+        exec(code, namespace)
+        program = namespace.pop('program')
+
+        def run_program():
+            if self.budget is not None:
+                self.budget.start()
+            self.returning = False
+            try:
+                return program()
+            except NameError as e:
+                name = undefined_name(e)
+                if name is None:
+                    self.locate(e, module)
+                    raise
+                error = NameError(f"Undefined variable: {name}")
+                self.locate(error, module, e.__traceback__)
+                raise error.with_traceback(e.__traceback__) from None
+            except Exception as e:
+                self.locate(e, module)
+                raise
+        return run_program
+
+    # Notes the .mylang line error came from, when the module knows it
+    def locate(self, error, module, traceback=None):
+        line = module.line_of(traceback or error.__traceback__)
+        if line is not None:
+            error.add_note(f"at {self.filename}:{line}")
+
+    # Forgets every global and function. Compiled modules stay valid: they
+    # hold on to the globals dict and function table, which are emptied in
+    # place.
+    def reset(self):
+        self.namespace.clear()
+        self.namespace['__builtins__'] = self.helpers
+        self.types.clear()
+        self.funcs.clear()
+        self.returning = False
+
+    # Sets global name, declaring it if needed, without any type checks
+    def bind(self, name, value, type_str):
+        self.namespace[name + '_'] = value
+        self.types[name] = type_str
@@ -0,0 +1,461 @@
+import Bytecode
+import Checker
+import Output
+import Resolver
+import Runtime
+from Bytecode import (
+    LOAD_CONST, LOAD_LOCAL, STORE_LOCAL, DECL_LOCAL, LOAD_GLOBAL, STORE_GLOBAL,
+    DECL_GLOBAL, POP, DUP, ADD, SUB, MUL, DIV, NEG, NOT, JUMP_IF_TRUE_OR_POP,
+    JUMP_IF_FALSE_OR_POP, EQ, NE, LE, GE, LT, GT, JUMP, JUMP_IF_FALSE, CALL,
+    CALL_BUILTIN, MAKE_FUNCTION,
+    RETURN_VALUE, LOAD_OUTER, STORE_OUTER, STORE_LOCAL_TYPED, STORE_GLOBAL_TYPED,
+    INCR_LOCAL, INCR_GLOBAL, LOAD_LOCAL_STRING, LOAD_GLOBAL_STRING, APPEND_LOCAL,
+    APPEND_GLOBAL, BUILD_ARRAY, INDEX, STORE_INDEX, LOOP_IF_FALSE,
+)
+from Resolver import UNSET
+
+# === Stack VM ===
+# Executes Bytecode.Code in a single dispatch loop. User-level calls push a
+# Frame instead of recursing in Python. Names are resolved to slots at
+# compile time: locals index the current frame, globals the machine's global
+# slots, and names of enclosing functions walk Frame.parent. A local or
+# outer slot that is still UNSET sends the instruction to find(), which
+# looks the name up where the reference would.
+
+
+class Frame:
+    __slots__ = ('code', 'pc', 'slots', 'types', 'stack', 'parent')
+
+    def __init__(self, code, slots, types, parent=None):
+        self.code = code
+        self.pc = 0
+        self.slots = slots
+        self.types = types
+        self.stack = []
+        self.parent = parent
+
+
+class Function:
+    __slots__ = ('code', 'parent')
+
+    def __init__(self, code, parent):
+        self.code = code
+        self.parent = parent
+
+    def __repr__(self):
+        return f"<function {self.code.name}>"
+
+
+class Machine:
+    def __init__(self, budget=None):
+        self.global_scope = Resolver.Scope()
+        self.globals = []
+        self.global_types = []
+        self.funcs = {}
+        self.output = Output.Output(buffer_size=0)  # where print writes
+        self.budget = budget  # Budget.Budget limiting each evaluate()
+        self.returning = False  # the last evaluate() ended in a top-level return
+
+    # Globals as {name: (value, type)}, the shape Environment.vars uses
+    @property
+    def vars(self):
+        return {name: (self.globals[slot], self.global_types[slot])
+                for name, slot in self.global_scope.slots.items()
+                if slot < len(self.globals) and self.globals[slot] is not UNSET}
+
+    def compile(self, node):
+        statements = node if isinstance(node, list) else [node]
+        global_types = Resolver.SlotTypes(self.global_scope, self.globals, self.global_types)
+        types = Checker.check(statements, global_types).types
+        return Bytecode.BytecodeCompiler(self.global_scope, types).compile_program(statements)
+
+    def evaluate(self, node):
+        return self.execute(self.compile(node))
+
+    # Same interface as CompiledEnvironment.prepare
+    def prepare(self, node):
+        code = self.compile(node)
+        return lambda: self.execute(code)
+
+    def reset(self):
+        self.globals[:] = [UNSET] * len(self.globals)
+        self.global_types[:] = [None] * len(self.global_types)
+        self.funcs.clear()
+        self.returning = False
+
+    def bind(self, name, value, type_str):
+        slot = self.global_scope.declare(name)
+        missing = slot + 1 - len(self.globals)
+        if missing > 0:
+            self.globals.extend([UNSET] * missing)
+            self.global_types.extend([None] * missing)
+        self.globals[slot] = value
+        self.global_types[slot] = type_str
+
+    # The variable a name refers to while the slot it resolved to is UNSET:
+    # the first slot in fallback (see BytecodeCompiler.locate) whose
+    # declaration has run, as (slots, types, slot)
+    def find(self, frame, name, fallback):
+        for depth, slot in fallback:
+            if depth is None:
+                slots, types = self.globals, self.global_types
+            else:
+                target = frame
+                for _ in range(depth):
+                    target = target.parent
+                slots, types = target.slots, target.types
+            if slots[slot] is not UNSET:
+                return slots, types, slot
+        raise NameError(f"Undefined variable: {name}")
+
+    def disassemble(self, node):
+        code = self.compile(node)
+        return code.disassemble(self.global_scope.names)
+
+    def execute(self, code):
+        self.returning = False
+        global_names = self.global_scope.names
+        missing = len(global_names) - len(self.globals)
+        if missing > 0:
+            self.globals.extend([UNSET] * missing)
+            self.global_types.extend([None] * missing)
+        glob = self.globals
+        glob_types = self.global_types
+        find = self.find
+        funcs = self.funcs
+        convert = Runtime.convert
+        converters = Runtime.CONVERTERS
+        check_decl = Runtime.check_decl
+        builtin_print = Runtime.builtin_print
+        builder = Runtime.StringBuilder
+        compound = Runtime.compound
+        output = self.output
+        budget = self.budget
+        array_builtins = budget.array_builtins if budget is not None else Runtime.ARRAY_BUILTINS
+        sized = budget is not None and budget.value_size is not None
+        if budget is not None:
+            budget.start()
+
+        frames = []
+        frame = Frame(code, [], [])
+        ops = code.ops
+        consts = code.consts
+        slots = frame.slots
+        types = frame.types
+        stack = frame.stack
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+
+        while True:
+            op = ops[pc]
+            arg = ops[pc + 1]
+            pc += 2
+
+            if op == LOAD_LOCAL:
+                value = slots[arg]
+                if value is UNSET:
+                    target, _, slot = find(frame, frame.code.local_names[arg],
+                                           frame.code.fallbacks[arg])
+                    value = target[slot]
+                push(value)
+            elif op == LOAD_CONST:
+                push(consts[arg])
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == STORE_LOCAL:
+                if slots[arg] is UNSET:
+                    target, target_types, slot = find(
+                        frame, frame.code.local_names[arg], frame.code.fallbacks[arg])
+                    target[slot] = convert(target_types[slot], pop())
+                    continue
+                value = pop()
+                if type(value) is not converters.get(types[arg]):
+                    value = convert(types[arg], value)
+                slots[arg] = value
+            elif op == STORE_LOCAL_TYPED:
+                if slots[arg] is UNSET:
+                    target, _, slot = find(frame, frame.code.local_names[arg],
+                                           frame.code.fallbacks[arg])
+                    target[slot] = pop()
+                    continue
+                slots[arg] = pop()
+            elif op == INCR_LOCAL:
+                slot, op_str, right = frame.code.updates[arg]
+                value = slots[slot]
+                # An int slot always holds its declared type
+                if type(value) is int and type(right) is int:
+                    slots[slot] = value + right if op_str == '+' else value - right
+                else:
+                    target, target_types = slots, types
+                    if value is UNSET:
+                        target, target_types, slot = find(
+                            frame, frame.code.local_names[slot], frame.code.fallbacks[slot])
+                        value = target[slot]
+                    target[slot] = compound(target_types[slot], op_str, value, right)
+                    if sized:
+                        budget.check_value(target[slot])
+            elif op == INCR_GLOBAL:
+                slot, op_str, right = frame.code.updates[arg]
+                value = glob[slot]
+                if type(value) is int and type(right) is int:
+                    glob[slot] = value + right if op_str == '+' else value - right
+                else:
+                    if value is UNSET:
+                        raise NameError(f"Undefined variable: {global_names[slot]}")
+                    glob[slot] = compound(glob_types[slot], op_str, value, right)
+                    if sized:
+                        budget.check_value(glob[slot])
+            elif op == LOAD_GLOBAL:
+                value = glob[arg]
+                if value is UNSET:
+                    raise NameError(f"Undefined variable: {global_names[arg]}")
+                push(value)
+            elif op == APPEND_LOCAL:
+                right = pop()
+                value = pop()
+                target, target_types, slot = slots, types, arg
+                if slots[arg] is UNSET:
+                    # value came from the variable the load fell back to
+                    target, target_types, slot = find(
+                        frame, frame.code.local_names[arg], frame.code.fallbacks[arg])
+                if type(value) is type(right) and (type(value) is int or type(value) is float):
+                    target[slot] = value + right
+                else:
+                    target[slot] = compound(target_types[slot], '+', value, right)
+                if sized:
+                    budget.check_value(target[slot])
+            elif op == APPEND_GLOBAL:
+                right = pop()
+                value = pop()
+                if type(value) is type(right) and (type(value) is int or type(value) is float):
+                    glob[arg] = value + right
+                else:
+                    glob[arg] = compound(glob_types[arg], '+', value, right)
+                if sized:
+                    budget.check_value(glob[arg])
+            elif op == STORE_GLOBAL:
+                if glob[arg] is UNSET:
+                    raise NameError(f"Undefined variable: {global_names[arg]}")
+                glob[arg] = convert(glob_types[arg], pop())
+            elif op == STORE_GLOBAL_TYPED:
+                if glob[arg] is UNSET:
+                    raise NameError(f"Undefined variable: {global_names[arg]}")
+                glob[arg] = pop()
+            elif op == JUMP:
+                pc = arg
+            elif op == LOOP_IF_FALSE:
+                # One step per iteration, counted before the body like the tree engine
+                if not pop():
+                    pc = arg
+                elif budget is not None:
+                    budget.countdown -= 1
+                    if budget.countdown <= 0:
+                        budget.check()
+            elif op == ADD:
+                right = pop()
+                left = stack[-1]
+                if type(left) is type(right):
+                    stack[-1] = left + right
+                else:
+                    stack[-1] = Runtime.add(left, right)
+                if sized:
+                    budget.check_value(stack[-1])
+            elif op == LOAD_LOCAL_STRING:
+                value = slots[arg]
+                if value is UNSET:
+                    target, _, slot = find(frame, frame.code.local_names[arg],
+                                           frame.code.fallbacks[arg])
+                    value = target[slot]
+                if type(value) is builder:
+                    value = str(value)
+                push(value)
+            elif op == LOAD_GLOBAL_STRING:
+                value = glob[arg]
+                if value is UNSET:
+                    raise NameError(f"Undefined variable: {global_names[arg]}")
+                if type(value) is builder:
+                    value = str(value)
+                push(value)
+            elif op == SUB:
+                right = pop()
+                left = stack[-1]
+                if type(left) is type(right) and (type(left) is int or type(left) is float):
+                    stack[-1] = left - right
+                else:
+                    stack[-1] = Runtime.sub(left, right)
+            elif op == MUL:
+                right = pop()
+                left = stack[-1]
+                if type(left) is type(right) and (type(left) is int or type(left) is float):
+                    stack[-1] = left * right
+                else:
+                    stack[-1] = Runtime.mul(left, right)
+                if sized:
+                    budget.check_value(stack[-1])
+            elif op == DIV:
+                right = pop()
+                stack[-1] = Runtime.div(stack[-1], right)
+            elif op == LE:
+                right = pop()
+                stack[-1] = stack[-1] <= right
+            elif op == LT:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == GE:
+                right = pop()
+                stack[-1] = stack[-1] >= right
+            elif op == GT:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == EQ:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == NE:
+                right = pop()
+                stack[-1] = stack[-1] != right
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1]:
+                    pop()
+                else:
+                    pc = arg
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = arg
+                else:
+                    pop()
+            elif op == NOT:
+                stack[-1] = not stack[-1]
+            elif op == NEG:
+                stack[-1] = Runtime.neg(stack[-1])
+            elif op == INDEX:
+                index = pop()
+                stack[-1] = stack[-1][index]
+            elif op == STORE_INDEX:
+                value = pop()
+                index = pop()
+                pop()[index] = value
+                if arg:
+                    push(value)
+            elif op == POP:
+                pop()
+            elif op == DUP:
+                push(stack[-1])
+            elif op == CALL_BUILTIN:
+                builtin, argc = frame.code.calls[arg]
+                if argc:
+                    args = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    args = ()
+                if builtin is builtin_print:
+                    output.print(args)
+                    push(None)
+                else:
+                    push(builtin(*args))
+            elif op == CALL:
+                func_name, argc = frame.code.calls[arg]
+                if argc:
+                    args = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    args = []
+                callee = funcs.get(func_name)
+                if callee is None:
+                    # Array builtins give way to user functions of the same name
+                    builtin = array_builtins.get(func_name)
+                    if builtin is None:
+                        raise NameError(f"Unknown function: {func_name}")
+                    push(builtin(*args))
+                    continue
+                callee_code = callee.code
+                params = callee_code.params
+                if argc != len(params):
+                    raise TypeError(
+                        f"{func_name}() expects {len(params)} args, got {argc}")
+                if budget is not None:
+                    budget.enter()
+                nlocals = len(callee_code.local_names)
+                new_slots = [UNSET] * nlocals
+                new_types = [None] * nlocals
+                for (slot, param_type), value in zip(params, args):
+                    new_slots[slot] = convert(param_type, value)
+                    new_types[slot] = param_type
+                frame.pc = pc
+                frames.append(frame)
+                frame = Frame(callee_code, new_slots, new_types, callee.parent)
+                ops = callee_code.ops
+                consts = callee_code.consts
+                slots = new_slots
+                types = new_types
+                stack = frame.stack
+                push = stack.append
+                pop = stack.pop
+                pc = 0
+            elif op == RETURN_VALUE:
+                result = pop()
+                return_type = frame.code.return_type
+                if return_type:
+                    result = convert(return_type, result)
+                if not frames:
+                    self.returning = arg == 1
+                    return result
+                if budget is not None:
+                    budget.leave()
+                frame = frames.pop()
+                ops = frame.code.ops
+                consts = frame.code.consts
+                slots = frame.slots
+                types = frame.types
+                stack = frame.stack
+                push = stack.append
+                pop = stack.pop
+                pc = frame.pc
+                push(result)
+            elif op == DECL_LOCAL:
+                slot, type_str = frame.code.decls[arg]
+                if slots[slot] is not UNSET:
+                    raise NameError(
+                        f"Variable '{frame.code.local_names[slot]}' already declared")
+                value = check_decl(type_str, pop())
+                slots[slot] = convert(type_str, value)
+                types[slot] = type_str
+            elif op == DECL_GLOBAL:
+                slot, type_str = frame.code.decls[arg]
+                value = pop()
+                if glob[slot] is not UNSET:
+                    raise NameError(
+                        f"Variable '{global_names[slot]}' already declared")
+                check_decl(type_str, value)
+                glob[slot] = convert(type_str, value)
+                glob_types[slot] = type_str
+            elif op == MAKE_FUNCTION:
+                callee = consts[arg]
+                funcs[callee.name] = Function(callee, frame)
+            elif op == BUILD_ARRAY:
+                if arg:
+                    items = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    items = []
+                value = Runtime.make_array(items)
+                if sized:
+                    budget.check_value(value)
+                push(value)
+            elif op == LOAD_OUTER or op == STORE_OUTER:
+                depth, slot, fallback = frame.code.outers[arg]
+                target = frame
+                for _ in range(depth):
+                    target = target.parent
+                target_slots, target_types = target.slots, target.types
+                if target_slots[slot] is UNSET:
+                    target_slots, target_types, slot = find(
+                        frame, target.code.local_names[slot], fallback)
+                if op == LOAD_OUTER:
+                    value = target_slots[slot]
+                    push(str(value) if type(value) is builder else value)
+                else:
+                    target_slots[slot] = convert(target_types[slot], pop())
+            else:
+                raise RuntimeError(f"Bad opcode {op} at {pc - 2}")
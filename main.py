@@ -1,21 +1,40 @@
+import argparse
 import sys
 
+import Batch
+import Bench
+import Budget
+import Cache
+import Checker
+import Conformance
+import Embed
 import Lexer
+import Memo
 import Parser
-import Evaluator
+import Optimizer
+import Output
+import Profiler
+import Session
+import Transpiler
 
+ENGINES = Embed.ENGINES
 
 
-def run(code, env):
-    tokens = []
+def run(code, env, parse=Cache.parse_source, optimize=False):
     ast = []
     try:
-        tokens = Lexer.tokenize(code)
-        parser = Parser.Parser(tokens)
-        ast = parser.parse()
+        ast = parse(code)
+        if optimize:
+            ast = Optimizer.optimize(ast)
         env.evaluate(ast)
     except Exception as e:
+        # Whatever the program printed comes before the report
+        env.output.flush()
         print('\033[101m\33[30m' + f" {type(e).__name__}: {e} " + '\033[0m')
+        for note in getattr(e, '__notes__', ()):
+            print('\033[91m' + note + '\033[0m')
+        # The parser streams tokens; only materialize them for the report
+        tokens = Lexer.tokenize(code)
         if tokens:
             print('\033[91m'+ f"Tokens: {"[\n" + ",\n".join(f"{i}:    {repr(t)}" for i, t in enumerate(tokens)) + "\n]"}" +'\033[0m')
         if ast:
@@ -24,28 +43,262 @@ def run(code, env):
         if len(env.funcs) > 0:print('\033[93m'+ f"Global Functions: {env.funcs}" + '\033[0m')
         sys.exit(1)
 
-def console_mode():
-    env = Evaluator.Environment()
+# Parses and executes one top-level statement at a time straight from the
+# file, so memory stays bounded no matter how large the source is. Earlier
+# statements run before a later syntax error is found.
+def run_stream(file, env, optimize=False):
+    stmt = None
+    try:
+        parser = Parser.Parser(Lexer.iter_file_tokens(file))
+        for stmt in parser.statements():
+            env.evaluate(Optimizer.optimize([stmt]) if optimize else [stmt])
+            if env.returning:
+                break
+    except Exception as e:
+        env.output.flush()
+        print('\033[101m\33[30m' + f" {type(e).__name__}: {e} " + '\033[0m')
+        if stmt is not None:
+            print('\033[91m'+ f"Last statement: {stmt!r}" + '\033[0m')
+        if len(env.vars) > 0: print('\033[93m'+ f"Global Variables: {env.vars}" + '\033[0m')
+        if len(env.funcs) > 0:print('\033[93m'+ f"Global Functions: {env.funcs}" + '\033[0m')
+        sys.exit(1)
+
+# Errors are reported and the session carries on with its state intact
+def console_mode(env, optimize=False):
+    session = Session.Session(env, optimize)
     while True:
-        code = input("> ")
-        if code.strip().lower() == 'exit':
+        try:
+            line = input("... " if session.pending else "> ")
+        except EOFError:
             break
-        if code.strip():
-            run(code, env)
+        except KeyboardInterrupt:
+            print()
+            session.reset()
+            continue
+        if not session.pending and line.strip().lower() == 'exit':
+            break
+        try:
+            session.push(line)
+        except (Exception, KeyboardInterrupt) as e:
+            env.output.flush()
+            print('\033[101m\33[30m' + f" {type(e).__name__}: {e} " + '\033[0m')
+        else:
+            env.output.flush()
+
+def file_mode(filepath, env, stream=False, cache=None, optimize=False):
+    try:
+        with open(filepath, 'r') as file:
+            if stream:
+                run_stream(file, env, optimize)
+            else:
+                code = file.read()
+                if isinstance(env, Transpiler.PythonEnvironment):
+                    # Parsed with source lines, which the generated module
+                    # keeps; both are cached, as is its compiled code
+                    env.filename = filepath
+                    env.locations = {}
+                    env.cache = cache
+                    run(code, env, lambda code: parse_located(
+                        code, env.locations, optimize, cache, filepath))
+                elif cache is not None:
+                    run(code, env, lambda code: cache.parse(filepath, code), optimize)
+                else:
+                    run(code, env, optimize=optimize)
+    except FileNotFoundError:
+        print(f"File not found: {filepath}")
+        sys.exit(1)
+
+def parse_located(code, locations, optimize=False, cache=None, filepath=None):
+    if cache is not None:
+        ast = cache.parse_located(filepath, code, locations)
+    else:
+        ast = Parser.LocatingParser(Lexer.iter_tokens(code), locations).parse()
+    return Optimizer.optimize(ast, locations) if optimize else ast
 
-def file_mode():
-    env = Evaluator.Environment()
-    filepath = sys.argv[1]
+# Prints the Python module the python engine runs for a file
+def emit_python(filepath, env, optimize=False):
     try:
         with open(filepath, 'r') as file:
             code = file.read()
-            run(code, env)
+        env.filename = filepath
+        env.locations = {}
+        module = env.translate(parse_located(code, env.locations, optimize))
     except FileNotFoundError:
         print(f"File not found: {filepath}")
         sys.exit(1)
+    except (SyntaxError, RecursionError) as e:
+        print('\033[101m\33[30m' + f" {type(e).__name__}: {e} " + '\033[0m')
+        sys.exit(1)
+    print(module.source, end='')
+
+# Reports operations that are certain to fail before anything runs. Syntax
+# errors and missing files are left to the normal run to report. Branches
+# with a constant false condition never run, so they are dropped first, the
+# way -O drops them.
+def typecheck_file(filepath, env):
+    try:
+        with open(filepath, 'r') as file:
+            code = file.read()
+        locations = {}
+        ast = Parser.LocatingParser(Lexer.iter_tokens(code), locations).parse()
+    except (OSError, SyntaxError):
+        return
+    ast = Optimizer.optimize(ast, locations)
+    global_types = {name: type_str for name, (_, type_str) in env.vars.items()}
+    errors = Checker.check(ast, global_types).errors
+    for error in errors:
+        line = locations.get(id(error.statement), '?')
+        print('\033[91m' + f"{filepath}:{line}: {error.kind}: {error.message}" + '\033[0m')
+    if errors:
+        sys.exit(1)
+
+# Always re-parses so the lexer and parser show up in the profile
+def profile_mode(filepath, env, profiler, optimize=False):
+    try:
+        with open(filepath, 'r') as file:
+            code = file.read()
+    except FileNotFoundError:
+        print(f"File not found: {filepath}")
+        sys.exit(1)
+    run(code, env, lambda code: profiler.parse(code, optimize))
 
 if __name__ == '__main__':
-    if len(sys.argv) > 1:
-        file_mode()
-    else:
-        console_mode()
+    arg_parser = argparse.ArgumentParser(description='Run a mylang program')
+    arg_parser.add_argument('file', nargs='?', help='program to run; starts a console when omitted')
+    arg_parser.add_argument('--engine', choices=ENGINES, default='closure',
+                            help='execution engine (tree is the reference evaluator; vm runs '
+                                 'without Python recursion, so script depth is only bounded by memory; '
+                                 'python translates the program to Python and runs it with CPython)')
+    arg_parser.add_argument('--emit-python', action='store_true',
+                            help='print the Python module the python engine generates for the file '
+                                 'instead of running it')
+    arg_parser.add_argument('--stream', action='store_true',
+                            help='lex, parse and run the file one top-level statement at a time')
+    arg_parser.add_argument('--no-cache', action='store_true',
+                            help=f'always re-parse instead of using {Cache.CACHE_DIR_NAME}')
+    arg_parser.add_argument('--cache-dir', help='keep parsed programs in this directory')
+    arg_parser.add_argument('--cache-stats', action='store_true',
+                            help='report cache hits and misses on stderr')
+    arg_parser.add_argument('-O', '--optimize', action='store_true',
+                            help='fold constants and drop dead branches before running')
+    arg_parser.add_argument('--typecheck', action='store_true',
+                            help='report operations certain to fail with a type error when '
+                                 'they run, and do not run if there are any; branches that '
+                                 'can never run are skipped')
+    arg_parser.add_argument('--profile', action='store_true',
+                            help='report time per phase, function and source line on stderr')
+    arg_parser.add_argument('--profile-out', metavar='FILE',
+                            help='with --profile, write collapsed stacks for flamegraph tools')
+    arg_parser.add_argument('--memoize', action='store_true',
+                            help='cache results of side-effect-free functions (all engines but vm)')
+    arg_parser.add_argument('--memo-size', type=int, default=Memo.DEFAULT_SIZE,
+                            help='cached results kept per function')
+    arg_parser.add_argument('--memo-stats', action='store_true',
+                            help='report memo hits and misses on stderr')
+    arg_parser.add_argument('--max-steps', type=int, metavar='N',
+                            help='stop after N loop iterations and function calls')
+    arg_parser.add_argument('--max-seconds', type=float, metavar='S',
+                            help='stop after S seconds of wall-clock time')
+    arg_parser.add_argument('--max-value-size', type=int, metavar='N',
+                            help="stop when a string longer than N characters, an int "
+                                 "larger than N bytes or an array of more than N "
+                                 "elements is built")
+    arg_parser.add_argument('--max-depth', type=int, metavar='N',
+                            help='stop when user function calls nest deeper than N')
+    arg_parser.add_argument('--output', metavar='FILE',
+                            help="write the program's print output to FILE instead of stdout")
+    arg_parser.add_argument('--buffer-size', type=int, metavar='N',
+                            help='characters of print output collected before each write '
+                                 f'(default {Output.DEFAULT_BUFFER_SIZE}, or 0 on a terminal: '
+                                 'write every print straight away)')
+    arg_parser.add_argument('--bench', nargs='*', metavar='PATH',
+                            help='time lex, parse and evaluate of these programs '
+                                 '(default: the benchmarks directory and generated sources)')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    arg_parser.add_argument('--warmup', type=int, default=1, help='untimed runs per benchmark')
+    arg_parser.add_argument('--batch', nargs='+', metavar='PATH',
+                            help='run every .mylang file in these directories (and these files) '
+                                 'over a pool of worker processes and print one report')
+    arg_parser.add_argument('--conformance', nargs='*', metavar='PATH',
+                            help='run these programs (default: the conformance directory) on every '
+                                 'engine, with and without -O, and compare what they print with '
+                                 'their .out files')
+    arg_parser.add_argument('-j', '--jobs', type=int,
+                            help='worker processes for --batch (default: one per CPU)')
+    arg_parser.add_argument('--json', action='store_true',
+                            help='print benchmark or batch results as JSON')
+    args = arg_parser.parse_args()
+    if args.profile and (args.engine not in Profiler.ENGINES or args.stream or not args.file):
+        arg_parser.error('--profile needs a file and the closure or tree engine, without --stream')
+    if args.memoize and args.engine == 'vm':
+        arg_parser.error('--memoize needs the closure, tree or python engine')
+    if args.emit_python and (args.engine != 'python' or not args.file):
+        arg_parser.error('--emit-python needs a file and the python engine')
+    if args.batch and (args.file or args.bench is not None or args.profile
+                       or args.memoize or args.stream or args.output):
+        arg_parser.error('--batch cannot be combined with a file, --bench, --profile, '
+                         '--memoize, --stream or --output')
+    memo = Memo.Memoizer(max(args.memo_size, 1)) if args.memoize else None
+    limits = {name: value for name, value in (
+        ('steps', args.max_steps), ('seconds', args.max_seconds),
+        ('value_size', args.max_value_size), ('depth', args.max_depth)) if value is not None}
+    budget = Budget.Budget(**limits) if limits else None
+    options = {}
+    if memo is not None:
+        options['memo'] = memo
+    if budget is not None:
+        options['budget'] = budget
+    env = ENGINES[args.engine](**options)
+    try:
+        target = open(args.output, 'w') if args.output else None
+    except OSError as e:
+        arg_parser.error(f"cannot write --output: {e}")
+    buffer_size = args.buffer_size
+    if buffer_size is None:
+        buffer_size = 0 if (target or sys.stdout).isatty() else Output.DEFAULT_BUFFER_SIZE
+    output = env.output = Output.Output(target, buffer_size)
+    try:
+        if args.typecheck and args.file and args.bench is None:
+            typecheck_file(args.file, env)
+        if args.emit_python:
+            emit_python(args.file, env, args.optimize)
+        elif args.batch:
+            report = Batch.main(args.batch, args.jobs, args.engine, args.optimize,
+                                not args.no_cache, args.cache_dir, args.json, limits)
+            if report['failed']:
+                sys.exit(1)
+        elif args.conformance is not None:
+            paths = args.conformance + ([args.file] if args.file else [])
+            if Conformance.main(paths):
+                sys.exit(1)
+        elif args.bench is not None:
+            paths = args.bench + ([args.file] if args.file else [])
+            Bench.main(paths, ENGINES[args.engine], args.engine, max(args.repeat, 1),
+                       max(args.warmup, 0), args.optimize, args.json)
+        elif args.profile:
+            profiler = Profiler.Profiler()
+            env = Profiler.ENGINES[args.engine](profiler, memo, budget)
+            env.output = output
+            try:
+                profile_mode(args.file, env, profiler, args.optimize)
+            finally:
+                output.flush()
+                print(profiler.report(), file=sys.stderr)
+                if args.profile_out:
+                    profiler.write_collapsed(args.profile_out)
+        elif args.file:
+            cache = None if args.no_cache else Cache.Cache(args.cache_dir)
+            try:
+                file_mode(args.file, env, args.stream, cache, args.optimize)
+            finally:
+                output.flush()
+                if cache is not None and args.cache_stats:
+                    print(cache.report(), file=sys.stderr)
+                if memo is not None and args.memo_stats:
+                    print(memo.report(), file=sys.stderr)
+        else:
+            console_mode(env, args.optimize)
+    finally:
+        output.flush()
+        if target is not None:
+            target.close()